@@ -23,12 +23,16 @@ from protos.countries import CountryCode
 from protos import objects
 from keys import blockchainid
 from keys.keychain import KeyChain
+from keys.pgpcache import PGPCache
+from keys.sigcache import SignatureCache
 from dht.utils import digest
 from market.profile import Profile
 from market.contracts import Contract, check_order_for_payment
 from market.btcprice import BtcPrice
+from market.audit import ACTION_IDS
 from net.upnp import PortMapper
 from api.utils import sanitize_html
+from log import Logger
 
 DEFAULT_RECORDS_COUNT = 20
 DEFAULT_RECORDS_OFFSET = 0
@@ -63,11 +67,12 @@ class OpenBazaarAPI(APIResource):
         self.kserver = kserver
         self.protocol = protocol
         self.db = mserver.db
-        self.keychain = KeyChain(self.db)
+        self.keychain = KeyChain.get(self.db)
         self.username = username
         self.password = password
         self.authenticated_sessions = authenticated_sessions
         self.failed_login_attempts = {}
+        self.log = Logger(system=self)
         task.LoopingCall(self._keep_sessions_alive).start(890, False)
         APIResource.__init__(self)
 
@@ -75,6 +80,24 @@ class OpenBazaarAPI(APIResource):
         for session in self.authenticated_sessions:
             session.touch()
 
+    @staticmethod
+    def _bad_request(request, reason):
+        request.setResponseCode(http.BAD_REQUEST)
+        request.setHeader('content-type', "application/json")
+        request.write(json.dumps({"success": False, "reason": reason}, indent=4))
+        request.finish()
+        return server.NOT_DONE_YET
+
+    def _request_failed(self, request):
+        """Returns an errback which answers the request with a 500 error."""
+        def failed(failure):
+            self.log.error("unable to serve %s: %s" % (request.path, failure.getErrorMessage()))
+            request.setResponseCode(http.INTERNAL_SERVER_ERROR)
+            request.setHeader('content-type', "application/json")
+            request.write(json.dumps({"success": False, "reason": failure.getErrorMessage()}, indent=4))
+            request.finish()
+        return failed
+
     def _failed_login(self, host):
         def remove_ban(host):
             del self.failed_login_attempts[host]
@@ -286,31 +309,34 @@ class OpenBazaarAPI(APIResource):
                     response["followers"].append(follower_json)
                 if followers[1] is not None:
                     response["count"] = followers[1]
+                if followers[2] is not None:
+                    response["cursor"] = str(followers[2])
                 request.setHeader('content-type', "application/json")
                 request.write(json.dumps(sanitize_html(response), indent=4))
                 request.finish()
             else:
                 request.write(json.dumps({}))
                 request.finish()
-        start = 0
-        if "start" in request.args:
-            start = int(request.args["start"][0])
+        try:
+            start = int(request.args["start"][0]) if "start" in request.args else 0
+            cursor = int(request.args["cursor"][0]) if request.args.get("cursor", [""])[0] else None
+        except ValueError:
+            return self._bad_request(request, "start and cursor must be integers")
         if "guid" in request.args:
             def get_node(node):
                 if node is not None:
-                    self.mserver.get_followers(node, start).addCallback(parse_followers)
+                    self.mserver.get_followers(node, start, cursor).addCallback(parse_followers)
                 else:
                     request.write(json.dumps({}))
                     request.finish()
             self.kserver.resolve(unhexlify(request.args["guid"][0])).addCallback(get_node)
         else:
-            ser = self.db.follow.get_followers(start)
-            if ser[0] is not None:
+            def parse(ser):
                 f = objects.Followers()
                 f.ParseFromString(ser[0])
-                parse_followers((f, ser[1]))
-            else:
-                parse_followers((None, 0))
+                parse_followers((f, ser[1], ser[2]))
+            d = self.db.deferred.follow.get_followers(start, cursor)
+            d.addCallback(parse).addErrback(self._request_failed(request))
         return server.NOT_DONE_YET
 
     @GET('^/api/v1/get_following')
@@ -389,8 +415,7 @@ class OpenBazaarAPI(APIResource):
     @authenticated
     def update_profile(self, request):
         try:
-            p = Profile(self.db)
-            can_update_profile = (p.get().HasField("guid_key") or
+            can_update_profile = (Profile(self.db).get().HasField("guid_key") or
                                   ("name" in request.args and
                                    "location" in request.args))
             if not can_update_profile:
@@ -419,43 +444,54 @@ class OpenBazaarAPI(APIResource):
                 u.about = request.args["about"][0].decode("utf8")
             if "short_description" in request.args:
                 u.short_description = request.args["short_description"][0].decode("utf8")
-            if "nsfw" in request.args:
-                p.profile.nsfw = str_to_bool(request.args["nsfw"][0])
-            if "vendor" in request.args:
-                p.profile.vendor = str_to_bool(request.args["vendor"][0])
-            if "moderator" in request.args:
-                p.profile.moderator = str_to_bool(request.args["moderator"][0])
-            if "moderation_fee" in request.args:
-                p.profile.moderation_fee = round(float(request.args["moderation_fee"][0]), 2)
             if "website" in request.args:
                 u.website = request.args["website"][0].decode("utf8")
             if "email" in request.args:
                 u.email = request.args["email"][0].decode("utf8")
-            if "primary_color" in request.args:
-                p.profile.primary_color = int(request.args["primary_color"][0])
-            if "secondary_color" in request.args:
-                p.profile.secondary_color = int(request.args["secondary_color"][0])
-            if "background_color" in request.args:
-                p.profile.background_color = int(request.args["background_color"][0])
-            if "text_color" in request.args:
-                p.profile.text_color = int(request.args["text_color"][0])
             if "avatar" in request.args:
                 u.avatar_hash = unhexlify(request.args["avatar"][0])
             if "header" in request.args:
                 u.header_hash = unhexlify(request.args["header"][0])
+
+            def save(_):
+                try:
+                    # the profile is read now, after the pgp key (if any) was verified and added
+                    p = Profile(self.db)
+                    if "nsfw" in request.args:
+                        p.profile.nsfw = str_to_bool(request.args["nsfw"][0])
+                    if "vendor" in request.args:
+                        p.profile.vendor = str_to_bool(request.args["vendor"][0])
+                    if "moderator" in request.args:
+                        p.profile.moderator = str_to_bool(request.args["moderator"][0])
+                    if "moderation_fee" in request.args:
+                        p.profile.moderation_fee = round(float(request.args["moderation_fee"][0]), 2)
+                    if "primary_color" in request.args:
+                        p.profile.primary_color = int(request.args["primary_color"][0])
+                    if "secondary_color" in request.args:
+                        p.profile.secondary_color = int(request.args["secondary_color"][0])
+                    if "background_color" in request.args:
+                        p.profile.background_color = int(request.args["background_color"][0])
+                    if "text_color" in request.args:
+                        p.profile.text_color = int(request.args["text_color"][0])
+                    if not p.get().HasField("guid_key"):
+                        key = u.PublicKey()
+                        key.public_key = self.keychain.verify_key.encode()
+                        key.signature = self.keychain.signing_key.sign(key.public_key)[:64]
+                        u.guid_key.MergeFrom(key)
+                    u.last_modified = int(time.time())
+                    p.update(u)
+                    request.write(json.dumps({"success": True}))
+                    request.finish()
+                    self.kserver.node.vendor = p.get().vendor
+                except Exception, e:
+                    request.write(json.dumps({"success": False, "reason": e.message}, indent=4))
+                    request.finish()
+
+            d = defer.succeed(None)
             if "pgp_key" in request.args and "signature" in request.args:
-                p.add_pgp_key(request.args["pgp_key"][0], request.args["signature"][0],
-                              self.keychain.guid.encode("hex"))
-            if not p.get().HasField("guid_key"):
-                key = u.PublicKey()
-                key.public_key = self.keychain.verify_key.encode()
-                key.signature = self.keychain.signing_key.sign(key.public_key)[:64]
-                u.guid_key.MergeFrom(key)
-            u.last_modified = int(time.time())
-            p.update(u)
-            request.write(json.dumps({"success": True}))
-            request.finish()
-            self.kserver.node.vendor = p.get().vendor
+                d = Profile(self.db).add_pgp_key(request.args["pgp_key"][0], request.args["signature"][0],
+                                                 self.keychain.guid.encode("hex"))
+            d.addCallback(save).addErrback(self._request_failed(request))
             return server.NOT_DONE_YET
         except Exception, e:
             request.write(json.dumps({"success": False, "reason": e.message}, indent=4))
@@ -640,8 +676,8 @@ class OpenBazaarAPI(APIResource):
             request.finish()
             return server.NOT_DONE_YET
         else:
-            for vendor in self.protocol.vendors.values():
-                self.db.vendors.save_vendor(vendor.id.encode("hex"), vendor.getProto().SerializeToString())
+            self.db.vendors.save_vendors([(vendor.id.encode("hex"), vendor.getProto().SerializeToString())
+                                          for vendor in self.protocol.vendors.values()])
             PortMapper().clean_my_mappings(self.kserver.node.port)
             self.protocol.shutdown()
             reactor.stop()
@@ -818,6 +854,7 @@ class OpenBazaarAPI(APIResource):
             file_path = os.path.join(DATA_FOLDER, "purchases", "trade receipts", request.args["id"][0] + ".json")
         with open(file_path, 'r') as filename:
             order = json.load(filename, object_pairs_hook=OrderedDict)
+
         c = Contract(self.db, contract=order, testnet=self.protocol.testnet)
         if "buyer_receipt" not in c.contract:
             c.add_receipt(True,
@@ -934,7 +971,7 @@ class OpenBazaarAPI(APIResource):
                 "libbitcoin_server": get_value(
                     "LIBBITCOIN_SERVERS_TESTNET", "testnet_server_custom")if self.protocol.testnet else get_value(
                         "LIBBITCOIN_SERVERS", "mainnet_server_custom"),
-                "seed": KeyChain(self.db).signing_key.encode(encoder=nacl.encoding.HexEncoder),
+                "seed": KeyChain.get(self.db).signing_key.encode(encoder=nacl.encoding.HexEncoder),
                 "terms_conditions": "" if settings[9] is None else settings[9],
                 "refund_policy": "" if settings[10] is None else settings[10],
                 "resolver": get_value("CONSTANTS", "RESOLVER"),
@@ -1007,27 +1044,33 @@ class OpenBazaarAPI(APIResource):
     def get_notifications(self, request):
         limit = int(request.args["limit"][0]) if "limit" in request.args else 20
         start = request.args["start"][0] if "start" in request.args else ""
-        notifications = self.db.notifications.get_notifications(start, limit)
-        notification_dict = {
-            "unread": self.db.notifications.get_unread_count(),
-            "notifications": []
-        }
-        for n in notifications[::-1]:
-            notification_json = {
-                "id": n[0],
-                "guid": n[1],
-                "handle": n[2],
-                "type": n[3],
-                "order_id": n[4],
-                "title": n[5],
-                "timestamp": n[6],
-                "image_hash": n[7].encode("hex"),
-                "read": False if n[8] == 0 else True
+
+        def load():
+            return self.db.notifications.get_notifications(start, limit), self.db.notifications.get_unread_count()
+
+        def respond(result):
+            notifications, unread = result
+            notification_dict = {
+                "unread": unread,
+                "notifications": []
             }
-            notification_dict["notifications"].append(notification_json)
-        request.setHeader('content-type', "application/json")
-        request.write(json.dumps(sanitize_html(notification_dict), indent=4))
-        request.finish()
+            for n in notifications[::-1]:
+                notification_json = {
+                    "id": n[0],
+                    "guid": n[1],
+                    "handle": n[2],
+                    "type": n[3],
+                    "order_id": n[4],
+                    "title": n[5],
+                    "timestamp": n[6],
+                    "image_hash": n[7].encode("hex"),
+                    "read": False if n[8] == 0 else True
+                }
+                notification_dict["notifications"].append(notification_json)
+            request.setHeader('content-type', "application/json")
+            request.write(json.dumps(sanitize_html(notification_dict), indent=4))
+            request.finish()
+        self.db.deferred.run(load).addCallback(respond).addErrback(self._request_failed(request))
         return server.NOT_DONE_YET
 
     @POST('^/api/v1/mark_notification_as_read')
@@ -1062,32 +1105,36 @@ class OpenBazaarAPI(APIResource):
     @authenticated
     def get_chat_messages(self, request):
         start = request.args["start"][0] if "start" in request.args else None
-        messages = self.db.messages.get_messages(request.args["guid"][0], "CHAT", start)
-        message_list = []
-        for m in messages[::-1]:
-            message_json = {
-                "id": m[11],
-                "guid": m[0],
-                "handle": m[1],
-                "message": m[5],
-                "timestamp": m[6],
-                "avatar_hash": m[7].encode("hex"),
-                "outgoing": False if m[9] == 0 else True,
-                "read": False if m[10] == 0 else True
-            }
-            message_list.append(message_json)
-        request.setHeader('content-type', "application/json")
-        request.write(json.dumps(sanitize_html(message_list), indent=4))
-        request.finish()
+
+        def respond(messages):
+            message_list = []
+            for m in messages[::-1]:
+                message_json = {
+                    "id": m[11],
+                    "guid": m[0],
+                    "handle": m[1],
+                    "message": m[5],
+                    "timestamp": m[6],
+                    "avatar_hash": m[7].encode("hex"),
+                    "outgoing": False if m[9] == 0 else True,
+                    "read": False if m[10] == 0 else True
+                }
+                message_list.append(message_json)
+            request.setHeader('content-type', "application/json")
+            request.write(json.dumps(sanitize_html(message_list), indent=4))
+            request.finish()
+        d = self.db.deferred.messages.get_messages(request.args["guid"][0], "CHAT", start)
+        d.addCallback(respond).addErrback(self._request_failed(request))
         return server.NOT_DONE_YET
 
     @GET('^/api/v1/get_chat_conversations')
     @authenticated
     def get_chat_conversations(self, request):
-        messages = self.db.messages.get_conversations()
-        request.setHeader('content-type', "application/json")
-        request.write(json.dumps(messages, indent=4).encode("utf-8"))
-        request.finish()
+        def respond(messages):
+            request.setHeader('content-type', "application/json")
+            request.write(json.dumps(messages, indent=4).encode("utf-8"))
+            request.finish()
+        self.db.deferred.messages.get_conversations().addCallback(respond).addErrback(self._request_failed(request))
         return server.NOT_DONE_YET
 
     @DELETE('^/api/v1/chat_conversation')
@@ -1119,54 +1166,57 @@ class OpenBazaarAPI(APIResource):
     @GET('^/api/v1/get_sales')
     @authenticated
     def get_sales(self, request):
+        def respond(sales):
+            sales_list = []
+            for sale in sales:
+                sale_json = {
+                    "order_id": sale[0],
+                    "title": sale[1],
+                    "description": sale[2],
+                    "timestamp": sale[3],
+                    "btc_total": sale[4],
+                    "status": sale[5],
+                    "thumbnail_hash": sale[6],
+                    "buyer": sale[7],
+                    "contract_type": sale[8],
+                    "unread": sale[9],
+                    "status_changed": False if sale[10] == 0 else True
+                }
+                sales_list.append(sale_json)
+            request.setHeader('content-type', "application/json")
+            request.write(json.dumps(sanitize_html(sales_list), indent=4))
+            request.finish()
         if "status" in request.args:
-            sales = self.db.sales.get_by_status(request.args["status"][0])
+            d = self.db.deferred.sales.get_by_status(request.args["status"][0])
         else:
-            sales = self.db.sales.get_all()
-        sales_list = []
-        for sale in sales:
-            sale_json = {
-                "order_id": sale[0],
-                "title": sale[1],
-                "description": sale[2],
-                "timestamp": sale[3],
-                "btc_total": sale[4],
-                "status": sale[5],
-                "thumbnail_hash": sale[6],
-                "buyer": sale[7],
-                "contract_type": sale[8],
-                "unread": sale[9],
-                "status_changed": False if sale[10] == 0 else True
-            }
-            sales_list.append(sale_json)
-        request.setHeader('content-type', "application/json")
-        request.write(json.dumps(sanitize_html(sales_list), indent=4))
-        request.finish()
+            d = self.db.deferred.sales.get_all()
+        d.addCallback(respond).addErrback(self._request_failed(request))
         return server.NOT_DONE_YET
 
     @GET('^/api/v1/get_purchases')
     @authenticated
     def get_purchases(self, request):
-        purchases = self.db.purchases.get_all()
-        purchases_list = []
-        for purchase in purchases:
-            purchase_json = {
-                "order_id": purchase[0],
-                "title": purchase[1],
-                "description": purchase[2],
-                "timestamp": purchase[3],
-                "btc_total": purchase[4],
-                "status": purchase[5],
-                "thumbnail_hash": purchase[6],
-                "vendor": purchase[7],
-                "contract_type": purchase[8],
-                "unread": purchase[9],
-                "status_changed": False if purchase[10] == 0 else True
-            }
-            purchases_list.append(purchase_json)
-        request.setHeader('content-type', "application/json")
-        request.write(json.dumps(sanitize_html(purchases_list), indent=4))
-        request.finish()
+        def respond(purchases):
+            purchases_list = []
+            for purchase in purchases:
+                purchase_json = {
+                    "order_id": purchase[0],
+                    "title": purchase[1],
+                    "description": purchase[2],
+                    "timestamp": purchase[3],
+                    "btc_total": purchase[4],
+                    "status": purchase[5],
+                    "thumbnail_hash": purchase[6],
+                    "vendor": purchase[7],
+                    "contract_type": purchase[8],
+                    "unread": purchase[9],
+                    "status_changed": False if purchase[10] == 0 else True
+                }
+                purchases_list.append(purchase_json)
+            request.setHeader('content-type', "application/json")
+            request.write(json.dumps(sanitize_html(purchases_list), indent=4))
+            request.finish()
+        self.db.deferred.purchases.get_all().addCallback(respond).addErrback(self._request_failed(request))
         return server.NOT_DONE_YET
 
     @POST('^/api/v1/check_for_payment')
@@ -1232,6 +1282,15 @@ class OpenBazaarAPI(APIResource):
         with open(file_path, 'r') as filename:
             order = json.load(filename, object_pairs_hook=OrderedDict)
 
+        # open a connection to the other party now so the next order message goes out on it
+        try:
+            if file_path.startswith(os.path.join(DATA_FOLDER, "purchases")):
+                self.mserver.prewarm(order["vendor_offer"]["listing"]["id"]["guid"])
+            elif file_path.startswith(os.path.join(DATA_FOLDER, "store")):
+                self.mserver.prewarm(order["buyer_order"]["order"]["id"]["guid"])
+        except KeyError:
+            pass
+
         if status == 0 or status == 2:
             check_order_for_payment(request.args["order_id"][0], self.db, self.protocol.blockchain,
                                     self.mserver.protocol.get_notification_listener(),
@@ -1417,6 +1476,60 @@ class OpenBazaarAPI(APIResource):
             request.finish()
         return server.NOT_DONE_YET
 
+    @GET('^/api/v1/get_audit_stats')
+    @authenticated
+    def get_audit_stats(self, request):
+        actions = dict((v, k) for k, v in ACTION_IDS.items())
+        daily = "period" in request.args and request.args["period"][0] == "daily"
+        try:
+            start = int(request.args["start"][0]) if "start" in request.args else 0
+            end = int(request.args["end"][0]) if "end" in request.args else None
+        except ValueError:
+            return self._bad_request(request, "start and end must be integers")
+        contract_hash = request.args["contract_id"][0] if "contract_id" in request.args else None
+
+        def respond(rollups):
+            stats = {
+                "period": "daily" if daily else "hourly",
+                "totals": dict((action, 0) for action in ACTION_IDS),
+                "buckets": []
+            }
+            for bucket, contract, action_id, events in rollups:
+                stats["buckets"].append({
+                    "timestamp": bucket,
+                    "contract_id": contract,
+                    "action": actions.get(action_id, action_id),
+                    "count": events
+                })
+                if action_id in actions:
+                    stats["totals"][actions[action_id]] += events
+            request.setHeader('content-type', "application/json")
+            request.write(json.dumps(sanitize_html(stats), indent=4))
+            request.finish()
+
+        self.db.deferred.audit_shopping.get_rollups(daily, start, end, contract_hash)\
+            .addCallback(respond).addErrback(self._request_failed(request))
+        return server.NOT_DONE_YET
+
+    @GET('^/api/v1/get_stats')
+    @authenticated
+    def get_stats(self, request):
+        stats = {
+            "dispatch": self.protocol.get_dispatch_stats(),
+            "connections": self.protocol.get_connection_stats(),
+            "hole_punching": self.protocol.get_hole_punch_stats(),
+            "keep_alive": self.protocol.get_keep_alive_stats(),
+            "relay": self.protocol.relay_manager.get_stats(),
+            "signature_cache": SignatureCache.instance().get_stats(),
+            "pgp_cache": PGPCache.instance().get_stats(),
+            "blob_cache": self.db.blobs.get_stats(),
+            "audit": self.mserver.protocol.audit.get_stats()
+        }
+        request.setHeader('content-type', "application/json")
+        request.write(json.dumps(stats, indent=4))
+        request.finish()
+        return server.NOT_DONE_YET
+
     @GET('^/api/v1/btc_price')
     @authenticated
     def btc_price(self, request):
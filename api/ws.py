@@ -127,7 +127,7 @@ class WSProtocol(Protocol):
                                            None if not n.HasField("relayAddress") else
                                            (n.relayAddress.ip, n.relayAddress.port),
                                            n.natType, n.vendor)
-                        if n.guid == KeyChain(self.factory.db).guid:
+                        if n.guid == KeyChain.get(self.factory.db).guid:
                             parse_profile(Profile(self.factory.db).get(), node_to_ask)
                         else:
                             self.factory.mserver.get_profile(node_to_ask)\
@@ -145,16 +145,10 @@ class WSProtocol(Protocol):
         self.log.info("Fetching listings from %s vendors" % len(vendors))
 
         def get_following_from_vendors(vendors):
-            follow_data = self.factory.mserver.db.follow.get_following()
-            following_guids = []
-            if follow_data is not None:
-                f = objects.Following()
-                f.ParseFromString(follow_data)
-                for user in f.users:
-                    following_guids.append(user.guid)
+            follow = self.factory.mserver.db.follow
             vendor_list = []
             for k, v in vendors.items():
-                if k in following_guids:
+                if follow.is_following(k):
                     vendor_list.append(v)
             return vendor_list
 
@@ -277,7 +271,7 @@ class WSProtocol(Protocol):
                                            None if not n.HasField("relayAddress") else
                                            (n.relayAddress.ip, n.relayAddress.port),
                                            n.natType, n.vendor)
-                        if n.guid == KeyChain(self.factory.db).guid:
+                        if n.guid == KeyChain.get(self.factory.db).guid:
                             proto = self.factory.db.listings.get_proto()
                             l = Listings()
                             l.ParseFromString(proto)
@@ -318,6 +312,9 @@ class WSProtocol(Protocol):
             elif request_json["request"]["command"] == "search":
                 self.search(message_id, request_json["request"]["keyword"].lower())
 
+            elif request_json["request"]["command"] == "prewarm":
+                self.factory.mserver.prewarm(request_json["request"]["guid"])
+
             elif request_json["request"]["command"] == "send_message":
                 self.send_message(message_id, request_json["request"]["guid"],
                                   request_json["request"]["handle"],
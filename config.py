@@ -13,7 +13,7 @@ from ConfigParser import ConfigParser
 from urlparse import urlparse
 
 SERVER_VERSION = "0.2.4"
-PROTOCOL_VERSION = 2
+PROTOCOL_VERSION = 3
 CONFIG_FILE = join(os.getcwd(), 'ob.cfg')
 
 # FIXME probably a better way to do this. This curretly checks two levels deep.
@@ -27,6 +27,7 @@ DEFAULTS = {
     'data_folder': None,
     'ksize': '20',
     'alpha': '3',
+    'max_connections': '1000',
     'transaction_fee': '10000',
     'libbitcoin_servers': 'tcp://libbitcoin1.openbazaar.org:9091',
     'libbitcoin_servers_testnet': 'tcp://libbitcoin2.openbazaar.org:9091, <Z&{.=LJSPySefIKgCu99w.L%b^6VvuVp0+pbnOM',
@@ -164,6 +165,7 @@ else:
 DATA_FOLDER = _platform_agnostic_data_path(cfg.get('CONSTANTS', 'DATA_FOLDER'))
 KSIZE = int(cfg.get('CONSTANTS', 'KSIZE'))
 ALPHA = int(cfg.get('CONSTANTS', 'ALPHA'))
+MAX_CONNECTIONS = int(cfg.get('CONSTANTS', 'MAX_CONNECTIONS'))
 TRANSACTION_FEE = int(cfg.get('CONSTANTS', 'TRANSACTION_FEE'))
 RESOLVER = cfg.get('CONSTANTS', 'RESOLVER')
 SSL = str_to_bool(cfg.get('AUTHENTICATION', 'SSL'))
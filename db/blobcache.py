@@ -0,0 +1,70 @@
+__author__ = 'chris'
+
+from collections import OrderedDict
+
+
+class BlobCache(object):
+    """
+    An LRU cache of the contents of the files we serve (images and contracts),
+    keyed by hash, so the same thumbnails, avatar and contracts aren't read off
+    disk for every GET_IMAGE and GET_CONTRACT.
+
+    The cache is bounded by the total size of the blobs it holds. Blobs larger than
+    `max_blob_size` are never cached. The `HashMap` drops an entry whenever its hash
+    is inserted or deleted.
+    """
+
+    def __init__(self, max_size=32 * 1024 * 1024, max_blob_size=2 * 1024 * 1024):
+        """
+        Args:
+            max_size: the maximum number of bytes to hold.
+            max_blob_size: the largest blob that will be cached.
+        """
+        self.max_size = max_size
+        self.max_blob_size = max_blob_size
+        self.blobs = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_served = 0
+
+    def get(self, hash_value):
+        """Returns the cached blob, or `None` if it isn't in the cache."""
+        try:
+            blob = self.blobs.pop(hash_value)
+        except KeyError:
+            self.misses += 1
+            return None
+        self.blobs[hash_value] = blob
+        self.hits += 1
+        self.bytes_served += len(blob)
+        return blob
+
+    def add(self, hash_value, blob):
+        self.invalidate(hash_value)
+        if len(blob) > self.max_blob_size:
+            return
+        while self.blobs and self.size + len(blob) > self.max_size:
+            self.size -= len(self.blobs.popitem(last=False)[1])
+        self.blobs[hash_value] = blob
+        self.size += len(blob)
+
+    def invalidate(self, hash_value):
+        blob = self.blobs.pop(hash_value, None)
+        if blob is not None:
+            self.size -= len(blob)
+
+    def clear(self):
+        self.blobs.clear()
+        self.size = 0
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": float(self.hits) / lookups if lookups else None,
+            "bytes_served": self.bytes_served,
+            "entries": len(self.blobs),
+            "size": self.size
+        }
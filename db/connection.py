@@ -0,0 +1,108 @@
+__author__ = 'chris'
+
+import atexit
+import os
+import sqlite3
+import threading
+
+_local = threading.local()
+_lock = threading.Lock()
+_connections = {}
+
+
+class Connection(object):
+    """
+    A persistent sqlite3 connection, one per database file per thread, handed out by
+    `connect`. It keeps the interface the stores use (`cursor`, `commit`, `close` and
+    `with conn:`) but:
+
+        - `close` doesn't close the connection, so its statement cache survives
+          between calls. Like closing, it rolls back anything left uncommitted.
+        - `with conn:` blocks nest. Only the outermost one commits (or rolls back if
+          it raises), and `commit` inside a block does nothing. Wrapping several
+          store calls in `with Database.transaction():` makes them one transaction.
+
+    The database is switched to WAL journaling so readers don't block the writer.
+    """
+
+    def __init__(self, path, cached_statements=256):
+        self.path = path
+        self.conn = sqlite3.connect(path, cached_statements=cached_statements, check_same_thread=False)
+        self.conn.text_factory = str
+        self.conn.execute('''PRAGMA journal_mode=WAL''')
+        # in WAL mode this can lose the last commits on power loss but never corrupts the database
+        self.conn.execute('''PRAGMA synchronous=NORMAL''')
+        self.depth = 0
+        self.closed = False
+
+    def cursor(self):
+        return self.conn.cursor()
+
+    def execute(self, sql, parameters=()):
+        return self.conn.execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.conn.executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        if self.depth == 0:
+            self.conn.commit()
+
+    def rollback(self):
+        if self.depth == 0:
+            self.conn.rollback()
+
+    def close(self):
+        self.rollback()
+
+    def __enter__(self):
+        self.depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.depth -= 1
+        if self.depth == 0:
+            if exc_type is None:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+        return False
+
+    def shutdown(self):
+        """Really close the connection."""
+        self.closed = True
+        self.conn.close()
+
+
+def connect(path):
+    """Returns this thread's `Connection` to the database at `path`."""
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(path)
+    if conn is None or conn.closed:
+        conn = connections[path] = Connection(path)
+        with _lock:
+            _connections.setdefault(path, []).append(conn)
+    return conn
+
+
+def close_all(path=None):
+    """
+    Close every thread's connection to the database at `path` (or to all databases).
+    Call this before deleting or recreating a database file. If the file has already
+    been deleted its WAL files are removed as well.
+    """
+    with _lock:
+        paths = [path] if path is not None else _connections.keys()
+        for p in paths:
+            for conn in _connections.pop(p, []):
+                if not conn.closed:
+                    conn.shutdown()
+            if not os.path.exists(p):
+                for suffix in ("-wal", "-shm"):
+                    if os.path.exists(p + suffix):
+                        os.remove(p + suffix)
+
+
+atexit.register(close_all)
@@ -4,21 +4,27 @@ import os
 import sqlite3 as lite
 import time
 from api.utils import sanitize_html
-from collections import Counter
+from collections import Counter, OrderedDict
 from config import DATA_FOLDER
+from db import connection
+from db.blobcache import BlobCache
+from db.deferreddb import DeferredDatabase
 from dht.node import Node
 from dht.utils import digest
+from keys.keychain import KeyChain
 from protos import objects
 from protos.objects import Listings, Followers, Following
+from protos.wire import join_repeated
 from os.path import join
-from db.migrations import migration1, migration2, migration3, migration4, migration5, migration6, migration7
+from db.migrations import migration1, migration2, migration3, migration4, migration5, migration6, migration7, \
+    migration8, migration9, migration10, migration11, migration12
 
 
 class Database(object):
 
     __slots__ = ['PATH', 'filemap', 'profile', 'listings', 'keys', 'follow', 'messages',
                  'notifications', 'broadcasts', 'vendors', 'moderators', 'purchases', 'sales',
-                 'cases', 'ratings', 'transactions', 'settings', 'audit_shopping']
+                 'cases', 'ratings', 'transactions', 'settings', 'audit_shopping', 'deferred']
 
     def __init__(self, testnet=False, filepath=None):
         object.__setattr__(self, 'PATH', self._database_path(testnet, filepath))
@@ -39,9 +45,12 @@ class Database(object):
         object.__setattr__(self, 'transactions', Transactions(self.PATH))
         object.__setattr__(self, 'settings', Settings(self.PATH))
         object.__setattr__(self, 'audit_shopping', ShoppingEvents(self.PATH))
+        object.__setattr__(self, 'deferred', DeferredDatabase(self))
 
         self._initialize_datafolder_tree()
         self._initialize_database(self.PATH)
+        # load the follower count now, before the database thread starts updating it
+        self.follow.get_follower_count()
 
     def get_database_path(self):
         return self.PATH
@@ -54,7 +63,9 @@ class Database(object):
             raise RuntimeError('attempted to initialize empty path')
 
         if not os.path.isfile(database_path):
+            connection.close_all(database_path)
             self._create_database(database_path)
+            KeyChain.invalidate(database_path)
             cache = join(DATA_FOLDER, "cache.pickle")
             if os.path.exists(cache):
                 os.remove(cache)
@@ -83,9 +94,15 @@ class Database(object):
 
     @staticmethod
     def connect_database(path):
-        conn = lite.connect(path)
-        conn.text_factory = str
-        return conn
+        """Returns this thread's pooled `db.connection.Connection` to the database."""
+        return connection.connect(path)
+
+    def transaction(self):
+        """
+        Use as `with db.transaction():` to make the store calls in the block, on this
+        thread, a single transaction.
+        """
+        return self.connect_database(self.PATH)
 
     @staticmethod
     def _initialize_datafolder_tree():
@@ -204,29 +221,89 @@ class Database(object):
             migration4.migrate(self.PATH)
             migration5.migrate(self.PATH)
             migration6.migrate(self.PATH)
+            migration7.migrate(self.PATH)
+            migration8.migrate(self.PATH)
+            migration9.migrate(self.PATH)
+            migration10.migrate(self.PATH)
+            migration11.migrate(self.PATH)
+            migration12.migrate(self.PATH)
         elif version == 1:
             migration2.migrate(self.PATH)
             migration3.migrate(self.PATH)
             migration4.migrate(self.PATH)
             migration5.migrate(self.PATH)
             migration6.migrate(self.PATH)
+            migration7.migrate(self.PATH)
+            migration8.migrate(self.PATH)
+            migration9.migrate(self.PATH)
+            migration10.migrate(self.PATH)
+            migration11.migrate(self.PATH)
+            migration12.migrate(self.PATH)
         elif version == 2:
             migration3.migrate(self.PATH)
             migration4.migrate(self.PATH)
             migration5.migrate(self.PATH)
             migration6.migrate(self.PATH)
+            migration7.migrate(self.PATH)
+            migration8.migrate(self.PATH)
+            migration9.migrate(self.PATH)
+            migration10.migrate(self.PATH)
+            migration11.migrate(self.PATH)
+            migration12.migrate(self.PATH)
         elif version == 3:
             migration4.migrate(self.PATH)
             migration5.migrate(self.PATH)
             migration6.migrate(self.PATH)
+            migration7.migrate(self.PATH)
+            migration8.migrate(self.PATH)
+            migration9.migrate(self.PATH)
+            migration10.migrate(self.PATH)
+            migration11.migrate(self.PATH)
+            migration12.migrate(self.PATH)
         elif version == 4:
             migration5.migrate(self.PATH)
             migration6.migrate(self.PATH)
+            migration7.migrate(self.PATH)
+            migration8.migrate(self.PATH)
+            migration9.migrate(self.PATH)
+            migration10.migrate(self.PATH)
+            migration11.migrate(self.PATH)
+            migration12.migrate(self.PATH)
         elif version == 5:
             migration6.migrate(self.PATH)
             migration7.migrate(self.PATH)
+            migration8.migrate(self.PATH)
+            migration9.migrate(self.PATH)
+            migration10.migrate(self.PATH)
+            migration11.migrate(self.PATH)
+            migration12.migrate(self.PATH)
         elif version == 6:
             migration7.migrate(self.PATH)
+            migration8.migrate(self.PATH)
+            migration9.migrate(self.PATH)
+            migration10.migrate(self.PATH)
+            migration11.migrate(self.PATH)
+            migration12.migrate(self.PATH)
+        elif version == 7:
+            migration8.migrate(self.PATH)
+            migration9.migrate(self.PATH)
+            migration10.migrate(self.PATH)
+            migration11.migrate(self.PATH)
+            migration12.migrate(self.PATH)
+        elif version == 8:
+            migration9.migrate(self.PATH)
+            migration10.migrate(self.PATH)
+            migration11.migrate(self.PATH)
+            migration12.migrate(self.PATH)
+        elif version == 9:
+            migration10.migrate(self.PATH)
+            migration11.migrate(self.PATH)
+            migration12.migrate(self.PATH)
+        elif version == 10:
+            migration11.migrate(self.PATH)
+            migration12.migrate(self.PATH)
+        elif version == 11:
+            migration12.migrate(self.PATH)
 
 
 class HashMap(object):
@@ -235,12 +312,16 @@ class HashMap(object):
     over the wire in a query) with a more human readable filename in local
     storage. This is useful for users who want to look through their store
     data on disk.
+
+    The contents of the files we serve are kept in a `BlobCache`, see `read`.
     """
 
     def __init__(self, database_path):
         self.PATH = database_path
+        self.blobs = BlobCache()
 
     def insert(self, hash_value, filepath):
+        self.blobs.invalidate(hash_value)
         conn = Database.connect_database(self.PATH)
         with conn:
             cursor = conn.cursor()
@@ -259,6 +340,21 @@ class HashMap(object):
             return None
         return DATA_FOLDER + ret[0]
 
+    def read(self, hash_value):
+        """
+        Returns the contents of the file, from the cache if we've served it recently,
+        or `None` if the hash isn't in the map. Raises `IOError` if the file can't be read.
+        """
+        blob = self.blobs.get(hash_value)
+        if blob is None:
+            file_path = self.get_file(hash_value)
+            if file_path is None:
+                return None
+            with open(file_path, "rb") as f:
+                blob = f.read()
+            self.blobs.add(hash_value, blob)
+        return blob
+
     def get_all(self):
         conn = Database.connect_database(self.PATH)
         cursor = conn.cursor()
@@ -268,6 +364,7 @@ class HashMap(object):
         return ret
 
     def delete(self, hash_value):
+        self.blobs.invalidate(hash_value)
         conn = Database.connect_database(self.PATH)
         with conn:
             cursor = conn.cursor()
@@ -276,6 +373,7 @@ class HashMap(object):
         conn.close()
 
     def delete_all(self):
+        self.blobs.clear()
         conn = Database.connect_database(self.PATH)
         with conn:
             cursor = conn.cursor()
@@ -292,10 +390,18 @@ class ProfileStore(object):
     object). Also we will just serve this over the wire so we don't have to manually
     rebuild it every startup. To interact with the profile you should use the
     `market.profile` module and not this class directly.
+
+    The serialized profile is cached in memory and the cache is written through
+    on `set_proto`. The same `str` is returned until the profile changes. `signed`
+    holds the signed profile and metadata `market.profile` builds from it, keyed by
+    the verify key, and is cleared when the profile changes.
     """
 
     def __init__(self, database_path):
         self.PATH = database_path
+        self.proto = None
+        self.loaded = False
+        self.signed = {}
 
     def set_proto(self, proto):
         conn = Database.connect_database(self.PATH)
@@ -306,16 +412,21 @@ class ProfileStore(object):
                           VALUES (?,?,?)''', (1, proto, handle))
             conn.commit()
         conn.close()
+        self.proto = proto
+        self.loaded = True
+        self.signed = {}
 
     def get_proto(self):
+        if self.loaded:
+            return self.proto
         conn = Database.connect_database(self.PATH)
         cursor = conn.cursor()
         cursor.execute('''SELECT serializedUserInfo FROM profile WHERE id = 1''')
         ret = cursor.fetchone()
         conn.close()
-        if ret is None:
-            return None
-        return ret[0]
+        self.proto = None if ret is None else ret[0]
+        self.loaded = True
+        return self.proto
 
     def set_temp_handle(self, handle):
         conn = Database.connect_database(self.PATH)
@@ -343,50 +454,57 @@ class ProfileStore(object):
 
 class ListingsStore(object):
     """
-    Stores a serialized `Listings` protobuf object. It contains metadata for all the
-    contracts hosted by this store. We will send this in response to a GET_LISTING
-    query. This should be updated each time a new contract is created.
+    Stores the `ListingMetadata` for all the contracts hosted by this store, one row
+    per contract. We will send them as a `Listings` protobuf object in response to a
+    GET_LISTING query. This should be updated each time a new contract is created.
+
+    The listings are cached in memory, in the order they were added, and the
+    serialized `Listings` is assembled when it's first asked for after a change.
+    The same `str` is returned until they change.
     """
 
     def __init__(self, database_path):
         self.PATH = database_path
+        self.listings = None
+        self.proto = None
+
+    def _load(self):
+        if self.listings is None:
+            conn = Database.connect_database(self.PATH)
+            cursor = conn.cursor()
+            cursor.execute('''SELECT contractHash, serializedListing FROM listings ORDER BY rowid''')
+            self.listings = OrderedDict(cursor.fetchall())
+            conn.close()
+        return self.listings
 
     def add_listing(self, proto):
         """
         Will also update an existing listing if the contract hash is the same.
         """
+        listings = self._load()
+        ser = proto.SerializeToString()
         conn = Database.connect_database(self.PATH)
         with conn:
             cursor = conn.cursor()
-            l = Listings()
-            ser = self.get_proto()
-            if ser is not None:
-                l.ParseFromString(ser)
-                for listing in l.listing:
-                    if listing.contract_hash == proto.contract_hash:
-                        l.listing.remove(listing)
-            l.listing.extend([proto])
-            cursor.execute('''INSERT OR REPLACE INTO listings(id, serializedListings)
-                          VALUES (?,?)''', (1, l.SerializeToString()))
+            cursor.execute('''INSERT OR REPLACE INTO listings(contractHash, serializedListing, pinned, hidden,
+                          lastModified) VALUES (?,?,?,?,?)''',
+                           (proto.contract_hash, ser, int(proto.pinned), int(proto.hidden), proto.last_modified))
             conn.commit()
         conn.close()
+        listings.pop(proto.contract_hash, None)
+        listings[proto.contract_hash] = ser
+        self.proto = None
 
     def delete_listing(self, hash_value):
+        listings = self._load()
         conn = Database.connect_database(self.PATH)
         with conn:
             cursor = conn.cursor()
-            ser = self.get_proto()
-            if ser is None:
-                return
-            l = Listings()
-            l.ParseFromString(ser)
-            for listing in l.listing:
-                if listing.contract_hash == hash_value:
-                    l.listing.remove(listing)
-            cursor.execute('''INSERT OR REPLACE INTO listings(id, serializedListings)
-                          VALUES (?,?)''', (1, l.SerializeToString()))
+            cursor.execute('''DELETE FROM listings WHERE contractHash=?''', (hash_value,))
             conn.commit()
         conn.close()
+        if listings.pop(hash_value, None) is not None:
+            self.proto = None
 
     def delete_all_listings(self):
         conn = Database.connect_database(self.PATH)
@@ -395,16 +513,21 @@ class ListingsStore(object):
             cursor.execute('''DELETE FROM listings''')
             conn.commit()
         conn.close()
+        self.listings = OrderedDict()
+        self.proto = None
+
+    def get_listing(self, hash_value):
+        """Returns the serialized `ListingMetadata` for the contract, or `None`."""
+        return self._load().get(hash_value)
 
     def get_proto(self):
-        conn = Database.connect_database(self.PATH)
-        cursor = conn.cursor()
-        cursor.execute('''SELECT serializedListings FROM listings WHERE id = 1''')
-        ret = cursor.fetchone()
-        conn.close()
-        if ret is None:
-            return None
-        return ret[0]
+        """Returns the serialized `Listings`, which is empty if there are no listings."""
+        listings = self._load()
+        if not listings:
+            return ""
+        if self.proto is None:
+            self.proto = join_repeated(Listings.LISTING_FIELD_NUMBER, listings.itervalues())
+        return self.proto
 
 
 class KeyStore(object):
@@ -423,6 +546,7 @@ class KeyStore(object):
                           VALUES (?,?,?)''', (key_type, privkey, pubkey))
             conn.commit()
         conn.close()
+        KeyChain.invalidate(self.PATH)
 
     def get_key(self, key_type):
         conn = Database.connect_database(self.PATH)
@@ -442,108 +566,145 @@ class KeyStore(object):
             cursor.execute('''DELETE FROM keys''')
             conn.commit()
         conn.close()
+        KeyChain.invalidate(self.PATH)
 
 
 class FollowData(object):
     """
     A class for saving and retrieving follower and following data
     for this node.
+
+    The users we follow are stored one row per guid and cached in memory, in the
+    order they were followed. The serialized `Following` is assembled when it's
+    first asked for after a change and the same `str` is returned until the next.
+
+    Followers are paged newest first, `PAGE_SIZE` at a time, by the rowid of the
+    last follower on the previous page. Their count is kept in memory. It's loaded
+    when the `Database` is opened and only changed by `set_follower` and
+    `delete_follower`, so those should only be called from one thread.
     """
 
+    PAGE_SIZE = 30
+
     def __init__(self, database_path):
         self.PATH = database_path
+        self.following = None
+        self.following_proto = None
+        self.follower_count = None
+
+    def _load_following(self):
+        if self.following is None:
+            conn = Database.connect_database(self.PATH)
+            cursor = conn.cursor()
+            cursor.execute('''SELECT guid, serializedUser FROM following ORDER BY rowid''')
+            self.following = OrderedDict(cursor.fetchall())
+            conn.close()
+        return self.following
 
     def follow(self, proto):
+        following = self._load_following()
+        ser = proto.SerializeToString()
         conn = Database.connect_database(self.PATH)
         with conn:
             cursor = conn.cursor()
-            f = Following()
-            ser = self.get_following()
-            if ser is not None:
-                f.ParseFromString(ser)
-                for user in f.users:
-                    if user.guid == proto.guid:
-                        f.users.remove(user)
-            f.users.extend([proto])
-            cursor.execute('''INSERT OR REPLACE INTO following(id, serializedFollowing) VALUES (?,?)''',
-                           (1, f.SerializeToString()))
+            cursor.execute('''INSERT OR REPLACE INTO following(guid, serializedUser) VALUES (?,?)''',
+                           (proto.guid, ser))
             conn.commit()
         conn.close()
+        following.pop(proto.guid, None)
+        following[proto.guid] = ser
+        self.following_proto = None
 
     def unfollow(self, guid):
+        following = self._load_following()
+        if not isinstance(guid, str) or guid not in following:
+            return
         conn = Database.connect_database(self.PATH)
         with conn:
             cursor = conn.cursor()
-            f = Following()
-            ser = self.get_following()
-            if ser is not None:
-                f.ParseFromString(ser)
-                for user in f.users:
-                    if user.guid == guid:
-                        f.users.remove(user)
-            cursor.execute('''INSERT OR REPLACE INTO following(id, serializedFollowing) VALUES (?,?)''',
-                           (1, f.SerializeToString()))
+            cursor.execute('''DELETE FROM following WHERE guid=?''', (guid,))
             conn.commit()
         conn.close()
+        del following[guid]
+        self.following_proto = None
 
     def get_following(self):
-        conn = Database.connect_database(self.PATH)
-        cursor = conn.cursor()
-        cursor.execute('''SELECT serializedFollowing FROM following WHERE id=1''')
-        ret = cursor.fetchall()
-        conn.close()
-        if not ret:
-            return None
-        else:
-            return ret[0][0]
+        """Returns the serialized `Following`, which is empty if we aren't following anyone."""
+        following = self._load_following()
+        if not following:
+            return ""
+        if self.following_proto is None:
+            self.following_proto = join_repeated(Following.USERS_FIELD_NUMBER, following.itervalues())
+        return self.following_proto
+
+    def get_user(self, guid):
+        """Returns the serialized `Following.User` if we're following the guid, otherwise `None`."""
+        return self._load_following().get(guid)
 
     def is_following(self, guid):
-        f = Following()
-        ser = self.get_following()
-        if ser is not None:
-            f.ParseFromString(ser)
-            for user in f.users:
-                if user.guid == guid:
-                    return True
-        return False
+        return guid in self._load_following()
 
     def set_follower(self, proto):
-        conn = Database.connect_database(self.PATH)
         p = Followers.Follower()
         p.ParseFromString(proto)
+        count = self.get_follower_count()
+        conn = Database.connect_database(self.PATH)
         with conn:
             cursor = conn.cursor()
-            cursor.execute('''INSERT OR REPLACE INTO followers(guid, serializedFollower) VALUES (?,?)''',
-                           (p.guid.encode("hex"), proto.encode("hex")))
+            # delete and insert rather than replace so a returning follower moves to the front
+            cursor.execute('''DELETE FROM followers WHERE guid=?''', (p.guid,))
+            existed = cursor.rowcount > 0
+            cursor.execute('''INSERT INTO followers(guid, serializedFollower) VALUES (?,?)''', (p.guid, proto))
             conn.commit()
         conn.close()
+        if not existed:
+            self.follower_count = count + 1
 
     def delete_follower(self, guid):
+        count = self.get_follower_count()
         conn = Database.connect_database(self.PATH)
         with conn:
             cursor = conn.cursor()
-            cursor.execute('''DELETE FROM followers WHERE guid=?''', (guid.encode("hex"), ))
+            cursor.execute('''DELETE FROM followers WHERE guid=?''', (guid, ))
+            deleted = cursor.rowcount
             conn.commit()
         conn.close()
+        self.follower_count = count - deleted
 
-    def get_followers(self, start=0):
-        conn = Database.connect_database(self.PATH)
-        cursor = conn.cursor()
+    def get_follower_count(self):
+        if self.follower_count is None:
+            conn = Database.connect_database(self.PATH)
+            cursor = conn.cursor()
+            cursor.execute('''SELECT Count(*) FROM followers''')
+            self.follower_count = cursor.fetchone()[0]
+            conn.close()
+        return self.follower_count
 
-        cursor.execute('''SELECT Count(*) FROM followers''')
-        count = cursor.fetchone()[0]
+    def get_followers(self, start=0, cursor=None):
+        """
+        Returns a page of our followers, newest first.
 
-        f = Followers()
-        if count > 0:
-            smt = '''select serializedFollower from followers order by rowid desc limit 30 offset ''' + str(start)
-            cursor.execute(smt)
-            serialized_followers = cursor.fetchall()
-            conn.close()
-            for proto in serialized_followers:
-                p = Followers.Follower()
-                p.ParseFromString(proto[0].decode("hex"))
-                f.followers.extend([p])
-        return (f.SerializeToString(), count)
+        Args:
+            start: the number of followers to skip. Only used if there is no `cursor`.
+            cursor: the cursor returned with the previous page.
+
+        Returns:
+            A tuple of the serialized `Followers`, the total number of followers and
+            the cursor for the next page, or `None` if this is the last one.
+        """
+        conn = Database.connect_database(self.PATH)
+        c = conn.cursor()
+        if cursor is not None:
+            c.execute('''SELECT rowid, serializedFollower FROM followers WHERE rowid < ?
+                         ORDER BY rowid DESC LIMIT ?''', (cursor, self.PAGE_SIZE))
+        else:
+            c.execute('''SELECT rowid, serializedFollower FROM followers ORDER BY rowid DESC LIMIT ? OFFSET ?''',
+                      (self.PAGE_SIZE, start))
+        rows = c.fetchall()
+        conn.close()
+        next_cursor = rows[-1][0] if len(rows) == self.PAGE_SIZE else None
+        ser = join_repeated(Followers.FOLLOWERS_FIELD_NUMBER, (row[1] for row in rows))
+        return (ser, self.get_follower_count(), next_cursor)
 
 
 class MessageStore(object):
@@ -554,6 +715,8 @@ class MessageStore(object):
 
     def __init__(self, database_path):
         self.PATH = database_path
+        # guid -> (profile file mtime, sanitized guid, sanitized handle, avatar hash) for the conversation list
+        self.profiles = {}
 
     def save_message(self, guid, handle, pubkey, subject, message_type, message,
                      timestamp, avatar_hash, signature, is_outgoing, msg_id=None):
@@ -616,40 +779,56 @@ avatarHash, signature, outgoing, read FROM messages WHERE subject=? ''',
         """
         conn = Database.connect_database(self.PATH)
         cursor = conn.cursor()
-        cursor.execute('''SELECT DISTINCT guid FROM messages''',)
-        guids = cursor.fetchall()
+        # SQLite takes the bare columns from the row with the max(timestamp)
+        cursor.execute('''SELECT c.guid, c.avatarHash, c.message, c.timestamp, c.pubkey, c.anyAvatarHash, u.unread
+FROM (SELECT guid, avatarHash, message, max(timestamp) AS timestamp, pubkey,
+      (SELECT avatarHash FROM messages AS m WHERE m.guid=messages.guid AND m.messageType=? AND avatarHash NOT NULL
+       LIMIT 1) AS anyAvatarHash
+      FROM messages WHERE messageType=? GROUP BY guid) AS c
+LEFT JOIN (SELECT guid, Count(*) AS unread FROM messages WHERE read=0 and outgoing=0 and subject=""
+           GROUP BY guid) AS u ON u.guid=c.guid''', ("CHAT", "CHAT"))
+        rows = cursor.fetchall()
+        conn.close()
         ret = []
-        unread = self.get_unread()
-        for g in guids:
-            cursor.execute('''SELECT avatarHash, message, max(timestamp), pubkey FROM messages
-WHERE guid=? and messageType=?''', (g[0], "CHAT"))
-            val = cursor.fetchone()
-            avatar_hash = None
-            handle = ""
-            if val[0] is not None:
+        for guid, avatar_hash, message, timestamp, pubkey, any_avatar_hash, unread in rows:
+            clean_guid, handle, avatar_hash = self._get_profile(guid)
+            if avatar_hash is None and any_avatar_hash is not None:
+                avatar_hash = any_avatar_hash.encode("hex")
+            # the hex encoded fields and numbers can't hold any html so only the strings are sanitized
+            ret.append({"guid": clean_guid,
+                        "avatar_hash": avatar_hash,
+                        "handle": handle,
+                        "last_message": sanitize_html(message),
+                        "timestamp": timestamp,
+                        "public_key": pubkey.encode("hex"),
+                        "unread": unread or 0})
+        return ret
+
+    def _get_profile(self, guid):
+        """
+        Returns the sanitized guid and handle and the hex avatar hash (`None` if we
+        don't have its cached profile) for the conversation list. They're kept until
+        the guid's profile file changes.
+        """
+        path = join(DATA_FOLDER, 'cache', guid + ".profile")
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            mtime = None
+        cached = self.profiles.get(guid)
+        if cached is None or cached[0] != mtime:
+            handle, avatar_hash = "", None
+            if mtime is not None:
                 try:
-                    with open(join(DATA_FOLDER, 'cache', g[0] + ".profile"), "r") as filename:
+                    with open(path, "r") as filename:
                         profile = filename.read()
                     p = objects.Profile()
                     p.ParseFromString(profile)
-                    avatar_hash = p.avatar_hash.encode("hex")
-                    handle = p.handle
+                    handle, avatar_hash = p.handle, p.avatar_hash.encode("hex")
                 except Exception:
-                    cursor.execute('''SELECT avatarHash FROM messages
-WHERE guid=? and messageType=? and avatarHash NOT NULL''', (g[0], "CHAT"))
-                    avi = cursor.fetchone()
-                    if avi[0] is not None:
-                        avatar_hash = avi[0].encode("hex")
-
-                ret.append({"guid": g[0],
-                            "avatar_hash": avatar_hash,
-                            "handle": handle,
-                            "last_message": val[1],
-                            "timestamp": val[2],
-                            "public_key": val[3].encode("hex"),
-                            "unread": 0 if g[0] not in unread else unread[g[0]]})
-        conn.close()
-        return sanitize_html(ret)
+                    pass
+            cached = self.profiles[guid] = (mtime, sanitize_html(guid), sanitize_html(handle), avatar_hash)
+        return cached[1:]
 
     def get_unread(self):
         """
@@ -657,13 +836,11 @@ WHERE guid=? and messageType=? and avatarHash NOT NULL''', (g[0], "CHAT"))
         """
         conn = Database.connect_database(self.PATH)
         cursor = conn.cursor()
-        cursor.execute('''SELECT guid FROM messages WHERE read=0 and outgoing=0 and subject=""''',)
-        ret = []
-        guids = cursor.fetchall()
-        for g in guids:
-            ret.append(g[0])
+        cursor.execute('''SELECT guid, Count(*) FROM messages WHERE read=0 and outgoing=0 and subject=""
+GROUP BY guid''')
+        ret = Counter(dict(cursor.fetchall()))
         conn.close()
-        return Counter(ret)
+        return ret
 
     def get_timestamp(self, msgID):
         conn = Database.connect_database(self.PATH)
@@ -817,6 +994,18 @@ class VendorStore(object):
             conn.commit()
         conn.close()
 
+    def save_vendors(self, vendors):
+        """
+        Save a list of (guid, serialized_node) tuples in one transaction.
+        """
+        conn = Database.connect_database(self.PATH)
+        with conn:
+            cursor = conn.cursor()
+            cursor.executemany('''INSERT OR REPLACE INTO vendors(guid, serializedNode)
+    VALUES (?,?)''', vendors)
+            conn.commit()
+        conn.close()
+
     def get_vendors(self):
         conn = Database.connect_database(self.PATH)
         cursor = conn.cursor()
@@ -1394,20 +1583,78 @@ smtpRecipient, smtpUsername, smtpPassword) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?
 class ShoppingEvents(object):
     """
     Stores audit events for shoppers on your storefront
+
+    The number of events per contract and action is also rolled up into hourly and
+    daily buckets as the events are written, so storefront analytics don't have to
+    scan the raw events. Old events and hourly buckets are removed by `prune`.
     """
 
+    ROLLUPS = (("audit_hourly", 3600), ("audit_daily", 86400))
+
     def __init__(self, database_path):
         self.PATH = database_path
 
     def set(self, shopper_guid, action_id, contract_hash=None):
+        self.set_many([(shopper_guid, int(time.time()), contract_hash or '', action_id)])
+
+    def set_many(self, events):
+        """
+        Insert a batch of events, and update the rollups, in one transaction.
+
+        Args:
+            events: a list of (shopper_guid, timestamp, contract_hash, action_id) tuples.
+        """
+        conn = Database.connect_database(self.PATH)
+        with conn:
+            cursor = conn.cursor()
+            cursor.executemany('''INSERT INTO audit_shopping(shopper_guid, timestamp, contract_hash, action_id)
+                                  VALUES (?,?,?,?)''', events)
+            for table, seconds in self.ROLLUPS:
+                counts = Counter((timestamp - timestamp % seconds, contract_hash, action_id)
+                                 for _, timestamp, contract_hash, action_id in events)
+                cursor.executemany('''INSERT OR IGNORE INTO %s(bucket, contract_hash, action_id, events)
+                                      VALUES (?,?,?,0)''' % table, counts.keys())
+                cursor.executemany('''UPDATE %s SET events=events+? WHERE bucket=? AND contract_hash=?
+                                      AND action_id=?''' % table, [(n,) + k for k, n in counts.items()])
+            conn.commit()
+        conn.close()
+
+    def get_rollups(self, daily=False, start=0, end=None, contract_hash=None):
+        """
+        Returns the number of events per bucket, contract and action as a list of
+        (bucket, contract_hash, action_id, events) tuples, oldest first.
+
+        Args:
+            daily: use the daily buckets rather than the hourly ones.
+            start: the earliest bucket to return (a unix timestamp).
+            end: the latest bucket to return, defaults to now.
+            contract_hash: only return the events for this contract.
+        """
+        table = "audit_daily" if daily else "audit_hourly"
+        if end is None:
+            end = int(time.time())
+        conn = Database.connect_database(self.PATH)
+        cursor = conn.cursor()
+        if contract_hash is None:
+            cursor.execute('''SELECT bucket, contract_hash, action_id, events FROM %s WHERE bucket BETWEEN ? AND ?
+                              ORDER BY bucket''' % table, (start, end))
+        else:
+            cursor.execute('''SELECT bucket, contract_hash, action_id, events FROM %s WHERE contract_hash=?
+                              AND bucket BETWEEN ? AND ? ORDER BY bucket''' % table, (contract_hash, start, end))
+        ret = cursor.fetchall()
+        conn.close()
+        return ret
+
+    def prune(self, events_before, hourly_before):
+        """
+        Delete the raw events older than `events_before` and the hourly buckets
+        older than `hourly_before` (unix timestamps). The daily buckets are kept.
+        """
         conn = Database.connect_database(self.PATH)
         with conn:
             cursor = conn.cursor()
-            timestamp = int(time.time())
-            if not contract_hash:
-                contract_hash = ''
-            cursor.execute('''INSERT INTO audit_shopping(shopper_guid, timestamp, contract_hash, action_id) VALUES
-                              (?,?,?,?)''', (shopper_guid, timestamp, contract_hash, action_id))
+            cursor.execute('''DELETE FROM audit_shopping WHERE timestamp<?''', (events_before,))
+            cursor.execute('''DELETE FROM audit_hourly WHERE bucket<?''', (hourly_before,))
             conn.commit()
         conn.close()
 
@@ -0,0 +1,124 @@
+__author__ = 'chris'
+
+import Queue
+import threading
+from twisted.internet import defer, reactor
+from twisted.python.failure import Failure
+
+
+class DeferredDatabase(object):
+    """
+    Runs `Database` calls in a dedicated thread so SQLite (checkpoints, long scans,
+    fsyncs) never blocks the reactor. Calls are queued and run one at a time in the
+    order they were made, so there is only ever one writer. Results come back as
+    Deferreds, fired in the reactor thread.
+
+    Each store is mirrored with Deferred returning methods:
+
+        db.deferred.messages.get_conversations().addCallback(...)
+
+    and `run(func, *args)` calls any function in the thread, which is the way to
+    make several store calls in one transaction.
+
+    The stores' in-memory caches are shared with the reactor thread, so only
+    simple assignments to them are safe from here.
+    """
+
+    def __init__(self, db, threaded=True):
+        """
+        Args:
+            db: the `Database`.
+            threaded: if False, calls run synchronously in the calling thread (for tests).
+        """
+        self.db = db
+        self.threaded = threaded
+        self.queue = Queue.Queue()
+        self.thread = None
+        self.trigger = None
+        self.stores = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        store = self.stores.get(name)
+        if store is None:
+            store = self.stores[name] = _DeferredStore(self, getattr(self.db, name))
+        return store
+
+    def run(self, func, *args, **kwargs):
+        """
+        Call `func(*args, **kwargs)` in the database thread.
+
+        Returns:
+            A deferred which fires with the return value, or errbacks with the exception.
+        """
+        if not self.threaded:
+            return defer.maybeDeferred(func, *args, **kwargs)
+        if self.thread is None:
+            self.start()
+        d = defer.Deferred()
+        self.queue.put((d, func, args, kwargs))
+        return d
+
+    def start(self):
+        self.thread = threading.Thread(target=self._work, name="database")
+        # daemon, so a forgotten `stop` can't keep the process alive. `stop` runs before shutdown.
+        self.thread.daemon = True
+        self.thread.start()
+        self.trigger = reactor.addSystemEventTrigger("before", "shutdown", self._shutdown)
+
+    def stop(self):
+        """
+        Stop the thread once the queued calls have run.
+
+        Returns:
+            A deferred which fires when they're done.
+        """
+        if self.trigger is not None:
+            reactor.removeSystemEventTrigger(self.trigger)
+            self.trigger = None
+        if self.thread is None:
+            return defer.succeed(None)
+        d = self.run(lambda: None)
+        self.queue.put(None)
+        self.thread = None
+        return d
+
+    def _shutdown(self):
+        # the trigger is firing, so it's too late to remove it
+        self.trigger = None
+        return self.stop()
+
+    def _work(self):
+        while True:
+            call = self.queue.get()
+            if call is None:
+                return
+            d, func, args, kwargs = call
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                result = Failure()
+            reactor.callFromThread(self._fire, d, result)
+
+    @staticmethod
+    def _fire(d, result):
+        if isinstance(result, Failure):
+            d.errback(result)
+        else:
+            d.callback(result)
+
+
+class _DeferredStore(object):
+    """A store whose methods run in the database thread and return Deferreds."""
+
+    def __init__(self, deferred_db, store):
+        self.deferred_db = deferred_db
+        self.store = store
+
+    def __getattr__(self, name):
+        method = getattr(self.store, name)
+
+        def call(*args, **kwargs):
+            return self.deferred_db.run(method, *args, **kwargs)
+        return call
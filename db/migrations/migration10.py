@@ -0,0 +1,26 @@
+import sqlite3
+from protos import objects
+
+
+def migrate(database_path):
+    print "migrating to db version 10"
+    conn = sqlite3.connect(database_path)
+    conn.text_factory = str
+    cursor = conn.cursor()
+
+    # replace the single serialized Following blob with a row per followed user
+    cursor.execute('''SELECT serializedFollowing FROM following WHERE id = 1''')
+    ret = cursor.fetchone()
+    cursor.execute('''DROP TABLE following''')
+    cursor.execute('''CREATE TABLE following(guid BLOB PRIMARY KEY, serializedUser BLOB)''')
+    if ret is not None and ret[0] is not None:
+        f = objects.Following()
+        f.ParseFromString(ret[0])
+        for user in f.users:
+            cursor.execute('''INSERT OR REPLACE INTO following(guid, serializedUser) VALUES (?,?)''',
+                           (user.guid, user.SerializeToString()))
+
+    # update version
+    cursor.execute('''PRAGMA user_version = 10''')
+    conn.commit()
+    conn.close()
@@ -0,0 +1,22 @@
+import sqlite3
+
+
+def migrate(database_path):
+    print "migrating to db version 11"
+    conn = sqlite3.connect(database_path)
+    conn.text_factory = str
+    cursor = conn.cursor()
+
+    # store the followers as raw bytes rather than hex, keeping the order they followed in
+    cursor.execute('''SELECT guid, serializedFollower FROM followers ORDER BY rowid''')
+    followers = cursor.fetchall()
+    cursor.execute('''DROP TABLE followers''')
+    cursor.execute('''CREATE TABLE followers(guid BLOB PRIMARY KEY, serializedFollower BLOB)''')
+    for guid, ser in followers:
+        cursor.execute('''INSERT OR REPLACE INTO followers(guid, serializedFollower) VALUES (?,?)''',
+                       (guid.decode("hex"), ser.decode("hex")))
+
+    # update version
+    cursor.execute('''PRAGMA user_version = 11''')
+    conn.commit()
+    conn.close()
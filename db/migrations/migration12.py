@@ -0,0 +1,18 @@
+import sqlite3
+
+
+def migrate(database_path):
+    print "migrating to db version 12"
+    conn = sqlite3.connect(database_path)
+    conn.text_factory = str
+    cursor = conn.cursor()
+
+    # conversations and message lists are looked up by guid, type and time. This covers index_guid too.
+    cursor.execute('''CREATE INDEX IF NOT EXISTS index_messages_conversation
+    ON messages(guid, messageType, "timestamp")''')
+    cursor.execute('''DROP INDEX IF EXISTS index_guid''')
+
+    # update version
+    cursor.execute('''PRAGMA user_version = 12''')
+    conn.commit()
+    conn.close()
@@ -0,0 +1,32 @@
+import sqlite3
+
+
+def migrate(database_path):
+    print "migrating to db version 8"
+    conn = sqlite3.connect(database_path)
+    conn.text_factory = str
+    cursor = conn.cursor()
+
+    # the old indexes were both on the primary key
+    cursor.execute('''DROP INDEX IF EXISTS shopper_guid_index''')
+    cursor.execute('''DROP INDEX IF EXISTS action_id_index''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS index_audit_shopper
+    ON audit_shopping(shopper_guid, "timestamp")''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS index_audit_contract
+    ON audit_shopping(contract_hash, "timestamp")''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS index_audit_timestamp ON audit_shopping("timestamp")''')
+
+    # create the rollup tables and fill them from the existing events
+    for table, seconds in (("audit_hourly", 3600), ("audit_daily", 86400)):
+        cursor.execute('''CREATE TABLE IF NOT EXISTS %s(bucket INTEGER NOT NULL, contract_hash TEXT NOT NULL,
+    action_id INTEGER NOT NULL, events INTEGER NOT NULL, PRIMARY KEY(bucket, contract_hash, action_id))''' % table)
+        cursor.execute('''CREATE INDEX IF NOT EXISTS index_%s_contract
+    ON %s(contract_hash, bucket)''' % (table, table))
+        cursor.execute('''INSERT OR REPLACE INTO %s(bucket, contract_hash, action_id, events)
+    SELECT "timestamp" - "timestamp" %% %d, COALESCE(contract_hash, ''), action_id, COUNT(*) FROM audit_shopping
+    GROUP BY 1, 2, 3''' % (table, seconds))
+
+    # update version
+    cursor.execute('''PRAGMA user_version = 8''')
+    conn.commit()
+    conn.close()
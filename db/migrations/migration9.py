@@ -0,0 +1,28 @@
+import sqlite3
+from protos import objects
+
+
+def migrate(database_path):
+    print "migrating to db version 9"
+    conn = sqlite3.connect(database_path)
+    conn.text_factory = str
+    cursor = conn.cursor()
+
+    # replace the single serialized Listings blob with a row per listing
+    cursor.execute('''SELECT serializedListings FROM listings WHERE id = 1''')
+    ret = cursor.fetchone()
+    cursor.execute('''DROP TABLE listings''')
+    cursor.execute('''CREATE TABLE listings(contractHash BLOB PRIMARY KEY, serializedListing BLOB,
+    pinned INTEGER, hidden INTEGER, lastModified INTEGER)''')
+    if ret is not None and ret[0] is not None:
+        l = objects.Listings()
+        l.ParseFromString(ret[0])
+        for listing in l.listing:
+            cursor.execute('''INSERT OR REPLACE INTO listings(contractHash, serializedListing, pinned, hidden,
+    lastModified) VALUES (?,?,?,?,?)''', (listing.contract_hash, listing.SerializeToString(),
+                                          int(listing.pinned), int(listing.hidden), listing.last_modified))
+
+    # update version
+    cursor.execute('''PRAGMA user_version = 9''')
+    conn.commit()
+    conn.close()
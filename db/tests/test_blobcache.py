@@ -0,0 +1,41 @@
+__author__ = 'chris'
+
+import unittest
+
+from db.blobcache import BlobCache
+
+
+class BlobCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = BlobCache(max_size=10, max_blob_size=6)
+
+    def test_get(self):
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.add("a", "12345")
+        self.assertEqual(self.cache.get("a"), "12345")
+        stats = self.cache.get_stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["bytes_served"], 5)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.add("a", "12345")
+        self.cache.add("b", "12345")
+        self.cache.get("a")
+        self.cache.add("c", "123")
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("a"), "12345")
+        self.assertEqual(self.cache.size, 8)
+
+    def test_large_blob_not_cached(self):
+        self.cache.add("a", "1234567")
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.size, 0)
+
+    def test_invalidate(self):
+        self.cache.add("a", "12345")
+        self.cache.add("a", "123")
+        self.assertEqual(self.cache.size, 3)
+        self.cache.invalidate("a")
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.size, 0)
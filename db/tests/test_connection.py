@@ -0,0 +1,63 @@
+__author__ = 'chris'
+
+import os
+import threading
+import unittest
+
+from db import connection
+
+
+class ConnectionTest(unittest.TestCase):
+    def setUp(self):
+        self.path = "test_connection.db"
+        self.conn = connection.connect(self.path)
+        self.conn.execute('''CREATE TABLE t(a INTEGER)''')
+
+    def tearDown(self):
+        connection.close_all(self.path)
+        os.remove(self.path)
+        self.assertFalse(os.path.exists(self.path + "-wal"))
+
+    def count(self):
+        return connection.connect(self.path).execute('''SELECT COUNT(*) FROM t''').fetchone()[0]
+
+    def test_pooled_per_thread(self):
+        self.assertIs(connection.connect(self.path), self.conn)
+        self.assertEqual(self.conn.execute('''PRAGMA journal_mode''').fetchone()[0], "wal")
+        other = []
+        t = threading.Thread(target=lambda: other.append(connection.connect(self.path)))
+        t.start()
+        t.join()
+        self.assertIsNot(other[0], self.conn)
+
+    def test_close_rolls_back(self):
+        self.conn.execute('''INSERT INTO t VALUES (1)''')
+        self.conn.close()
+        self.assertEqual(self.count(), 0)
+
+    def test_nested_transaction(self):
+        with self.conn:
+            self.conn.execute('''INSERT INTO t VALUES (1)''')
+            with connection.connect(self.path) as inner:
+                inner.execute('''INSERT INTO t VALUES (2)''')
+                inner.commit()
+            inner.close()
+            self.assertEqual(self.conn.depth, 1)
+        self.conn.close()
+        self.assertEqual(self.count(), 2)
+
+    def test_transaction_rolled_back(self):
+        try:
+            with self.conn:
+                self.conn.executemany('''INSERT INTO t VALUES (?)''', [(1,), (2,)])
+                with self.conn:
+                    raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(self.conn.depth, 0)
+        self.assertEqual(self.count(), 0)
+
+    def test_close_all(self):
+        connection.close_all(self.path)
+        self.assertTrue(self.conn.closed)
+        self.assertIsNot(connection.connect(self.path), self.conn)
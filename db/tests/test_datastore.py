@@ -1,6 +1,7 @@
 import os
 import unittest
 import time
+from db import connection
 from db.datastore import Database
 from dht.utils import digest
 from config import DATA_FOLDER
@@ -70,6 +71,7 @@ class DatastoreTest(unittest.TestCase):
         self.settings = self.db.settings
 
     def tearDown(self):
+        connection.close_all("test.db")
         os.remove("test.db")
 
     def test_hashmapInsert(self):
@@ -85,6 +87,21 @@ class DatastoreTest(unittest.TestCase):
         v = self.hm.get_file(self.test_hash)
         self.assertIsNone(v)
 
+    def test_hashmapRead(self):
+        path = os.path.join("store", "media", self.test_hash)
+        with open(DATA_FOLDER + path, "wb") as f:
+            f.write("image")
+        self.addCleanup(os.remove, DATA_FOLDER + path)
+        self.hm.insert(self.test_hash, path)
+        self.assertEqual(self.hm.read(self.test_hash), "image")
+        with open(DATA_FOLDER + path, "wb") as f:
+            f.write("new image")
+        self.assertEqual(self.hm.read(self.test_hash), "image")
+        self.hm.insert(self.test_hash, path)
+        self.assertEqual(self.hm.read(self.test_hash), "new image")
+        self.hm.delete(self.test_hash)
+        self.assertIsNone(self.hm.read(self.test_hash))
+
     def test_hashmapGetEmpty(self):
         f = self.hm.get_file('87e0555568bf5c7e4debd6645fc3f41e88df6ca9')
         self.assertEqual(f, None)
@@ -121,6 +138,25 @@ class DatastoreTest(unittest.TestCase):
         self.assertEqual(self.lm, val.listing[0])
         self.assertEqual(1, len(val.listing))
 
+    def test_listingsOrder(self):
+        self.ls.delete_all_listings()
+        lm2 = Listings.ListingMetadata()
+        lm2.contract_hash = self.test_hash2
+        lm2.hidden = True
+        self.ls.add_listing(self.lm)
+        self.ls.add_listing(lm2)
+        self.ls.add_listing(self.lm)
+        ser = self.ls.get_proto()
+        self.assertIs(ser, self.ls.get_proto())
+        val = Listings()
+        val.ParseFromString(ser)
+        self.assertEqual([lm2, self.lm], list(val.listing))
+        self.assertEqual(lm2.SerializeToString(), self.ls.get_listing(self.test_hash2))
+
+        # a new store reads the rows back in the same order
+        val.ParseFromString(Database(filepath="test.db").listings.get_proto())
+        self.assertEqual([lm2, self.lm], list(val.listing))
+
     def test_deleteListing(self):
         self.ls.delete_all_listings()
         self.ls.add_listing(self.lm)
@@ -133,6 +169,8 @@ class DatastoreTest(unittest.TestCase):
         # Try to delete when table is already empty
         self.ls.delete_all_listings()
         self.assertEqual(None, self.ls.delete_listing(self.test_hash))
+        # still an empty `Listings` after a restart
+        self.assertEqual("", Database(filepath="test.db").listings.get_proto())
 
     def test_setGUIDKey(self):
         self.ks.set_key("guid", "privkey", "signed_privkey")
@@ -161,6 +199,25 @@ class DatastoreTest(unittest.TestCase):
         following = self.fd.get_following()
         self.assertEqual(following, '')
         self.assertFalse(self.fd.is_following(self.u.guid))
+        # still an empty `Following` after a restart
+        self.assertEqual('', Database(filepath="test.db").follow.get_following())
+
+    def test_followingRows(self):
+        u2 = Following.User()
+        u2.guid = '0000000000000000000000000000000000000002'
+        self.fd.follow(self.u)
+        self.fd.follow(u2)
+        self.fd.follow(self.u)
+        ser = self.fd.get_following()
+        self.assertIs(ser, self.fd.get_following())
+        f = Following()
+        f.ParseFromString(ser)
+        self.assertEqual([u2, self.u], list(f.users))
+        self.assertEqual(u2.SerializeToString(), self.fd.get_user(u2.guid))
+        self.assertIsNone(self.fd.get_user('unknown'))
+
+        f.ParseFromString(Database(filepath="test.db").follow.get_following())
+        self.assertEqual([u2, self.u], list(f.users))
 
     def test_deleteFollower(self):
         self.fd.set_follower(self.f.SerializeToString())
@@ -170,6 +227,33 @@ class DatastoreTest(unittest.TestCase):
         self.fd.delete_follower(self.f.guid)
         f = self.fd.get_followers()
         self.assertEqual(f[0], '')
+        self.assertEqual(f[1], 0)
+
+    def test_followersPaging(self):
+        for i in range(65):
+            self.f.guid = "%034d" % i
+            self.fd.set_follower(self.f.SerializeToString())
+        # following again moves them to the front without counting them twice
+        self.f.guid = "%034d" % 0
+        self.fd.set_follower(self.f.SerializeToString())
+        self.fd.delete_follower("%034d" % 64)
+        self.assertEqual(64, Database(filepath="test.db").follow.get_follower_count())
+
+        guids = []
+        ser, count, cursor = self.fd.get_followers()
+        while True:
+            f = Followers()
+            f.ParseFromString(ser)
+            guids.extend(follower.guid for follower in f.followers)
+            self.assertEqual(64, count)
+            if cursor is None:
+                break
+            ser, count, cursor = self.fd.get_followers(cursor=cursor)
+        self.assertEqual(["%034d" % 0] + ["%034d" % i for i in range(63, 0, -1)], guids)
+
+        f = Followers()
+        f.ParseFromString(self.fd.get_followers(30)[0])
+        self.assertEqual(guids[30:60], [follower.guid for follower in f.followers])
 
     def test_MassageStore(self):
         msgs = self.ms.get_messages(self.u.guid, 'CHAT')
@@ -199,6 +283,26 @@ class DatastoreTest(unittest.TestCase):
         msgs = self.ms.get_messages(self.u.guid, 'CHAT')
         self.assertEqual(0, len(msgs))
 
+    def test_conversations(self):
+        other = '0000000000000000000000000000000002'
+        self.ms.save_message(self.u.guid, self.m.handle, 'key1', '', 'CHAT', 'first', 1, 'avatar', '', False)
+        self.ms.save_message(self.u.guid, self.m.handle, 'key1', '', 'CHAT', 'second', 3, 'avatar', '', False)
+        self.ms.save_message(self.u.guid, self.m.handle, 'key1', '', 'CHAT', 'reply', 2, 'avatar', '', True)
+        self.ms.save_message(other, '', 'key2', '', 'CHAT', 'hello', 4, None, '', True)
+        self.ms.save_message(other, '', 'key2', 'order', 'ORDER', 'order message', 5, None, '', False)
+
+        self.assertEqual({self.u.guid: 2}, self.ms.get_unread())
+        conversations = sorted(self.ms.get_conversations(), key=lambda c: c["guid"])
+        self.assertEqual(2, len(conversations))
+        self.assertEqual({"guid": self.u.guid, "avatar_hash": "avatar".encode("hex"), "handle": "",
+                          "last_message": "second", "timestamp": 3, "public_key": "key1".encode("hex"),
+                          "unread": 2}, conversations[0])
+        self.assertEqual(("hello", None, 0), (conversations[1]["last_message"], conversations[1]["avatar_hash"],
+                                              conversations[1]["unread"]))
+
+        self.ms.mark_as_read(self.u.guid)
+        self.assertEqual(0, self.ms.get_conversations()[0]["unread"])
+
     def test_BroadcastStore(self):
         bmsgs = self.bs.get_broadcasts()
         self.assertEqual(0, len(bmsgs))
@@ -333,6 +437,12 @@ class DatastoreTest(unittest.TestCase):
         self.vs.delete_vendor(self.u.guid)
         v = self.vs.get_vendors()
         self.assertEqual(v, {})
+        n2 = Node()
+        n2.CopyFrom(n)
+        n2.guid = digest("hijklmn")
+        self.vs.save_vendors([(self.u.guid, n.SerializeToString()), (self.f.guid, n2.SerializeToString())])
+        v = self.vs.get_vendors()
+        self.assertEqual(2, len(v))
 
     def test_Settings(self):
         NUM_SETTINGS = 20
@@ -344,6 +454,19 @@ class DatastoreTest(unittest.TestCase):
         settings = self.settings.get()
         self.assertEqual(NUM_SETTINGS, len(settings))
 
-
-
-
+    def test_ShoppingEvents(self):
+        events = self.db.audit_shopping
+        events.set_many([("guid1", 3600, "hash", 1), ("guid2", 3700, "hash", 1),
+                         ("guid1", 7300, "hash", 1), ("guid1", 7300, "", 2)])
+        events.set_many([("guid3", 7400, "hash", 1)])
+        self.assertEqual(5, len(events.get()))
+        self.assertEqual([(3600, "hash", 1, 2), (7200, "hash", 1, 2)],
+                         events.get_rollups(contract_hash="hash"))
+        self.assertEqual([(0, "", 2, 1), (0, "hash", 1, 4)],
+                         sorted(events.get_rollups(daily=True)))
+        self.assertEqual([(7200, "", 2, 1), (7200, "hash", 1, 2)], sorted(events.get_rollups(start=7200)))
+
+        events.prune(7300, 7200)
+        self.assertEqual(3, len(events.get()))
+        self.assertEqual(2, len(events.get_rollups()))
+        self.assertEqual(2, len(events.get_rollups(daily=True)))
@@ -0,0 +1,52 @@
+__author__ = 'chris'
+
+import os
+import threading
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from db import connection
+from db.datastore import Database
+
+
+class DeferredDatabaseTest(unittest.TestCase):
+    def setUp(self):
+        self.db = Database(filepath="test.db")
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.db.deferred.stop()
+        connection.close_all("test.db")
+        os.remove("test.db")
+
+    @defer.inlineCallbacks
+    def test_store_methods(self):
+        yield self.db.deferred.vendors.save_vendor("guid", "node")
+        vendors = yield self.db.deferred.run(self.db.vendors.get_vendors)
+        self.assertEqual(self.db.vendors.get_vendors(), vendors)
+        self.assertEqual(self.db.deferred.vendors, self.db.deferred.vendors)
+
+    @defer.inlineCallbacks
+    def test_runs_in_order_in_one_thread(self):
+        results = []
+
+        def call(i):
+            results.append((i, threading.current_thread().name))
+        yield defer.gatherResults([self.db.deferred.run(call, i) for i in range(10)])
+        self.assertEqual([i for i, _ in results], range(10))
+        self.assertEqual(set(name for _, name in results), {"database"})
+
+    def test_errback(self):
+        def fail():
+            raise ValueError("bad")
+        return self.assertFailure(self.db.deferred.run(fail), ValueError)
+
+    @defer.inlineCallbacks
+    def test_stop(self):
+        results = []
+        self.db.deferred.run(results.append, 1)
+        yield self.db.deferred.stop()
+        self.assertEqual(results, [1])
+        self.assertIsNone(self.db.deferred.thread)
+        self.assertIsNone(self.db.deferred.trigger)
@@ -8,6 +8,7 @@ Copyright (c) 2015 OpenBazaar
 import pickle
 import httplib
 import random
+import time
 from binascii import hexlify
 from twisted.internet.task import LoopingCall
 from twisted.internet import defer, reactor, task
@@ -28,7 +29,6 @@ from dht.crawling import NodeSpiderCrawl
 from protos import objects
 
 from config import SEEDS, SEEDS_TESTNET
-from random import shuffle
 
 
 def _anyRespondSuccess(responses):
@@ -172,6 +172,12 @@ class Server(object):
         else:
             d = deferred
 
+        rtts = {}
+
+        def timePing(result, addr, start):
+            rtts[addr] = time.time() - start
+            return result
+
         def initTable(results):
             response = False
             potential_relay_nodes = []
@@ -202,14 +208,17 @@ class Server(object):
                     self.bootstrap(self.querySeed(SEEDS), d)
                 return
             if len(potential_relay_nodes) > 0 and self.node.nat_type != objects.FULL_CONE:
-                shuffle(potential_relay_nodes)
-                self.node.relay_node = potential_relay_nodes[0]
+                relay_manager = self.protocol.multiplexer.relay_manager
+                for addr in potential_relay_nodes:
+                    relay_manager.add_candidate(addr, rtts.get(addr))
+                self.node.relay_node = relay_manager.select()
 
             d.callback(True)
         ds = {}
         for addr in addrs:
             if addr != (self.node.ip, self.node.port):
                 ds[addr] = self.protocol.ping(Node(digest("null"), addr[0], addr[1], nat_type=objects.FULL_CONE))
+                ds[addr].addCallback(timePing, addr, time.time())
         deferredDict(ds).addCallback(initTable)
         return d
 
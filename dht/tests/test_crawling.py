@@ -5,6 +5,7 @@ import nacl.signing
 import nacl.hash
 import os
 from binascii import unhexlify
+from db import connection as db_connection
 from db.datastore import Database
 from dht.crawling import RPCFindResponse, NodeSpiderCrawl, ValueSpiderCrawl
 from dht.node import Node, NodeHeap
@@ -68,6 +69,7 @@ class ValueSpiderCrawlTest(unittest.TestCase):
     def tearDown(self):
         self.con.shutdown()
         self.wire_protocol.shutdown()
+        db_connection.close_all("test.db")
         os.remove("test.db")
 
     def test_find(self):
@@ -249,6 +251,7 @@ class NodeSpiderCrawlTest(unittest.TestCase):
     def tearDown(self):
         self.con.shutdown()
         self.wire_protocol.shutdown()
+        db_connection.close_all("test.db")
         os.remove("test.db")
 
     def test_find(self):
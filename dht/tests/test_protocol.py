@@ -17,8 +17,9 @@ from dht.utils import digest
 from dht.storage import ForgetfulStorage
 from dht.node import Node
 from protos import message, objects
+from net.dos import RateLimit
 from net.wireprotocol import OpenBazaarProtocol
-from db import datastore
+from db import datastore, connection as db_connection
 from config import PROTOCOL_VERSION
 
 
@@ -70,12 +71,34 @@ class KademliaProtocolTest(unittest.TestCase):
         if self.con.state != connection.State.SHUTDOWN:
             self.con.shutdown()
         self.wire_protocol.shutdown()
+        db_connection.close_all("test.db")
         os.remove("test.db")
 
     def test_invalid_datagram(self):
         self.assertFalse(self.handler.receive_message("hi"))
         self.assertFalse(self.handler.receive_message("hihihihihihihihihihihihihihihihihihihihih"))
 
+    def test_sender_node_reused(self):
+        self._connecting_to_connected()
+
+        m = message.Message()
+        m.messageID = digest("msgid")
+        m.sender.MergeFrom(self.protocol.sourceNode.getProto())
+        m.command = message.Command.Value("PING")
+        m.protoVer = self.version
+        m.testnet = False
+        m.signature = self.signing_key.sign(m.SerializeToString())[:64]
+        self.handler.receive_message(m.SerializeToString())
+        node = self.handler.node
+        self.handler.receive_message(m.SerializeToString())
+        self.assertIs(self.handler.node, node)
+
+        m.sender.relayAddress.ip = "1.2.3.4"
+        m.sender.relayAddress.port = 1234
+        self.handler.receive_message(m.SerializeToString())
+        self.assertIsNot(self.handler.node, node)
+        self.assertEqual(self.handler.node.relay_node, ("1.2.3.4", 1234))
+
     def test_rpc_ping(self):
         self._connecting_to_connected()
 
@@ -106,6 +129,29 @@ class KademliaProtocolTest(unittest.TestCase):
         self.assertEqual(received_message, expected_message)
         self.assertEqual(len(m_calls), 2)
 
+    def test_rate_limited_request_answered(self):
+        self._connecting_to_connected()
+        self.wire_protocol.ban_score.limits[message.PING] = RateLimit(0, 0, 1)
+
+        m = message.Message()
+        m.messageID = digest("msgid")
+        m.sender.MergeFrom(self.protocol.sourceNode.getProto())
+        m.command = message.Command.Value("PING")
+        m.protoVer = self.version
+        m.testnet = False
+        m.signature = self.signing_key.sign(m.SerializeToString())[:64]
+        self.handler.on_connection_made()
+        self.handler.receive_message(m.SerializeToString())
+
+        self.clock.advance(100 * constants.PACKET_TIMEOUT)
+        connection.REACTOR.runUntilCurrent()
+        sent_packet = packet.Packet.from_bytes(self.proto_mock.send_datagram.call_args_list[0][0][0])
+        m2 = message.Message()
+        m2.ParseFromString(sent_packet.payload)
+        self.assertEqual(m2.command, message.CALM_DOWN)
+        self.assertEqual(m2.messageID, digest("msgid"))
+        self.assertEqual(len(m2.arguments), 0)
+
     def test_rpc_store(self):
         self._connecting_to_connected()
         self.protocol.router.addContact(self.protocol.sourceNode)
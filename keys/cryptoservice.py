@@ -0,0 +1,238 @@
+__author__ = 'chris'
+
+import base64
+import bitcointools
+import json
+import multiprocessing
+import nacl.hash
+import nacl.signing
+import signal
+from binascii import unhexlify
+from log import Logger
+from nacl.exceptions import BadSignatureError
+from protos import objects
+from twisted.internet import defer, reactor
+
+ED25519 = "ed25519"
+ECDSA = "ecdsa"
+
+
+class CryptoService(object):
+    """
+    Runs CPU heavy crypto (mostly the pure python ECDSA in `bitcointools`) in a pool
+    of worker processes so it doesn't block the reactor. Results come back as Deferreds.
+
+    There only needs to be one instance of the class running, use CryptoService.instance()
+    to access it. If one hasn't been created, `instance()` returns one without a pool which
+    runs everything synchronously in the reactor thread, as before.
+
+    The functions passed to `run` must be module level functions (so they can be pickled)
+    and their arguments and return values must be picklable.
+    """
+    __instance = None
+
+    @staticmethod
+    def instance():
+        if CryptoService.__instance is None:
+            CryptoService(processes=0)
+        return CryptoService.__instance
+
+    def __init__(self, processes=None, timeout=120, clock=reactor):
+        """
+        Args:
+            processes: the number of worker processes. Defaults to one less than the
+                number of cores. Zero runs everything synchronously.
+            timeout: seconds after which a call errbacks if its worker hasn't answered
+                (ex. the worker was killed).
+            clock: an `IReactorTime` provider.
+        """
+        if processes is None:
+            try:
+                processes = max(1, multiprocessing.cpu_count() - 1)
+            except NotImplementedError:
+                processes = 1
+        self.processes = processes
+        self.timeout = timeout
+        self.clock = clock
+        self.pool = None
+        # Deferred -> the timeout for each call waiting on a worker
+        self.pending = {}
+        self.log = Logger(system=self)
+        CryptoService.__instance = self
+
+    def start(self):
+        """
+        Start the worker processes. Call this early, before other threads are started,
+        as the workers are forked from this process.
+        """
+        if self.pool is None and self.processes > 0:
+            try:
+                self.pool = multiprocessing.Pool(self.processes, _init_worker)
+            except (OSError, ImportError, NotImplementedError), e:
+                self.log.warning("unable to start crypto worker pool (%s), running crypto in the reactor" % e)
+                self.processes = 0
+
+    def stop(self):
+        """Terminate the worker processes. The calls still waiting on them errback."""
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+        for d in self.pending.keys():
+            self._fire(d, (False, "the crypto service was stopped"))
+
+    def run(self, func, *args):
+        """
+        Call `func(*args)` in a worker process.
+
+        Returns:
+            A deferred which fires with the return value, or errbacks with the exception
+            raised by the function, or if the worker doesn't answer within `timeout`.
+        """
+        if self.pool is None:
+            return defer.maybeDeferred(func, *args)
+
+        d = defer.Deferred()
+        self.pending[d] = self.clock.callLater(self.timeout, self._fire, d,
+                                               (False, "no answer from the worker in %s seconds" % self.timeout))
+        self.pool.apply_async(_call, (func, args), callback=lambda r: reactor.callFromThread(self._fire, d, r))
+        return d
+
+    def _fire(self, d, result):
+        timeout = self.pending.pop(d, None)
+        if timeout is None:
+            # it already timed out, or the service was stopped
+            return
+        if timeout.active():
+            timeout.cancel()
+        success, value = result
+        if success:
+            d.callback(value)
+        else:
+            d.errback(Exception(value))
+
+
+def _init_worker():
+    # leave ctrl-c to the main process and drop any SIGTERM handler the reactor installed
+    # before the fork, so `Pool.terminate` can kill the worker
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def _call(func, args):
+    """Runs in the worker. Exceptions are returned rather than raised as 2.7's `Pool` has no error callback."""
+    try:
+        return True, func(*args)
+    except Exception, e:
+        return False, "%s: %s" % (e.__class__.__name__, e)
+
+
+def ecdsa_verify(message, signature, pubkey):
+    """
+    Verify a `bitcointools` encoded ECDSA signature.
+
+    Returns:
+        True if the signature is valid.
+    """
+    return bool(bitcointools.ecdsa_raw_verify(message, bitcointools.decode_sig(signature), pubkey))
+
+
+def ecdsa_sign(message, privkey):
+    """Returns the `bitcointools` encoded ECDSA signature of the message."""
+    return bitcointools.encode_sig(*bitcointools.ecdsa_raw_sign(message, privkey))
+
+
+def verify_signature(algorithm, pubkey, message, signature):
+    """Returns True if the `ED25519` (raw pubkey) or `ECDSA` (`bitcointools` encoding) signature is valid."""
+    if algorithm == ED25519:
+        try:
+            nacl.signing.VerifyKey(pubkey).verify(message, signature)
+            return True
+        except BadSignatureError:
+            return False
+    return ecdsa_verify(message, signature, pubkey)
+
+
+def verify_signatures(signatures):
+    """
+    Verify a list of (algorithm, pubkey, message, signature) tuples.
+
+    Returns:
+        True if they're all valid, otherwise a `str` describing the first which isn't.
+    """
+    for algorithm, pubkey, message, signature in signatures:
+        try:
+            if not verify_signature(algorithm, pubkey, message, signature):
+                return "Invalid %s signature" % algorithm
+        except Exception, e:
+            return "Invalid %s signature: %s" % (algorithm, e)
+    return True
+
+
+def vendor_offer_signatures(vendor_offer, guid_pubkey):
+    """
+    Returns the signatures in the "vendor_offer" section of a contract as a list of
+    (algorithm, pubkey, message, signature) tuples: the vendor's guid and bitcoin
+    signatures on the listing and each moderator's signature on their bitcoin key.
+
+    Raises an exception if a moderator's guid doesn't match their key.
+
+    Args:
+        vendor_offer: the `OrderedDict` "vendor_offer" section of a contract.
+        guid_pubkey: the vendor's raw ed25519 public key.
+    """
+    listing = json.dumps(vendor_offer["listing"], indent=4)
+    signatures = [
+        (ED25519, guid_pubkey, listing, base64.b64decode(vendor_offer["signatures"]["guid"])),
+        (ECDSA, vendor_offer["listing"]["id"]["pubkeys"]["bitcoin"], listing, vendor_offer["signatures"]["bitcoin"])
+    ]
+    for moderator in vendor_offer["listing"].get("moderators", []):
+        guid_key = moderator["pubkeys"]["guid"]
+        h = nacl.hash.sha512(unhexlify(guid_key))
+        pow_hash = h[40:]
+        if int(pow_hash[:6], 16) >= 50 or moderator["guid"] != h[:40]:
+            raise Exception("Invalid GUID")
+        signatures.append((ED25519, unhexlify(guid_key), unhexlify(moderator["pubkeys"]["bitcoin"]["key"]),
+                           base64.b64decode(moderator["pubkeys"]["bitcoin"]["signature"])))
+    return signatures
+
+
+def follower_signature(follower):
+    """Returns the (algorithm, pubkey, message, signature) of a `Followers.Follower`."""
+    unsigned = objects.Followers.Follower()
+    unsigned.CopyFrom(follower)
+    unsigned.ClearField("signature")
+    return ED25519, follower.pubkey, unsigned.SerializeToString(), follower.signature
+
+
+def check_follower(follower, following):
+    """Raises an exception if the follower's guid doesn't match its key or it isn't following `following`."""
+    h = nacl.hash.sha512(follower.pubkey)
+    pow_hash = h[40:]
+    if int(pow_hash[:6], 16) >= 50 or follower.guid.encode("hex") != h[:40]:
+        raise Exception('Invalid GUID')
+    if follower.following != following:
+        raise Exception('Invalid follower')
+
+
+def verify_followers(serialized_followers, following):
+    """
+    Verify the signature and guid of each follower in a `Followers` protobuf and
+    drop the ones which are invalid or aren't following `following`.
+
+    Returns:
+        The serialized `Followers` with only the valid followers.
+    """
+    f = objects.Followers()
+    f.ParseFromString(serialized_followers)
+    valid = []
+    for follower in f.followers:
+        try:
+            if not verify_signature(*follower_signature(follower)):
+                raise Exception('Invalid signature')
+            check_follower(follower, following)
+            valid.append(follower)
+        except Exception:
+            pass
+    ret = objects.Followers()
+    ret.followers.extend(valid)
+    return ret.SerializeToString()
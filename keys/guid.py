@@ -2,15 +2,43 @@ __author__ = 'chris'
 
 # pylint: disable=import-error
 #import guidc
+import multiprocessing
+import signal
+import time
 from binascii import hexlify, unhexlify
 
 import nacl.signing
 import nacl.hash
 import nacl.encoding
 
+# The average number of keys tried before one passes `_testpow`.
+EXPECTED_ATTEMPTS = 16 ** 6 / 50
+
 def _testpow(pow_hash):
     return True if int(pow_hash, 16) < 50 else False
 
+def _search(stop, attempts, results, report_every=1000):
+    """
+    Runs in each worker process. Tries keys until one passes the pow or another
+    worker finds one, adding the number tried to the shared `attempts` counter.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    count = 0
+    while not stop.is_set():
+        signing_key = nacl.signing.SigningKey.generate()
+        h = nacl.hash.sha512(signing_key.verify_key.encode())
+        count += 1
+        if _testpow(h[40:46]):
+            results.put(signing_key.encode(encoder=nacl.encoding.HexEncoder))
+            stop.set()
+            break
+        if count == report_every:
+            with attempts.get_lock():
+                attempts.value += count
+            count = 0
+    with attempts.get_lock():
+        attempts.value += count
+
 class GUID(object):
     """
     Class for generating the guid. It can be generated using C code for a modest
@@ -44,6 +72,48 @@ class GUID(object):
         self.verify_key = verify_key
         self.guid = unhexlify(h[:40])
 
+    @classmethod
+    def generate_parallel(cls, processes=None, progress=None, interval=1):
+        """
+        Search for a key on several cores at once. All the workers are stopped as soon
+        as one of them finds a key.
+
+        Args:
+            processes: the number of worker processes. Defaults to the number of cores.
+            progress: a function called every `interval` seconds with the number of keys
+                tried so far (see `EXPECTED_ATTEMPTS`).
+            interval: seconds between progress reports.
+
+        Returns:
+            A tuple of the `GUID` and the total number of keys tried.
+        """
+        if processes is None:
+            try:
+                processes = multiprocessing.cpu_count()
+            except NotImplementedError:
+                processes = 1
+        stop = multiprocessing.Event()
+        attempts = multiprocessing.Value("L", 0)
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=_search, args=(stop, attempts, results))
+                   for _ in range(processes)]
+        for w in workers:
+            w.daemon = True
+            w.start()
+        try:
+            while not stop.wait(interval):
+                if progress is not None:
+                    progress(attempts.value)
+            privkey = results.get()
+        finally:
+            stop.set()
+            deadline = time.time() + 5
+            for w in workers:
+                w.join(max(0, deadline - time.time()))
+                if w.is_alive():
+                    w.terminate()
+        return cls.from_privkey(privkey), attempts.value
+
     @classmethod
     def from_privkey(cls, privkey):
         signing_key = nacl.signing.SigningKey(privkey, encoder=nacl.encoding.HexEncoder)
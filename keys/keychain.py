@@ -3,10 +3,29 @@ import bitcointools
 import nacl.signing
 import nacl.encoding
 import threading
-from keys.guid import GUID
+from keys.guid import GUID, EXPECTED_ATTEMPTS
+from twisted.internet import reactor
 
 
 class KeyChain(object):
+    """
+    Holds this node's guid and bitcoin keys. Deriving them takes a couple of queries
+    and a SHA-512, so one keychain is kept per database; use `KeyChain.get(db)`.
+    """
+    __keychains = {}
+
+    @staticmethod
+    def get(database):
+        """Returns the cached keychain for the database, loading it if needed."""
+        keychain = KeyChain.__keychains.get(database.PATH)
+        if keychain is None:
+            keychain = KeyChain(database)
+        return keychain
+
+    @staticmethod
+    def invalidate(database_path):
+        """Drop the cached keychain. Called when the keys in the database change."""
+        KeyChain.__keychains.pop(database_path, None)
 
     def __init__(self, database, callback=None, heartbeat_server=None):
         self.db = database
@@ -14,7 +33,7 @@ class KeyChain(object):
         if guid_keys is None:
             if heartbeat_server:
                 heartbeat_server.set_status("generating GUID")
-            threading.Thread(target=self.create_keychain, args=[callback]).start()
+            threading.Thread(target=self.create_keychain, args=[callback, heartbeat_server]).start()
         else:
             g = GUID.from_privkey(guid_keys[0])
             self.guid = g.guid
@@ -24,17 +43,28 @@ class KeyChain(object):
             self.bitcoin_master_privkey, self.bitcoin_master_pubkey = self.db.keys.get_key("bitcoin")
             self.encryption_key = self.signing_key.to_curve25519_private_key()
             self.encryption_pubkey = self.verify_key.to_curve25519_public_key()
+            KeyChain.__keychains[self.db.PATH] = self
             if callable(callback):
                 callback(self)
 
-    def create_keychain(self, callback=None):
+    def create_keychain(self, callback=None, heartbeat_server=None):
         """
         The guid generation can take a while. While it's doing that we will
         open a port to allow a UI to connect and listen for generation to
-        complete.
+        complete. The search is spread over all cores and its progress is
+        pushed out with the heartbeat.
         """
         print "Generating GUID, this may take a few minutes..."
-        g = GUID()
+
+        def progress(attempts):
+            if heartbeat_server:
+                percent = min(99, attempts * 100 / EXPECTED_ATTEMPTS)
+                reactor.callFromThread(heartbeat_server.set_progress, percent)
+
+        g, attempts = GUID.generate_parallel(progress=progress)
+        print "Found a GUID after %s attempts" % attempts
+        if heartbeat_server:
+            reactor.callFromThread(heartbeat_server.set_progress, None)
         self.guid = g.guid
         self.signing_key = g.signing_key
         self.verify_key = g.verify_key
@@ -47,5 +77,6 @@ class KeyChain(object):
 
         self.encryption_key = self.signing_key.to_curve25519_private_key()
         self.encryption_pubkey = self.verify_key.to_curve25519_public_key()
+        KeyChain.__keychains[self.db.PATH] = self
         if callable(callback):
             callback(self, True)
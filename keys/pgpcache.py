@@ -0,0 +1,110 @@
+__author__ = 'chris'
+
+import gnupg
+from collections import OrderedDict
+from hashlib import sha256
+from twisted.internet import defer, threads
+
+
+def _verify(public_key, signature):
+    """Import the key and verify the signature. Runs in a worker thread."""
+    gpg = gnupg.GPG()
+    gpg.import_keys(public_key)
+    return bool(gpg.verify(signature))
+
+
+class PGPCache(object):
+    """
+    Caches the result of verifying a PGP signature with a public key.
+
+    Verifying spawns gpg subprocesses and touches the keyring, so the same
+    (public key, signature) pair is only ever verified once and `verify_in_thread`
+    does the work in the reactor's thread pool. Results are kept in a bounded LRU
+    keyed by a hash of the pair.
+
+    There only needs to be one instance of the class, use PGPCache.instance() to access it.
+    """
+    __instance = None
+
+    @staticmethod
+    def instance():
+        if PGPCache.__instance is None:
+            PGPCache()
+        return PGPCache.__instance
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self.results = OrderedDict()
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+        PGPCache.__instance = self
+
+    @staticmethod
+    def _key(public_key, signature):
+        return sha256(str(len(public_key)) + ":" + public_key + signature).digest()
+
+    def get(self, public_key, signature):
+        """Returns the cached result, or `None` if this pair hasn't been verified."""
+        k = self._key(public_key, signature)
+        try:
+            valid = self.results.pop(k)
+        except KeyError:
+            self.misses += 1
+            return None
+        self.results[k] = valid
+        self.hits += 1
+        return valid
+
+    def _store(self, k, valid):
+        self.results.pop(k, None)
+        if len(self.results) >= self.max_entries:
+            self.results.popitem(last=False)
+        self.results[k] = valid
+        return valid
+
+    def verify(self, public_key, signature):
+        """Verify in the calling thread. Returns True if the signature is valid."""
+        valid = self.get(public_key, signature)
+        if valid is None:
+            valid = self._store(self._key(public_key, signature), _verify(public_key, signature))
+        return valid
+
+    def verify_in_thread(self, public_key, signature):
+        """
+        Verify in a worker thread. Concurrent requests to verify the same pair share
+        the one verification.
+
+        Returns:
+            A deferred which fires with True if the signature is valid.
+        """
+        valid = self.get(public_key, signature)
+        if valid is not None:
+            return defer.succeed(valid)
+
+        k = self._key(public_key, signature)
+        d = defer.Deferred()
+        if k in self.pending:
+            self.pending[k].append(d)
+            return d
+        self.pending[k] = [d]
+
+        def done(result):
+            if isinstance(result, bool):
+                self._store(k, result)
+            else:
+                result = False
+            for waiting in self.pending.pop(k):
+                waiting.callback(result)
+
+        threads.deferToThread(_verify, public_key, signature).addBoth(done)
+        return d
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": float(self.hits) / lookups if lookups else None,
+            "entries": len(self.results)
+        }
@@ -0,0 +1,136 @@
+__author__ = 'chris'
+
+import nacl.encoding
+import nacl.signing
+from collections import OrderedDict
+from hashlib import sha256
+from keys.cryptoservice import CryptoService, ED25519, ECDSA, ecdsa_verify, verify_signatures
+from twisted.internet import defer
+
+
+class SignatureCache(object):
+    """
+    Remembers signatures we've already verified so the same signed objects (followers,
+    followed users' metadata, listings, moderator keys) aren't verified over and over.
+
+    Only successful verifications are recorded, keyed by (algorithm, pubkey, digest of
+    the message, signature), in a bounded LRU. `VerifyKey` objects are cached per pubkey
+    in a second LRU.
+
+    There only needs to be one instance of the class, use SignatureCache.instance() to access it.
+    """
+    __instance = None
+
+    @staticmethod
+    def instance():
+        if SignatureCache.__instance is None:
+            SignatureCache()
+        return SignatureCache.__instance
+
+    def __init__(self, max_signatures=10000, max_keys=1000):
+        """
+        Args:
+            max_signatures: the number of verified signatures to remember.
+            max_keys: the number of `VerifyKey` objects to keep.
+        """
+        self.max_signatures = max_signatures
+        self.max_keys = max_keys
+        self.signatures = OrderedDict()
+        self.keys = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        SignatureCache.__instance = self
+
+    def verify_key(self, pubkey, encoder=nacl.encoding.RawEncoder):
+        """Returns a (cached) `nacl.signing.VerifyKey` for the pubkey."""
+        k = (pubkey, encoder)
+        try:
+            verify_key = self.keys.pop(k)
+        except KeyError:
+            verify_key = nacl.signing.VerifyKey(pubkey, encoder=encoder)
+            if len(self.keys) >= self.max_keys:
+                self.keys.popitem(last=False)
+        self.keys[k] = verify_key
+        return verify_key
+
+    @staticmethod
+    def _key(algorithm, pubkey, message, signature):
+        return algorithm, pubkey, sha256(message).digest(), signature
+
+    def contains(self, algorithm, pubkey, message, signature):
+        """Returns True, and counts a hit, if this signature has already been verified."""
+        k = self._key(algorithm, pubkey, message, signature)
+        if k in self.signatures:
+            self.signatures[k] = self.signatures.pop(k)
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, algorithm, pubkey, message, signature):
+        """Record a signature which verified successfully."""
+        k = self._key(algorithm, pubkey, message, signature)
+        self.signatures.pop(k, None)
+        if len(self.signatures) >= self.max_signatures:
+            self.signatures.popitem(last=False)
+        self.signatures[k] = True
+
+    def verify(self, pubkey, message, signature, encoder=nacl.encoding.RawEncoder, cache=True):
+        """
+        A cached `nacl.signing.VerifyKey(pubkey, encoder).verify(message, signature)`.
+        Raises `BadSignatureError` if the signature is invalid.
+
+        Pass `cache=False` for signatures which won't be verified again (ex. on a
+        message or a broadcast) so they don't push reusable ones out of the cache.
+        """
+        verify_key = self.verify_key(pubkey, encoder)
+        if not cache:
+            verify_key.verify(message, signature)
+            return message
+        raw_pubkey = verify_key.encode()
+        if self.contains(ED25519, raw_pubkey, message, signature):
+            return message
+        verify_key.verify(message, signature)
+        self.add(ED25519, raw_pubkey, message, signature)
+        return message
+
+    def ecdsa_verify(self, message, signature, pubkey):
+        """A cached `cryptoservice.ecdsa_verify`. Returns True if the signature is valid."""
+        if self.contains(ECDSA, pubkey, message, signature):
+            return True
+        if not ecdsa_verify(message, signature, pubkey):
+            return False
+        self.add(ECDSA, pubkey, message, signature)
+        return True
+
+    def verify_all(self, signatures):
+        """
+        Verify a list of (algorithm, pubkey, message, signature) tuples in the
+        `CryptoService`, skipping the ones already in the cache.
+
+        Returns:
+            A deferred which fires with True if they're all valid, otherwise a `str`
+            describing the first which isn't.
+        """
+        unverified = [s for s in signatures if not self.contains(*s)]
+        if not unverified:
+            return defer.succeed(True)
+
+        def record(valid):
+            if valid is True:
+                for s in unverified:
+                    self.add(*s)
+            return valid
+
+        return CryptoService.instance().run(verify_signatures, unverified).addCallback(record)
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": float(self.hits) / lookups if lookups else None,
+            "signatures": len(self.signatures),
+            "keys": len(self.keys)
+        }
+
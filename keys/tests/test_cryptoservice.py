@@ -0,0 +1,85 @@
+__author__ = 'chris'
+
+import bitcointools
+import nacl.signing
+import time
+from twisted.internet import task
+from twisted.trial import unittest
+
+from keys.cryptoservice import CryptoService, ecdsa_sign, ecdsa_verify, verify_followers
+from protos import objects
+
+
+def fail():
+    raise ValueError("nope")
+
+
+class CryptoServiceTest(unittest.TestCase):
+    def setUp(self):
+        self.privkey = bitcointools.sha256("test key")
+        self.pubkey = bitcointools.privkey_to_pubkey(self.privkey)
+
+    def test_sign_and_verify(self):
+        sig = ecdsa_sign("message", self.privkey)
+        self.assertTrue(ecdsa_verify("message", sig, self.pubkey))
+        self.assertFalse(ecdsa_verify("another message", sig, self.pubkey))
+
+    def test_synchronous(self):
+        service = CryptoService(processes=0)
+        service.start()
+        self.assertIsNone(service.pool)
+        d = service.run(ecdsa_sign, "message", self.privkey)
+        return d.addCallback(lambda sig: self.assertTrue(ecdsa_verify("message", sig, self.pubkey)))
+
+    def test_pool(self):
+        service = CryptoService(processes=1)
+        service.start()
+        self.addCleanup(service.stop)
+        self.assertIs(CryptoService.instance(), service)
+        d = service.run(ecdsa_sign, "message", self.privkey)
+        self.assertEqual(len(service.pending), 1)
+
+        def check(sig):
+            self.assertEqual(len(service.pending), 0)
+            self.assertTrue(ecdsa_verify("message", sig, self.pubkey))
+        return d.addCallback(check)
+
+    def test_pool_error(self):
+        service = CryptoService(processes=1)
+        service.start()
+        self.addCleanup(service.stop)
+        d = service.run(fail)
+        return self.assertFailure(d, Exception).addCallback(
+            lambda e: self.assertEqual(str(e), "ValueError: nope"))
+
+    def test_pool_timeout(self):
+        clock = task.Clock()
+        service = CryptoService(processes=1, timeout=5, clock=clock)
+        service.start()
+        self.addCleanup(service.stop)
+        d = service.run(time.sleep, 10)
+        clock.advance(5)
+        self.assertEqual(service.pending, {})
+        return self.assertFailure(d, Exception).addCallback(
+            lambda e: self.assertEqual(str(e), "no answer from the worker in 5 seconds"))
+
+    def test_stop_fails_pending(self):
+        clock = task.Clock()
+        service = CryptoService(processes=1, clock=clock)
+        service.start()
+        d = service.run(time.sleep, 10)
+        service.stop()
+        self.assertEqual(clock.getDelayedCalls(), [])
+        return self.assertFailure(d, Exception)
+
+    def test_verify_followers_drops_invalid(self):
+        signing_key = nacl.signing.SigningKey.generate()
+        f = objects.Followers()
+        follower = f.followers.add()
+        follower.guid = "a" * 20
+        follower.following = "b" * 20
+        follower.pubkey = signing_key.verify_key.encode()
+        follower.signature = signing_key.sign(follower.SerializeToString())[:64]
+        valid = objects.Followers()
+        valid.ParseFromString(verify_followers(f.SerializeToString(), "b" * 20))
+        self.assertEqual(len(valid.followers), 0)
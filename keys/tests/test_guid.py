@@ -0,0 +1,33 @@
+__author__ = 'chris'
+
+import unittest
+
+import nacl.hash
+from binascii import hexlify
+
+from keys import guid
+from keys.guid import GUID
+
+
+class GUIDTest(unittest.TestCase):
+    def setUp(self):
+        # an easy target so the search finishes quickly. The workers are forked so they see it too.
+        self.testpow = guid._testpow
+        guid._testpow = lambda pow_hash: int(pow_hash, 16) < 0x100000
+
+    def tearDown(self):
+        guid._testpow = self.testpow
+
+    def test_generate_parallel(self):
+        reports = []
+        g, attempts = GUID.generate_parallel(processes=2, progress=reports.append, interval=0.01)
+        self.assertGreater(attempts, 0)
+        h = nacl.hash.sha512(g.verify_key.encode())
+        self.assertEqual(hexlify(g.guid), h[:40])
+        self.assertTrue(guid._testpow(h[40:46]))
+        self.assertEqual(reports, sorted(reports))
+
+    def test_from_privkey(self):
+        g = GUID.generate_parallel(processes=1)[0]
+        privkey = hexlify(g.signing_key.encode())
+        self.assertEqual(GUID.from_privkey(privkey).guid, g.guid)
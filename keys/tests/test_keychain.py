@@ -0,0 +1,50 @@
+__author__ = 'chris'
+
+import os
+import unittest
+
+import bitcointools
+import nacl.encoding
+import nacl.signing
+
+from db import connection
+from db.datastore import Database
+from keys.keychain import KeyChain
+
+# private keys which pass the guid proof of work
+PRIVKEY = "37323765d8bf38f506754aa935dd90b43103c9cd999068ca50c4f0fffb8dfd23"
+ROTATED_PRIVKEY = "04b16fa9520b9033d187d115740c059f19b690fee0af2cbd79eea1ad4161f6e7"
+
+
+class KeyChainTest(unittest.TestCase):
+    def setUp(self):
+        self.db = Database(filepath="test.db")
+        self.set_keys(PRIVKEY)
+
+    def tearDown(self):
+        connection.close_all("test.db")
+        os.remove("test.db")
+
+    def set_keys(self, privkey):
+        signing_key = nacl.signing.SigningKey(privkey, encoder=nacl.encoding.HexEncoder)
+        self.db.keys.set_key("guid", privkey, signing_key.verify_key.encode(encoder=nacl.encoding.HexEncoder))
+        bitcoin_privkey = bitcointools.bip32_master_key(bitcointools.sha256(signing_key.encode()))
+        self.db.keys.set_key("bitcoin", bitcoin_privkey, bitcointools.bip32_privtopub(bitcoin_privkey))
+
+    def test_get_is_cached(self):
+        keychain = KeyChain.get(self.db)
+        self.assertEqual(keychain.signing_key.encode(encoder=nacl.encoding.HexEncoder), PRIVKEY)
+        self.assertIs(KeyChain.get(self.db), keychain)
+        self.assertIs(KeyChain.get(Database(filepath="test.db")), keychain)
+
+    def test_set_key_invalidates(self):
+        keychain = KeyChain.get(self.db)
+        self.set_keys(ROTATED_PRIVKEY)
+        rotated = KeyChain.get(self.db)
+        self.assertIsNot(rotated, keychain)
+        self.assertEqual(rotated.signing_key.encode(encoder=nacl.encoding.HexEncoder), ROTATED_PRIVKEY)
+
+    def test_callback_registers_keychain(self):
+        loaded = []
+        KeyChain(self.db, loaded.append)
+        self.assertIs(KeyChain.get(self.db), loaded[0])
@@ -0,0 +1,47 @@
+__author__ = 'chris'
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from keys import pgpcache
+from keys.pgpcache import PGPCache
+
+
+class PGPCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.patch(pgpcache, "_verify", self.fake_verify)
+        self.cache = PGPCache(max_entries=2)
+
+    def fake_verify(self, public_key, signature):
+        self.calls.append((public_key, signature))
+        return signature == "good"
+
+    def test_verify_cached(self):
+        self.assertTrue(self.cache.verify("key", "good"))
+        self.assertTrue(self.cache.verify("key", "good"))
+        self.assertFalse(self.cache.verify("key", "bad"))
+        self.assertFalse(self.cache.verify("key", "bad"))
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(self.cache.get_stats()["hits"], 2)
+
+    def test_key_covers_both(self):
+        self.cache.verify("key", "good")
+        self.assertIsNone(self.cache.get("other key", "good"))
+        self.assertIsNone(self.cache.get("keygo", "od"))
+
+    def test_bounded(self):
+        for sig in ("one", "two", "three"):
+            self.cache.verify("key", sig)
+        self.assertEqual(self.cache.get_stats()["entries"], 2)
+        self.assertIsNone(self.cache.get("key", "one"))
+
+    @defer.inlineCallbacks
+    def test_verify_in_thread(self):
+        results = yield defer.gatherResults([self.cache.verify_in_thread("key", "good"),
+                                             self.cache.verify_in_thread("key", "good")])
+        self.assertEqual(results, [True, True])
+        self.assertEqual(len(self.calls), 1)
+        valid = yield self.cache.verify_in_thread("key", "good")
+        self.assertTrue(valid)
+        self.assertEqual(len(self.calls), 1)
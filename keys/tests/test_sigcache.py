@@ -0,0 +1,77 @@
+__author__ = 'chris'
+
+import bitcointools
+import nacl.signing
+from nacl.exceptions import BadSignatureError
+from twisted.trial import unittest
+
+from keys.cryptoservice import ED25519, ecdsa_sign
+from keys.sigcache import SignatureCache
+
+
+class SignatureCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = SignatureCache(max_signatures=2, max_keys=2)
+        self.signing_key = nacl.signing.SigningKey.generate()
+        self.pubkey = self.signing_key.verify_key.encode()
+
+    def sign(self, message):
+        return self.signing_key.sign(message)[:64]
+
+    def test_verify_caches_valid_signatures(self):
+        sig = self.sign("message")
+        self.cache.verify(self.pubkey, "message", sig)
+        self.cache.verify(self.pubkey, "message", sig)
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache.misses, 1)
+        self.assertEqual(self.cache.get_stats()["hit_rate"], 0.5)
+
+    def test_invalid_signature_not_cached(self):
+        sig = self.sign("message")
+        for _ in range(2):
+            self.assertRaises(BadSignatureError, self.cache.verify, self.pubkey, "another message", sig)
+        self.assertEqual(self.cache.hits, 0)
+        self.assertEqual(len(self.cache.signatures), 0)
+
+    def test_verify_without_caching(self):
+        sig = self.sign("message")
+        self.assertEqual(self.cache.verify(self.pubkey, "message", sig, cache=False), "message")
+        self.assertRaises(BadSignatureError, self.cache.verify, self.pubkey, "another message", sig, cache=False)
+        self.assertEqual(len(self.cache.signatures), 0)
+        self.assertEqual(self.cache.misses, 0)
+
+    def test_lru_is_bounded(self):
+        for message in ("one", "two", "three"):
+            self.cache.verify(self.pubkey, message, self.sign(message))
+        self.assertEqual(len(self.cache.signatures), 2)
+        self.assertFalse(self.cache.contains(ED25519, self.pubkey, "one", self.sign("one")))
+        self.assertTrue(self.cache.contains(ED25519, self.pubkey, "three", self.sign("three")))
+
+    def test_verify_key_cached(self):
+        self.assertIs(self.cache.verify_key(self.pubkey), self.cache.verify_key(self.pubkey))
+        for _ in range(3):
+            self.cache.verify_key(nacl.signing.SigningKey.generate().verify_key.encode())
+        self.assertEqual(len(self.cache.keys), 2)
+
+    def test_ecdsa_verify(self):
+        privkey = bitcointools.sha256("test key")
+        pubkey = bitcointools.privkey_to_pubkey(privkey)
+        sig = ecdsa_sign("message", privkey)
+        self.assertTrue(self.cache.ecdsa_verify("message", sig, pubkey))
+        self.assertTrue(self.cache.ecdsa_verify("message", sig, pubkey))
+        self.assertFalse(self.cache.ecdsa_verify("another message", sig, pubkey))
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_verify_all(self):
+        signatures = [(ED25519, self.pubkey, "one", self.sign("one")),
+                      (ED25519, self.pubkey, "two", self.sign("two"))]
+
+        def check_cached(valid):
+            self.assertTrue(valid)
+            self.assertTrue(self.cache.contains(*signatures[0]))
+            self.assertTrue(self.cache.contains(*signatures[1]))
+            return self.cache.verify_all([(ED25519, self.pubkey, "three", self.sign("one"))])
+
+        def check_invalid(valid):
+            self.assertEqual(valid, "Invalid %s signature" % ED25519)
+        return self.cache.verify_all(signatures).addCallback(check_cached).addCallback(check_invalid)
@@ -1,34 +1,132 @@
 __author__ = 'hoffmabc'
 
+import time
 from log import Logger
+from twisted.internet import defer, reactor
+from twisted.internet.interfaces import IReactorCore
+
+ACTION_IDS = {
+    "GET_PROFILE": 0,
+    "GET_CONTRACT": 1,
+    "GET_LISTINGS": 2,  # Click Store tab
+    "GET_FOLLOWING": 3,
+    "GET_FOLLOWERS": 4,
+    "GET_RATINGS": 5
+}
 
 
 class Audit(object):
     """
     A class for handling audit information
+
+    Events are queued in memory and written to the database in batches, in the
+    database thread, when `batch_size` events are waiting or `flush_interval`
+    seconds after the first one was queued. If the queue is full, or a batch
+    fails to write, the events are dropped and counted in `dropped`.
+
+    At most once every `prune_interval` seconds a flush also removes the events
+    older than `event_retention` seconds and the hourly rollups older than
+    `hourly_retention` seconds. The daily rollups are kept.
     """
 
-    def __init__(self, db, enabled=True):
+    def __init__(self, db, enabled=True, flush_interval=5, batch_size=500, max_queue=10000, clock=reactor,
+                 event_retention=30 * 86400, hourly_retention=90 * 86400, prune_interval=3600):
         self.db = db
         self.enabled = enabled
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_queue = max_queue
+        self.clock = clock
+        self.event_retention = event_retention
+        self.hourly_retention = hourly_retention
+        self.prune_interval = prune_interval
+        self.last_prune = 0
+
+        self.queue = []
+        self.flushing = None
+        self.delayed_flush = None
+        self.written = 0
+        self.dropped = 0
 
         self.log = Logger(system=self)
 
-        self.action_ids = {
-            "GET_PROFILE": 0,
-            "GET_CONTRACT": 1,
-            "GET_LISTINGS": 2,  # Click Store tab
-            "GET_FOLLOWING": 3,
-            "GET_FOLLOWERS": 4,
-            "GET_RATINGS": 5
-        }
+        self.action_ids = ACTION_IDS
+
+        # a test clock has no shutdown to flush on
+        if enabled and IReactorCore.providedBy(clock):
+            clock.addSystemEventTrigger("before", "shutdown", self.flush)
 
     def record(self, guid, action_id, contract_hash=None):
         if self.enabled is not True:
             return
-        self.log.info("Recording Audit Event [%s]" % action_id)
+        self.log.debug("Recording Audit Event [%s]" % action_id)
 
-        if action_id in self.action_ids:
-            self.db.audit_shopping.set(guid, self.action_ids[action_id], contract_hash)
-        else:
+        if action_id not in self.action_ids:
             self.log.error("Could not identify this action id")
+            return
+        if len(self.queue) >= self.max_queue:
+            self.dropped += 1
+            return
+
+        self.queue.append((guid, int(time.time()), contract_hash or '', self.action_ids[action_id]))
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self.flushing is not None:
+            return
+        if len(self.queue) >= self.batch_size:
+            self.flush()
+        elif self.queue and self.delayed_flush is None:
+            self.delayed_flush = self.clock.callLater(self.flush_interval, self.flush)
+
+    def flush(self):
+        """
+        Write the queued events to the database in the database thread.
+
+        Returns:
+            A deferred which fires when the batch has been written.
+        """
+        if self.delayed_flush is not None:
+            if self.delayed_flush.active():
+                self.delayed_flush.cancel()
+            self.delayed_flush = None
+        if self.flushing is not None:
+            # write whatever has been queued since once the current batch is done
+            d = defer.Deferred()
+            self.flushing.addCallback(lambda _: self.flush().addCallback(d.callback))
+            return d
+        if not self.queue:
+            return defer.succeed(None)
+
+        events, self.queue = self.queue, []
+
+        def done(result):
+            if result is None:
+                self.written += len(events)
+            else:
+                self.dropped += len(events)
+                self.log.warning("unable to write %s audit events: %s" % (len(events), result.getErrorMessage()))
+            self.flushing = None
+            self._schedule_flush()
+
+        now = int(time.time())
+        prune_before = None
+        if now - self.last_prune >= self.prune_interval:
+            prune_before = (now - self.event_retention, now - self.hourly_retention)
+            self.last_prune = now
+        self.flushing = self.db.deferred.run(self._write, events, prune_before)
+        self.flushing.addBoth(done)
+        return self.flushing
+
+    def _write(self, events, prune_before):
+        """Runs in the database thread."""
+        self.db.audit_shopping.set_many(events)
+        if prune_before is not None:
+            self.db.audit_shopping.prune(*prune_before)
+
+    def get_stats(self):
+        return {
+            "queued": len(self.queue),
+            "written": self.written,
+            "dropped": self.dropped
+        }
@@ -20,6 +20,7 @@ from datetime import datetime
 from dht.utils import digest
 from hashlib import sha256
 from keys.bip32utils import derive_childkey
+from keys.cryptoservice import CryptoService, ecdsa_verify
 from keys.keychain import KeyChain
 from log import Logger
 from market.profile import Profile
@@ -28,6 +29,7 @@ from market.transactions import BitcoinTransaction
 from protos.countries import CountryCode
 from protos.objects import Listings
 from market.smtpnotification import SMTPNotification
+from twisted.internet import defer
 
 
 class Contract(object):
@@ -50,7 +52,7 @@ class Contract(object):
             testnet: is this contract on the testnet
         """
         self.db = database
-        self.keychain = KeyChain(self.db)
+        self.keychain = KeyChain.get(self.db)
         if contract is not None:
             self.contract = contract
         elif hash_value is not None:
@@ -1106,7 +1108,7 @@ class Contract(object):
                                                   testnet=self.testnet,
                                                   out_value=out_value)
             chaincode = self.contract["buyer_order"]["order"]["payment"]["chaincode"]
-            masterkey_b = bitcointools.bip32_extract_key(KeyChain(self.db).bitcoin_master_privkey)
+            masterkey_b = bitcointools.bip32_extract_key(KeyChain.get(self.db).bitcoin_master_privkey)
             buyer_priv = derive_childkey(masterkey_b, chaincode, bitcointools.MAINNET_PRIVATE)
             buyer_sigs = tx.create_signature(buyer_priv, redeem_script)
             vendor_sigs = refund_json["refund"]["signature(s)"]
@@ -1158,6 +1160,10 @@ class Contract(object):
     def verify(self, sender_key):
         """
         Validate that an order sent over by a buyer is filled out correctly.
+
+        Returns:
+            A deferred which fires with True if the order is valid, otherwise a
+            `str` describing why it isn't.
         """
         SelectParams("testnet" if self.testnet else "mainnet")
         try:
@@ -1189,11 +1195,9 @@ class Contract(object):
             verify_key = nacl.signing.VerifyKey(sender_key)
             verify_key.verify(verify_obj, base64.b64decode(self.contract["buyer_order"]["signatures"]["guid"]))
 
+            # the bitcoin signature is checked last, off the reactor thread
             bitcoin_key = self.contract["buyer_order"]["order"]["id"]["pubkeys"]["bitcoin"]
             bitcoin_sig = self.contract["buyer_order"]["signatures"]["bitcoin"]
-            valid = bitcointools.ecdsa_raw_verify(verify_obj, bitcointools.decode_sig(bitcoin_sig), bitcoin_key)
-            if not valid:
-                raise Exception("Invalid Bitcoin signature")
 
             # verify the quantity does not exceed the max
             quantity = int(self.contract["buyer_order"]["order"]["quantity"])
@@ -1303,10 +1307,14 @@ class Contract(object):
                 if value is None:
                     raise Exception("Missing pubkey field")
 
-            return True
-
         except Exception, e:
-            return e.message
+            return defer.succeed(e.message)
+
+        def check_signature(valid):
+            return True if valid else "Invalid Bitcoin signature"
+
+        d = CryptoService.instance().run(ecdsa_verify, verify_obj, bitcoin_sig, bitcoin_key)
+        return d.addCallbacks(check_signature, lambda failure: failure.getErrorMessage())
 
     def validate_for_moderation(self, proof_sig):
         validation_failures = []
@@ -19,18 +19,21 @@ class MessageListenerImpl(object):
         self.log = Logger(system=self)
 
     def notify(self, plaintext, signature):
-        try:
-            success = self.db.messages.save_message(plaintext.sender_guid.encode("hex"),
-                                                    plaintext.handle, plaintext.pubkey,
-                                                    plaintext.subject, PlaintextMessage.Type.Name(plaintext.type),
-                                                    plaintext.message, plaintext.timestamp, plaintext.avatar_hash,
-                                                    signature, False)
-
-            if plaintext.subject != "":
-                self.db.purchases.update_unread(plaintext.subject)
-                self.db.sales.update_unread(plaintext.subject)
-                self.db.cases.update_unread(plaintext.subject)
+        def save():
+            with self.db.transaction():
+                success = self.db.messages.save_message(plaintext.sender_guid.encode("hex"),
+                                                        plaintext.handle, plaintext.pubkey, plaintext.subject,
+                                                        PlaintextMessage.Type.Name(plaintext.type),
+                                                        plaintext.message, plaintext.timestamp,
+                                                        plaintext.avatar_hash, signature, False)
 
+                if plaintext.subject != "":
+                    self.db.purchases.update_unread(plaintext.subject)
+                    self.db.sales.update_unread(plaintext.subject)
+                    self.db.cases.update_unread(plaintext.subject)
+            return success
+
+        def push(success):
             if success:
                 message_json = {
                     "message": {
@@ -46,8 +49,11 @@ class MessageListenerImpl(object):
                 if plaintext.handle:
                     message_json["message"]["handle"] = plaintext.handle
                 self.ws.push(json.dumps(sanitize_html(message_json), indent=4))
-        except Exception as e:
-            self.log.error('Market.Listener.notify Exception: %s' % e)
+
+        def failed(failure):
+            self.log.error('Market.Listener.notify Exception: %s' % failure.getErrorMessage())
+
+        self.db.deferred.run(save).addCallback(push).addErrback(failed)
 
 class BroadcastListenerImpl(object):
     implements(BroadcastListener)
@@ -55,23 +61,25 @@ class BroadcastListenerImpl(object):
     def __init__(self, web_socket_factory, database):
         self.ws = web_socket_factory
         self.db = database
+        self.log = Logger(system=self)
+
+    def failed(self, failure):
+        self.log.error("unable to save to the database: %s" % failure.getErrorMessage())
 
     def notify(self, guid, message):
         # pull the metadata for this node from the db
-        f = Following()
-        ser = self.db.follow.get_following()
+        ser = self.db.follow.get_user(guid)
         handle = ""
         avatar_hash = ""
         if ser is not None:
-            f.ParseFromString(ser)
-            for user in f.users:
-                if user.guid == guid:
-                    avatar_hash = user.metadata.avatar_hash
-                    handle = user.metadata.handle
+            user = Following.User()
+            user.ParseFromString(ser)
+            avatar_hash = user.metadata.avatar_hash
+            handle = user.metadata.handle
         timestamp = int(time.time())
         broadcast_id = digest(random.getrandbits(255)).encode("hex")
-        self.db.broadcasts.save_broadcast(broadcast_id, guid.encode("hex"), handle, message,
-                                          timestamp, avatar_hash)
+        self.db.deferred.broadcasts.save_broadcast(broadcast_id, guid.encode("hex"), handle, message,
+                                                   timestamp, avatar_hash).addErrback(self.failed)
         broadcast_json = {
             "broadcast": {
                 "id": broadcast_id,
@@ -91,12 +99,17 @@ class NotificationListenerImpl(object):
     def __init__(self, web_socket_factory, database):
         self.ws = web_socket_factory
         self.db = database
+        self.log = Logger(system=self)
+
+    def failed(self, failure):
+        self.log.error("unable to save to the database: %s" % failure.getErrorMessage())
 
     def notify(self, guid, handle, notif_type, order_id, title, image_hash):
         timestamp = int(time.time())
         notif_id = digest(random.getrandbits(255)).encode("hex")
-        self.db.notifications.save_notification(notif_id, guid.encode("hex"), handle, notif_type, order_id,
-                                                title, timestamp, image_hash)
+        self.db.deferred.notifications.save_notification(notif_id, guid.encode("hex"), handle, notif_type,
+                                                         order_id, title, timestamp,
+                                                         image_hash).addErrback(self.failed)
         notification_json = {
             "notification": {
                 "id": notif_id,
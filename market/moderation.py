@@ -42,7 +42,7 @@ def process_dispute(contract, db, message_listener, notification_listener, testn
     del tmp_contract["dispute"]
 
     order_id = digest(json.dumps(tmp_contract, indent=4)).encode("hex")
-    own_guid = KeyChain(db).guid.encode("hex")
+    own_guid = KeyChain.get(db).guid.encode("hex")
 
     if contract["dispute"]["info"]["guid"] == contract["vendor_offer"]["listing"]["id"]["guid"]:
         guid = unhexlify(contract["vendor_offer"]["listing"]["id"]["guid"])
@@ -2,10 +2,8 @@ __author__ = 'chris'
 
 import base64
 import bitcointools
-import gnupg
 import httplib
 import json
-import nacl.signing
 import nacl.hash
 import nacl.encoding
 import nacl.utils
@@ -21,7 +19,11 @@ from config import DATA_FOLDER, TRANSACTION_FEE
 from dht.node import Node
 from dht.utils import digest
 from keys.bip32utils import derive_childkey
+from keys.cryptoservice import CryptoService, ecdsa_sign, check_follower, follower_signature, verify_followers, \
+    vendor_offer_signatures
 from keys.keychain import KeyChain
+from keys.pgpcache import PGPCache
+from keys.sigcache import SignatureCache
 from log import Logger
 from market.contracts import Contract
 from market.moderation import process_dispute, close_dispute
@@ -33,9 +35,12 @@ from protos import objects
 from seed import peers
 from twisted.internet import defer, reactor, task
 
+# Seconds during which a node we pre-warmed a connection to won't be pre-warmed again.
+PREWARM_WINDOW = 120
+
 
 class Server(object):
-    def __init__(self, kserver, signing_key, database, audit=True):
+    def __init__(self, kserver, signing_key, database, audit=True, clock=reactor):
         """
         A high level class for sending direct, market messages to other nodes.
         A node will need one of these to participate in buying and selling.
@@ -47,6 +52,8 @@ class Server(object):
         self.db = database
         self.log = Logger(system=self)
         self.protocol = MarketProtocol(kserver.node, self.router, signing_key, database, audit)
+        self.prewarmed = {}
+        self.clock = clock
         task.LoopingCall(self.update_listings).start(3600, now=True)
 
     def querySeed(self, list_seed_pubkey):
@@ -71,8 +78,8 @@ class Server(object):
                 reread_data = data.decode("zlib")
                 proto = peers.PeerSeeds()
                 proto.ParseFromString(reread_data)
-                verify_key = nacl.signing.VerifyKey(pubkey, encoder=nacl.encoding.HexEncoder)
-                verify_key.verify("".join(proto.serializedNode), proto.signature)
+                SignatureCache.instance().verify(pubkey, "".join(proto.serializedNode), proto.signature,
+                                                 encoder=nacl.encoding.HexEncoder)
                 for peer in proto.serializedNode:
                     try:
                         n = objects.Node()
@@ -106,43 +113,26 @@ class Server(object):
                         raise Exception("Contract ID doesn't match")
 
                     # TODO: verify the guid in the contract matches this node's guid
-                    signature = contract["vendor_offer"]["signatures"]["guid"]
-                    verify_obj = json.dumps(contract["vendor_offer"]["listing"], indent=4)
-
-                    verify_key = nacl.signing.VerifyKey(node_to_ask.pubkey)
-                    verify_key.verify(verify_obj, base64.b64decode(signature))
-
-                    bitcoin_key = contract["vendor_offer"]["listing"]["id"]["pubkeys"]["bitcoin"]
-                    bitcoin_sig = contract["vendor_offer"]["signatures"]["bitcoin"]
-                    valid = bitcointools.ecdsa_raw_verify(verify_obj, bitcointools.decode_sig(bitcoin_sig),
-                                                          bitcoin_key)
-                    if not valid:
-                        raise Exception("Invalid Bitcoin signature")
-
-                    if "moderators" in contract["vendor_offer"]["listing"]:
-                        for moderator in contract["vendor_offer"]["listing"]["moderators"]:
-                            guid = moderator["guid"]
-                            guid_key = moderator["pubkeys"]["guid"]
-                            bitcoin_key = moderator["pubkeys"]["bitcoin"]["key"]
-                            bitcoin_sig = base64.b64decode(moderator["pubkeys"]["bitcoin"]["signature"])
-                            h = nacl.hash.sha512(unhexlify(guid_key))
-                            pow_hash = h[40:]
-                            if int(pow_hash[:6], 16) >= 50 or guid != h[:40]:
-                                raise Exception('Invalid GUID')
-                            verify_key = nacl.signing.VerifyKey(guid_key, encoder=nacl.encoding.HexEncoder)
-                            verify_key.verify(unhexlify(bitcoin_key), bitcoin_sig)
-                            #TODO: should probably also validate the handle here.
-                    self.cache(result[1][0], id_in_contract)
-                    if "image_hashes" in contract["vendor_offer"]["listing"]["item"]:
-                        for image_hash in contract["vendor_offer"]["listing"]["item"]["image_hashes"]:
-                            self.get_image(node_to_ask, unhexlify(image_hash))
-                    return contract
+                    # TODO: should probably also validate the moderator handles here.
+                    d = SignatureCache.instance().verify_all(
+                        vendor_offer_signatures(contract["vendor_offer"], node_to_ask.pubkey))
+                    return d.addCallback(save_contract, contract, result[1][0]).addErrback(lambda e: None)
                 else:
                     self.log.warning("Fetched an invalid contract from %s" % node_to_ask.id.encode("hex"))
                     return None
             except Exception:
                 return None
 
+        def save_contract(valid, contract, serialized_contract):
+            if valid is not True:
+                self.log.warning("Fetched an invalid contract from %s: %s" % (node_to_ask.id.encode("hex"), valid))
+                return None
+            self.cache(serialized_contract, contract["vendor_offer"]["listing"]["contract_id"])
+            if "image_hashes" in contract["vendor_offer"]["listing"]["item"]:
+                for image_hash in contract["vendor_offer"]["listing"]["item"]["image_hashes"]:
+                    self.get_image(node_to_ask, unhexlify(image_hash))
+            return contract
+
         if node_to_ask.ip is None:
             return defer.succeed(None)
         self.log.info("fetching contract %s from %s" % (contract_id.encode("hex"), node_to_ask))
@@ -183,21 +173,31 @@ class Server(object):
 
         def get_result(result):
             try:
-                verify_key = nacl.signing.VerifyKey(node_to_ask.pubkey)
-                verify_key.verify(result[1][0], result[1][1])
+                SignatureCache.instance().verify(node_to_ask.pubkey, result[1][0], result[1][1])
                 p = objects.Profile()
                 p.ParseFromString(result[1][0])
                 if p.pgp_key.public_key:
-                    gpg = gnupg.GPG()
-                    gpg.import_keys(p.pgp_key.publicKey)
-                    if not gpg.verify(p.pgp_key.signature) or \
-                                    node_to_ask.id.encode('hex') not in p.pgp_key.signature:
+                    if node_to_ask.id.encode('hex') not in p.pgp_key.signature:
                         p.ClearField("pgp_key")
+                    else:
+                        d = PGPCache.instance().verify_in_thread(p.pgp_key.public_key, p.pgp_key.signature)
+                        return d.addCallback(check_pgp, p, result[1][0])
+                return save_profile(p, result[1][0])
+            except Exception:
+                return None
+
+        def check_pgp(valid, p, serialized_profile):
+            if not valid:
+                p.ClearField("pgp_key")
+            return save_profile(p, serialized_profile)
+
+        def save_profile(p, serialized_profile):
+            try:
                 if not os.path.isfile(os.path.join(DATA_FOLDER, 'cache', p.avatar_hash.encode("hex"))):
                     self.get_image(node_to_ask, p.avatar_hash)
                 if not os.path.isfile(os.path.join(DATA_FOLDER, 'cache', p.header_hash.encode("hex"))):
                     self.get_image(node_to_ask, p.header_hash)
-                self.cache(result[1][0], node_to_ask.id.encode("hex") + ".profile")
+                self.cache(serialized_profile, node_to_ask.id.encode("hex") + ".profile")
                 return p
             except Exception:
                 return None
@@ -218,8 +218,7 @@ class Server(object):
 
         def get_result(result):
             try:
-                verify_key = nacl.signing.VerifyKey(node_to_ask.pubkey)
-                verify_key.verify(result[1][0], result[1][1])
+                SignatureCache.instance().verify(node_to_ask.pubkey, result[1][0], result[1][1])
                 m = objects.Metadata()
                 m.ParseFromString(result[1][0])
                 if not os.path.isfile(os.path.join(DATA_FOLDER, 'cache', m.avatar_hash.encode("hex"))):
@@ -243,8 +242,7 @@ class Server(object):
 
         def get_result(result):
             try:
-                verify_key = nacl.signing.VerifyKey(node_to_ask.pubkey)
-                verify_key.verify(result[1][0], result[1][1])
+                SignatureCache.instance().verify(node_to_ask.pubkey, result[1][0], result[1][1])
                 l = objects.Listings()
                 l.ParseFromString(result[1][0])
                 return l
@@ -266,8 +264,7 @@ class Server(object):
 
         def get_result(result):
             try:
-                verify_key = nacl.signing.VerifyKey(node_to_ask.pubkey)
-                verify_key.verify(result[1][0], result[1][1])
+                SignatureCache.instance().verify(node_to_ask.pubkey, result[1][0], result[1][1])
                 l = objects.Listings().ListingMetadata()
                 l.ParseFromString(result[1][0])
                 if l.thumbnail_hash != "":
@@ -290,7 +287,7 @@ class Server(object):
 
         u = objects.Profile()
         k = u.PublicKey()
-        k.public_key = unhexlify(bitcointools.bip32_extract_key(KeyChain(self.db).bitcoin_master_pubkey))
+        k.public_key = unhexlify(bitcointools.bip32_extract_key(KeyChain.get(self.db).bitcoin_master_pubkey))
         k.signature = self.signing_key.sign(k.public_key)[:64]
         u.bitcoin_key.MergeFrom(k)
         u.moderator = True
@@ -329,8 +326,7 @@ class Server(object):
                     m.ParseFromString(result[1][1])
                     u.metadata.MergeFrom(m)
                     u.signature = result[1][2]
-                    verify_key = nacl.signing.VerifyKey(node_to_follow.pubkey)
-                    verify_key.verify(result[1][1], result[1][2])
+                    SignatureCache.instance().verify(node_to_follow.pubkey, result[1][1], result[1][2])
                     self.db.follow.follow(u)
                     return True
                 except Exception:
@@ -338,13 +334,7 @@ class Server(object):
             else:
                 return False
 
-        proto = Profile(self.db).get(False)
-        m = objects.Metadata()
-        m.name = proto.name
-        m.handle = proto.handle
-        m.avatar_hash = proto.avatar_hash
-        m.short_description = proto.short_description
-        m.nsfw = proto.nsfw
+        m = Profile(self.db).get_metadata()
         f = objects.Followers.Follower()
         f.guid = self.kserver.node.id
         f.following = node_to_follow.id
@@ -375,45 +365,73 @@ class Server(object):
         self.log.info("sending unfollow request to %s" % node_to_unfollow)
         return d.addCallback(save_to_db)
 
-    def get_followers(self, node_to_ask, start=0):
+    def get_followers(self, node_to_ask, start=0, cursor=None):
         """
         Query the given node for a list if its followers. The response will be a
         `Followers` protobuf object. We will verify the signature for each follower
         to make sure that node really did follower this user.
+
+        Nodes from protocol version 3 return a cursor with each page, pass it back
+        as `cursor` to get the next one. Older nodes only understand `start`.
+
+        Returns:
+            A deferred which fires with the `Followers`, the follower count and
+            the cursor for the next page (`None` if there isn't one).
         """
 
         def get_response(response):
             # Verify the signature on the response
             f = objects.Followers()
             try:
-                verify_key = nacl.signing.VerifyKey(node_to_ask.pubkey)
-                verify_key.verify(response[1][0], response[1][1])
+                SignatureCache.instance().verify(node_to_ask.pubkey, response[1][0], response[1][1])
                 f.ParseFromString(response[1][0])
             except Exception:
-                return (None, None)
+                return (None, None, None)
             # Verify the signature and guid of each follower.
             count = None
             if len(response[1]) > 2:
                 count = response[1][2]
+            next_cursor = None
+            if len(response[1]) > 3 and response[1][3]:
+                next_cursor = response[1][3]
+
+            # Followers we've verified before only need the cheap checks, the rest go to the CryptoService.
+            # Followers are matched up by their whole serialization as anyone can copy a signature.
+            signatures = SignatureCache.instance()
+            verified = set()
+            unverified = objects.Followers()
             for follower in f.followers:
                 try:
-                    v_key = nacl.signing.VerifyKey(follower.pubkey)
-                    signature = follower.signature
-                    follower.ClearField("signature")
-                    v_key.verify(follower.SerializeToString(), signature)
-                    h = nacl.hash.sha512(follower.pubkey)
-                    pow_hash = h[40:]
-                    if int(pow_hash[:6], 16) >= 50 or follower.guid.encode("hex") != h[:40]:
-                        raise Exception('Invalid GUID')
-                    if follower.following != node_to_ask.id:
-                        raise Exception('Invalid follower')
+                    if signatures.contains(*follower_signature(follower)):
+                        check_follower(follower, node_to_ask.id)
+                        verified.add(follower.SerializeToString())
+                    else:
+                        unverified.followers.add().CopyFrom(follower)
                 except Exception:
-                    f.followers.remove(follower)
-            return (f, count)
+                    pass
+
+            def merge(serialized_followers):
+                newly_verified = objects.Followers()
+                newly_verified.ParseFromString(serialized_followers)
+                for follower in newly_verified.followers:
+                    signatures.add(*follower_signature(follower))
+                    verified.add(follower.SerializeToString())
+                valid = objects.Followers()
+                valid.followers.extend([follower for follower in f.followers
+                                        if follower.SerializeToString() in verified])
+                return (valid, count, next_cursor)
+
+            if not unverified.followers:
+                return merge("")
+            d = CryptoService.instance().run(verify_followers, unverified.SerializeToString(), node_to_ask.id)
+            return d.addCallbacks(merge, lambda e: (None, None, None))
 
         peer = (node_to_ask.ip, node_to_ask.port)
-        if peer in self.protocol.multiplexer and \
-                        self.protocol.multiplexer[peer].handler.remote_node_version > 1:
+        version = self.protocol.multiplexer[peer].handler.remote_node_version \
+            if peer in self.protocol.multiplexer else 1
+        if version > 2 and cursor is not None:
+            d = self.protocol.callGetFollowers(node_to_ask, start=start, cursor=cursor)
+        elif version > 1:
             d = self.protocol.callGetFollowers(node_to_ask, start=start)
         else:
             d = self.protocol.callGetFollowers(node_to_ask)
@@ -433,16 +451,13 @@ class Server(object):
             # Verify the signature on the response
             f = objects.Following()
             try:
-                verify_key = nacl.signing.VerifyKey(node_to_ask.pubkey)
-                verify_key.verify(response[1][0], response[1][1])
+                SignatureCache.instance().verify(node_to_ask.pubkey, response[1][0], response[1][1])
                 f.ParseFromString(response[1][0])
             except Exception:
                 return None
             for user in f.users:
                 try:
-                    v_key = nacl.signing.VerifyKey(user.pubkey)
-                    signature = user.signature
-                    v_key.verify(user.metadata.SerializeToString(), signature)
+                    SignatureCache.instance().verify(user.pubkey, user.metadata.SerializeToString(), user.signature)
                     h = nacl.hash.sha512(user.pubkey)
                     pow_hash = h[40:]
                     if int(pow_hash[:6], 16) >= 50 or user.guid.encode("hex") != h[:40]:
@@ -481,7 +496,11 @@ class Server(object):
             return defer.DeferredList(ds).addCallback(how_many_reached)
         dl = []
         f = objects.Followers()
-        f.ParseFromString(self.db.follow.get_followers())
+        ser, _, cursor = self.db.follow.get_followers()
+        f.ParseFromString(ser)
+        while cursor is not None:
+            ser, _, cursor = self.db.follow.get_followers(cursor=cursor)
+            f.MergeFromString(ser)
         for follower in f.followers:
             dl.append(self.kserver.resolve(follower.guid))
         self.log.info("broadcasting %s to followers" % message)
@@ -545,8 +564,8 @@ class Server(object):
                             p.ParseFromString(plaintext)
                             signature = p.signature
                             p.ClearField("signature")
-                            verify_key = nacl.signing.VerifyKey(p.pubkey)
-                            verify_key.verify(p.SerializeToString(), signature)
+                            SignatureCache.instance().verify(p.pubkey, p.SerializeToString(), signature,
+                                                             cache=False)
                             h = nacl.hash.sha512(p.pubkey)
                             pow_hash = h[40:]
                             if int(pow_hash[:6], 16) >= 50 or p.sender_guid.encode("hex") != h[:40]:
@@ -588,6 +607,56 @@ class Server(object):
                         pass
         self.kserver.get(self.kserver.node.id, False).addCallback(parse_messages)
 
+    def prewarm(self, guid):
+        """
+        Resolve a node and open a connection to it in the background so a later
+        order message (ex. from `purchase` or `confirm_order`) goes out over an
+        established connection instead of waiting on the handshake and hole punch.
+        Called when an order page is opened, or by the UI through the "prewarm" websocket command.
+
+        The PING adds the node to our routing table, so the keep alive would hold the
+        connection open indefinitely. If nothing but PINGs went over it within
+        `PREWARM_WINDOW` the connection is shut down again.
+
+        Args:
+            guid: the hex encoded guid of the node.
+
+        Returns:
+            A deferred which fires with True if the node was reached. It never errbacks.
+        """
+        now = time.time()
+        if now - self.prewarmed.get(guid, 0) < PREWARM_WINDOW:
+            return defer.succeed(True)
+        for g, t in self.prewarmed.items():
+            if now - t >= PREWARM_WINDOW:
+                del self.prewarmed[g]
+        self.prewarmed[guid] = now
+
+        def expire(address):
+            connection = self.protocol.multiplexer.get(address)
+            if connection is not None and connection.handler.time_last_message < now and \
+                    address != self.protocol.multiplexer.relay_node:
+                self.log.debug("pre-warmed connection to %s:%s went unused, closing it" % address)
+                connection.shutdown()
+
+        def ping(node):
+            if node is None:
+                self.prewarmed.pop(guid, None)
+                return False
+            address = (node.ip, node.port)
+            if address in self.protocol.multiplexer and self.protocol.multiplexer[address].handler.node is not None:
+                return True
+            self.log.debug("pre-warming connection to %s" % node)
+            self.clock.callLater(PREWARM_WINDOW, expire, address)
+            return self.kserver.protocol.callPing(node).addCallback(lambda result: result[0])
+
+        def failed(failure):
+            self.prewarmed.pop(guid, None)
+            self.log.warning("failed to pre-warm a connection to %s: %s" % (guid, failure.getErrorMessage()))
+            return False
+
+        return self.kserver.resolve(unhexlify(guid)).addCallback(ping).addErrback(failed)
+
     def purchase(self, node_to_ask, contract):
         """
         Send an order message to the vendor.
@@ -604,15 +673,16 @@ class Server(object):
                 buyer_key = derive_childkey(masterkey_b, chaincode)
                 amount = contract.contract["buyer_order"]["order"]["payment"]["amount"]
                 listing_hash = contract.contract["vendor_offer"]["listing"]["contract_id"]
-                verify_key = nacl.signing.VerifyKey(node_to_ask.pubkey)
-                verify_key.verify(
-                    str(address) + str(amount) + str(listing_hash) + str(buyer_key), response[1][0])
+                SignatureCache.instance().verify(
+                    node_to_ask.pubkey, str(address) + str(amount) + str(listing_hash) + str(buyer_key),
+                    response[1][0], cache=False)
                 return response[1][0]
             except Exception:
                 return False
 
-        public_key = nacl.signing.VerifyKey(contract.contract["vendor_offer"]["listing"]["id"]["pubkeys"]["guid"],
-                                            encoder=nacl.encoding.HexEncoder).to_curve25519_public_key()
+        public_key = SignatureCache.instance().verify_key(
+            contract.contract["vendor_offer"]["listing"]["id"]["pubkeys"]["guid"],
+            encoder=nacl.encoding.HexEncoder).to_curve25519_public_key()
         skephem = PrivateKey.generate()
         pkephem = skephem.public_key.encode(nacl.encoding.RawEncoder)
         box = Box(skephem, public_key)
@@ -638,7 +708,7 @@ class Server(object):
                     del contract_dict["vendor_order_confirmation"]
                     order_id = digest(json.dumps(contract_dict, indent=4)).encode("hex")
                     self.send_message(Node(unhexlify(guid)),
-                                      nacl.signing.VerifyKey(
+                                      SignatureCache.instance().verify_key(
                                           contract.contract["buyer_order"]["order"]["id"]["pubkeys"]["guid"],
                                           encoder=nacl.encoding.HexEncoder).to_curve25519_public_key().encode(),
                                       objects.PlaintextMessage.Type.Value("ORDER_CONFIRMATION"),
@@ -650,7 +720,7 @@ class Server(object):
                     return response[1][0]
 
             if node_to_ask:
-                public_key = nacl.signing.VerifyKey(
+                public_key = SignatureCache.instance().verify_key(
                     contract.contract["buyer_order"]["order"]["id"]["pubkeys"]["guid"],
                     encoder=nacl.encoding.HexEncoder).to_curve25519_public_key()
                 skephem = PrivateKey.generate()
@@ -682,7 +752,7 @@ class Server(object):
                     del contract_dict["buyer_receipt"]
                     order_id = digest(json.dumps(contract_dict, indent=4)).encode("hex")
                     self.send_message(Node(unhexlify(guid)),
-                                      nacl.signing.VerifyKey(
+                                      SignatureCache.instance().verify_key(
                                           contract.contract["vendor_offer"]["listing"]["id"]["pubkeys"]["guid"],
                                           encoder=nacl.encoding.HexEncoder).to_curve25519_public_key().encode(),
                                       objects.PlaintextMessage.Type.Value("RECEIPT"),
@@ -694,7 +764,7 @@ class Server(object):
                     return response[1][0]
 
             if node_to_ask:
-                public_key = nacl.signing.VerifyKey(
+                public_key = SignatureCache.instance().verify_key(
                     contract.contract["vendor_offer"]["listing"]["id"]["pubkeys"]["guid"],
                     encoder=nacl.encoding.HexEncoder).to_curve25519_public_key()
                 skephem = PrivateKey.generate()
@@ -740,7 +810,7 @@ class Server(object):
                 return False
 
         if "dispute" not in contract:
-            keychain = KeyChain(self.db)
+            keychain = KeyChain.get(self.db)
             contract["dispute"] = {}
             contract["dispute"]["info"] = {}
             contract["dispute"]["info"]["claim"] = claim
@@ -773,7 +843,7 @@ class Server(object):
             def parse_response(response):
                 if not response[0]:
                     self.send_message(Node(unhexlify(recipient_guid)),
-                                      nacl.signing.VerifyKey(
+                                      SignatureCache.instance().verify_key(
                                           public_key,
                                           encoder=nacl.encoding.HexEncoder).to_curve25519_public_key().encode(),
                                       objects.PlaintextMessage.Type.Value("DISPUTE_OPEN"),
@@ -782,7 +852,7 @@ class Server(object):
                                       store_only=True)
 
             if node_to_ask:
-                enc_key = nacl.signing.VerifyKey(
+                enc_key = SignatureCache.instance().verify_key(
                     public_key, encoder=nacl.encoding.HexEncoder).to_curve25519_public_key()
                 skephem = PrivateKey.generate()
                 pkephem = skephem.public_key.encode(nacl.encoding.RawEncoder)
@@ -828,11 +898,11 @@ class Server(object):
         buyer_address = contract["buyer_order"]["order"]["refund_address"]
 
         buyer_guid = contract["buyer_order"]["order"]["id"]["guid"]
-        buyer_enc_key = nacl.signing.VerifyKey(
+        buyer_enc_key = SignatureCache.instance().verify_key(
             contract["buyer_order"]["order"]["id"]["pubkeys"]["guid"],
             encoder=nacl.encoding.HexEncoder).to_curve25519_public_key()
         vendor_guid = contract["vendor_offer"]["listing"]["id"]["guid"]
-        vendor_enc_key = nacl.signing.VerifyKey(
+        vendor_enc_key = SignatureCache.instance().verify_key(
             contract["vendor_offer"]["listing"]["id"]["pubkeys"]["guid"],
             encoder=nacl.encoding.HexEncoder).to_curve25519_public_key()
 
@@ -890,7 +960,7 @@ class Server(object):
                                                           testnet=self.protocol.multiplexer.testnet)
                     chaincode = contract["buyer_order"]["order"]["payment"]["chaincode"]
                     redeem_script = str(contract["buyer_order"]["order"]["payment"]["redeem_script"])
-                    masterkey_m = bitcointools.bip32_extract_key(KeyChain(self.db).bitcoin_master_privkey)
+                    masterkey_m = bitcointools.bip32_extract_key(KeyChain.get(self.db).bitcoin_master_privkey)
                     moderator_priv = derive_childkey(masterkey_m, chaincode, bitcointools.MAINNET_PRIVATE)
 
                     signatures = tx.create_signature(moderator_priv, redeem_script)
@@ -899,7 +969,7 @@ class Server(object):
                     dispute_json["dispute_resolution"]["resolution"]["claim"] = self.db.cases.get_claim(order_id)
                     dispute_json["dispute_resolution"]["resolution"]["decision"] = resolution
                     dispute_json["dispute_resolution"]["signature"] = \
-                        base64.b64encode(KeyChain(self.db).signing_key.sign(json.dumps(
+                        base64.b64encode(KeyChain.get(self.db).signing_key.sign(json.dumps(
                             dispute_json["dispute_resolution"]["resolution"], indent=4))[:64])
 
                     contract["dispute_resolution"] = dispute_json["dispute_resolution"]
@@ -1001,7 +1071,7 @@ class Server(object):
         tx = BitcoinTransaction.make_unsigned(outpoints, outputs, testnet=self.protocol.multiplexer.testnet)
         chaincode = contract["buyer_order"]["order"]["payment"]["chaincode"]
         redeem_script = str(contract["buyer_order"]["order"]["payment"]["redeem_script"])
-        masterkey = bitcointools.bip32_extract_key(KeyChain(self.db).bitcoin_master_privkey)
+        masterkey = bitcointools.bip32_extract_key(KeyChain.get(self.db).bitcoin_master_privkey)
         childkey = derive_childkey(masterkey, chaincode, bitcointools.MAINNET_PRIVATE)
 
         own_sig = tx.create_signature(childkey, redeem_script)
@@ -1033,8 +1103,8 @@ class Server(object):
         """
         def get_result(result):
             try:
-                verify_key = nacl.signing.VerifyKey(node_to_ask.pubkey)
-                verify_key.verify(result[1][0], result[1][1])
+                signatures = SignatureCache.instance()
+                signatures.verify(node_to_ask.pubkey, result[1][0], result[1][1])
                 ratings = json.loads(result[1][0].decode("zlib"), object_pairs_hook=OrderedDict)
                 ret = []
                 for rating in ratings:
@@ -1044,20 +1114,19 @@ class Server(object):
                     listing_hash = rating["tx_summary"]["listing"]
                     proof_sig = rating["tx_summary"]["proof_of_tx"]
                     try:
-                        verify_key.verify(str(address) + str(amount) + str(listing_hash) + str(buyer_key),
+                        signatures.verify(node_to_ask.pubkey,
+                                          str(address) + str(amount) + str(listing_hash) + str(buyer_key),
                                           base64.b64decode(proof_sig))
 
-                        valid = bitcointools.ecdsa_raw_verify(json.dumps(rating["tx_summary"], indent=4),
-                                                              bitcointools.decode_sig(rating["signature"]),
-                                                              buyer_key)
+                        valid = signatures.ecdsa_verify(json.dumps(rating["tx_summary"], indent=4),
+                                                        rating["signature"], buyer_key)
                         if not valid:
                             raise Exception("Bitcoin signature not valid")
 
                         if "buyer_guid" in rating["tx_summary"] or "buyer_guid_key" in rating["tx_summary"]:
                             buyer_key_bin = unhexlify(rating["tx_summary"]["buyer_guid_key"])
-                            buyer_key = nacl.signing.VerifyKey(buyer_key_bin)
-                            buyer_key.verify(json.dumps(rating["tx_summary"], indent=4),
-                                             base64.b64decode(rating["guid_signature"]))
+                            signatures.verify(buyer_key_bin, json.dumps(rating["tx_summary"], indent=4),
+                                              base64.b64decode(rating["guid_signature"]))
                             h = nacl.hash.sha512(buyer_key_bin)
                             pow_hash = h[40:]
                             if int(pow_hash[:6], 16) >= 50 or rating["tx_summary"]["buyer_guid"] != h[:40]:
@@ -1092,7 +1161,7 @@ class Server(object):
             contract = json.load(filename, object_pairs_hook=OrderedDict)
 
         buyer_guid = contract["buyer_order"]["order"]["id"]["guid"]
-        buyer_enc_key = nacl.signing.VerifyKey(
+        buyer_enc_key = SignatureCache.instance().verify_key(
             contract["buyer_order"]["order"]["id"]["pubkeys"]["guid"],
             encoder=nacl.encoding.HexEncoder).to_curve25519_public_key()
         if "refund" in contract:
@@ -1100,7 +1169,7 @@ class Server(object):
         else:
             refund_address = contract["buyer_order"]["order"]["refund_address"]
             chaincode = contract["buyer_order"]["order"]["payment"]["chaincode"]
-            masterkey_v = bitcointools.bip32_extract_key(KeyChain(self.db).bitcoin_master_privkey)
+            masterkey_v = bitcointools.bip32_extract_key(KeyChain.get(self.db).bitcoin_master_privkey)
             vendor_priv = derive_childkey(masterkey_v, chaincode, bitcointools.MAINNET_PRIVATE)
 
             refund_json = {"refund": {}}
@@ -1189,7 +1258,7 @@ class Server(object):
                     c.delete(True)
                     if contract_hash in data:
                         del data[contract_hash]
-            guid = KeyChain(self.db).guid
+            guid = KeyChain.get(self.db).guid
             moderator = Profile(self.db).get().moderator
             if (guid not in data or time.time() - data[guid] > 500000) and moderator:
                 self.make_moderator()
@@ -1205,7 +1274,14 @@ class Server(object):
             l.ParseFromString(self.db.listings.get_proto())
         except Exception:
             return
-        keychain = KeyChain(self.db)
+        keychain = KeyChain.get(self.db)
+
+        def save(bitcoin_sig, contract):
+            contract.contract["vendor_offer"]["signatures"]["bitcoin"] = bitcoin_sig
+            contract.previous_title = None
+            contract.save()
+
+        dl = []
         for listing in l.listing:
             try:
                 contract_hash = listing.contract_hash
@@ -1249,13 +1325,12 @@ class Server(object):
                 c.contract["vendor_offer"]["signatures"] = {}
                 c.contract["vendor_offer"]["signatures"]["guid"] = \
                     base64.b64encode(keychain.signing_key.sign(listing)[:64])
-                c.contract["vendor_offer"]["signatures"]["bitcoin"] = \
-                    bitcointools.encode_sig(*bitcointools.ecdsa_raw_sign(
-                        listing, bitcointools.bip32_extract_key(keychain.bitcoin_master_privkey)))
-                c.previous_title = None
-                c.save()
+                d = CryptoService.instance().run(
+                    ecdsa_sign, listing, bitcointools.bip32_extract_key(keychain.bitcoin_master_privkey))
+                dl.append(d.addCallback(save, c).addErrback(lambda e: None))
             except Exception:
                 pass
+        return defer.DeferredList(dl)
 
     @staticmethod
     def cache(file_to_save, filename):
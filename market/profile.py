@@ -1,6 +1,7 @@
 __author__ = 'chris'
-import gnupg
+from keys.pgpcache import PGPCache
 from protos import objects
+from twisted.internet import defer
 
 
 class Profile(object):
@@ -12,16 +13,59 @@ class Profile(object):
     """
 
     def __init__(self, db):
-        self.profile = objects.Profile()
         self.db = db
-        if self.db.profile.get_proto() is not None:
-            self.profile.ParseFromString(self.db.profile.get_proto())
+        self._profile = None
+
+    @property
+    def profile(self):
+        """The `objects.Profile`, only parsed from the stored proto once it's needed."""
+        if self._profile is None:
+            self._profile = objects.Profile()
+            proto = self.db.profile.get_proto()
+            if proto is not None:
+                self._profile.ParseFromString(proto)
+        return self._profile
 
     def get(self, serialized=False):
         if serialized:
             return self.profile.SerializeToString()
         return self.profile
 
+    def get_metadata(self):
+        """Returns the `Metadata` protobuf (name, handle, etc) we serve in place of the full profile."""
+        m = objects.Metadata()
+        m.name = self.profile.name
+        m.handle = self.profile.handle
+        m.short_description = self.profile.short_description
+        m.avatar_hash = self.profile.avatar_hash
+        m.nsfw = self.profile.nsfw
+        return m
+
+    def get_signed(self, signing_key):
+        """
+        Returns the stored profile, serialized, and its signature. The result is cached
+        until the profile changes.
+        """
+        return self._signed("profile", signing_key, lambda proto: proto)
+
+    def get_signed_metadata(self, signing_key):
+        """
+        Returns the serialized `Metadata` for the stored profile and its signature.
+        The result is cached until the profile changes.
+        """
+        return self._signed("metadata", signing_key, lambda _: self.get_metadata().SerializeToString())
+
+    def _signed(self, name, signing_key, serialize):
+        proto = self.db.profile.get_proto()
+        k = (name, signing_key.verify_key.encode())
+        cached = self.db.profile.signed.get(k)
+        if cached is not None and cached[0] is proto:
+            return cached[1]
+        serialized = serialize(proto if proto is not None else "")
+        signed = [serialized, signing_key.sign(serialized)[:64]]
+        self.db.profile.signed[k] = (proto, signed)
+        return signed
+
     def update(self, user_info):
         """
         To update the profile, create a new protobuf Profile object and add the
@@ -67,19 +111,26 @@ class Profile(object):
         """
         Adds a pgp public key to the profile. The user must have submitted a
         valid signature covering the guid otherwise the key will not be added to
-        the profile.
+        the profile. The signature is verified in a thread and the result is cached,
+        see `PGPCache`.
+
+        Returns:
+            A deferred which fires with True if the key was added.
         """
-        gpg = gnupg.GPG()
-        gpg.import_keys(public_key)
-        if gpg.verify(signature) and guid in signature:
+        if guid not in signature:
+            return defer.succeed(False)
+
+        def add(valid):
+            if not valid:
+                return False
             p = self.profile.PublicKey()
             p.public_key = public_key
             p.signature = signature
             self.profile.pgp_key.MergeFrom(p)
             self.db.profile.set_proto(self.profile.SerializeToString())
             return True
-        else:
-            return False
+
+        return PGPCache.instance().verify_in_thread(public_key, signature).addCallback(add)
 
     def remove_field(self, field):
         if field is not "name":
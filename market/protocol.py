@@ -1,7 +1,6 @@
 __author__ = 'chris'
 
 import json
-import nacl.signing
 import nacl.utils
 import nacl.encoding
 import nacl.hash
@@ -9,18 +8,20 @@ from binascii import unhexlify
 from collections import OrderedDict
 from interfaces import MessageProcessor, BroadcastListener, MessageListener, NotificationListener
 from keys.bip32utils import derive_childkey
+from keys.sigcache import SignatureCache
 from log import Logger
 from market.audit import Audit
 from market.contracts import Contract
 from market.moderation import process_dispute, close_dispute
 from market.profile import Profile
 from market.smtpnotification import SMTPNotification
+from market.storefront import Storefront
 from nacl.public import PublicKey, Box
 from net.rpcudp import RPCProtocol
 from protos.message import GET_CONTRACT, GET_IMAGE, GET_PROFILE, GET_LISTINGS, GET_USER_METADATA,\
     GET_CONTRACT_METADATA, FOLLOW, UNFOLLOW, GET_FOLLOWERS, GET_FOLLOWING, BROADCAST, MESSAGE, ORDER, \
     ORDER_CONFIRMATION, COMPLETE_ORDER, DISPUTE_OPEN, DISPUTE_CLOSE, GET_RATINGS, REFUND
-from protos.objects import Metadata, Listings, Followers, PlaintextMessage
+from protos.objects import Followers, PlaintextMessage
 from zope.interface import implements
 from zope.interface.exceptions import DoesNotImplement
 from zope.interface.verify import verifyObject
@@ -38,6 +39,8 @@ class MarketProtocol(RPCProtocol):
         self.multiplexer = None
         self.db = database
         self.signing_key = signing_key
+        self.storefront = Storefront(database, signing_key)
+        self.signed_following = None
         self.listeners = []
         self.handled_commands = [GET_CONTRACT, GET_IMAGE, GET_PROFILE, GET_LISTINGS, GET_USER_METADATA,
                                  GET_CONTRACT_METADATA, FOLLOW, UNFOLLOW, GET_FOLLOWERS, GET_FOLLOWING,
@@ -55,8 +58,9 @@ class MarketProtocol(RPCProtocol):
         self.audit.record(sender.id.encode("hex"), "GET_CONTRACT", contract_hash.encode('hex'))
         self.router.addContact(sender)
         try:
-            with open(self.db.filemap.get_file(contract_hash.encode("hex")), "r") as filename:
-                contract = filename.read()
+            contract = self.db.filemap.read(contract_hash.encode("hex"))
+            if contract is None:
+                raise Exception("Contract not found")
             return [contract]
         except Exception:
             self.log.warning("could not find contract %s" % contract_hash.encode('hex'))
@@ -69,8 +73,9 @@ class MarketProtocol(RPCProtocol):
                 self.log.warning("Image hash is not 20 characters %s" % image_hash)
                 raise Exception("Invalid image hash")
             self.log.info("serving image %s to %s" % (image_hash.encode('hex'), sender))
-            with open(self.db.filemap.get_file(image_hash.encode("hex")), "rb") as filename:
-                image = filename.read()
+            image = self.db.filemap.read(image_hash.encode("hex"))
+            if image is None:
+                raise Exception("Image not found")
             return [image]
         except Exception:
             self.log.warning("could not find image %s" % image_hash[:20].encode('hex'))
@@ -81,8 +86,7 @@ class MarketProtocol(RPCProtocol):
         self.audit.record(sender.id.encode("hex"), "GET_PROFILE")
         self.router.addContact(sender)
         try:
-            proto = Profile(self.db).get(True)
-            return [proto, self.signing_key.sign(proto)[:64]]
+            return Profile(self.db).get_signed(self.signing_key)
         except Exception:
             self.log.error("unable to load the profile")
             return None
@@ -91,14 +95,7 @@ class MarketProtocol(RPCProtocol):
         self.log.info("serving user metadata to %s" % sender)
         self.router.addContact(sender)
         try:
-            proto = Profile(self.db).get(False)
-            m = Metadata()
-            m.name = proto.name
-            m.handle = proto.handle
-            m.short_description = proto.short_description
-            m.avatar_hash = proto.avatar_hash
-            m.nsfw = proto.nsfw
-            return [m.SerializeToString(), self.signing_key.sign(m.SerializeToString())[:64]]
+            return Profile(self.db).get_signed_metadata(self.signing_key)
         except Exception:
             self.log.error("unable to load profile metadata")
             return None
@@ -108,15 +105,7 @@ class MarketProtocol(RPCProtocol):
         self.audit.record(sender.id.encode("hex"), "GET_LISTINGS")
         self.router.addContact(sender)
         try:
-            p = Profile(self.db).get()
-            l = Listings()
-            l.ParseFromString(self.db.listings.get_proto())
-            l.handle = p.handle
-            l.avatar_hash = p.avatar_hash
-            for listing in l.listing:
-                if listing.hidden:
-                    l.listing.remove(listing)
-            return [l.SerializeToString(), self.signing_key.sign(l.SerializeToString())[:64]]
+            return self.storefront.get_listings()
         except Exception:
             self.log.warning("could not find any listings in the database")
             return None
@@ -125,16 +114,7 @@ class MarketProtocol(RPCProtocol):
         self.log.info("serving metadata for contract %s to %s" % (contract_hash.encode("hex"), sender))
         self.router.addContact(sender)
         try:
-            proto = self.db.listings.get_proto()
-            p = Profile(self.db).get()
-            l = Listings()
-            l.ParseFromString(proto)
-            for listing in l.listing:
-                if listing.contract_hash == contract_hash:
-                    listing.avatar_hash = p.avatar_hash
-                    listing.handle = p.handle
-                    ser = listing.SerializeToString()
-            return [ser, self.signing_key.sign(ser)[:64]]
+            return self.storefront.get_contract_metadata(contract_hash)
         except Exception:
             self.log.warning("could not find metadata for contract %s" % contract_hash.encode("hex"))
             return None
@@ -143,8 +123,7 @@ class MarketProtocol(RPCProtocol):
         self.log.info("received follow request from %s" % sender)
         self.router.addContact(sender)
         try:
-            verify_key = nacl.signing.VerifyKey(sender.pubkey)
-            verify_key.verify(proto, signature)
+            SignatureCache.instance().verify(sender.pubkey, proto, signature, cache=False)
             f = Followers.Follower()
             f.ParseFromString(proto)
             if f.guid != sender.id:
@@ -152,14 +131,12 @@ class MarketProtocol(RPCProtocol):
             if f.following != self.node.id:
                 raise Exception('Following wrong node')
             f.signature = signature
-            self.db.follow.set_follower(f.SerializeToString())
-            proto = Profile(self.db).get(False)
-            m = Metadata()
-            m.name = proto.name
-            m.handle = proto.handle
-            m.avatar_hash = proto.avatar_hash
-            m.short_description = proto.short_description
-            m.nsfw = proto.nsfw
+        except Exception:
+            self.log.warning("failed to validate follower")
+            return ["False"]
+
+        def saved(_):
+            metadata = Profile(self.db).get_signed_metadata(self.signing_key)
             for listener in self.listeners:
                 try:
                     verifyObject(NotificationListener, listener)
@@ -174,49 +151,59 @@ class MarketProtocol(RPCProtocol):
                               "Handle: %s" %
                               (f.metadata.name, f.guid.encode('hex'), f.guid.encode('hex'), f.metadata.handle))
 
-            return ["True", m.SerializeToString(), self.signing_key.sign(m.SerializeToString())[:64]]
-        except Exception:
-            self.log.warning("failed to validate follower")
+            return ["True"] + metadata
+
+        def failed(failure):
+            self.log.warning("failed to accept follower: %s" % failure.getErrorMessage())
             return ["False"]
 
+        return self.db.deferred.follow.set_follower(f.SerializeToString()).addCallback(saved).addErrback(failed)
+
     def rpc_unfollow(self, sender, signature):
         self.log.info("received unfollow request from %s" % sender)
         self.router.addContact(sender)
         try:
-            verify_key = nacl.signing.VerifyKey(sender.pubkey)
-            verify_key.verify("unfollow:" + self.node.id, signature)
-            f = self.db.follow
-            f.delete_follower(sender.id)
-            return ["True"]
+            SignatureCache.instance().verify(sender.pubkey, "unfollow:" + self.node.id, signature, cache=False)
         except Exception:
             self.log.warning("failed to validate signature on unfollow request")
             return ["False"]
+        d = self.db.deferred.follow.delete_follower(sender.id)
+        return d.addCallbacks(lambda _: ["True"], lambda _: ["False"])
 
-    def rpc_get_followers(self, sender, start=None):
+    def rpc_get_followers(self, sender, start=None, cursor=None):
         self.log.info("serving followers list to %s" % sender)
         self.audit.record(sender.id.encode("hex"), "GET_FOLLOWERS")
         self.router.addContact(sender)
-        if start is not None:
-            ser = self.db.follow.get_followers(int(start))
+
+        def respond(ser):
+            # peers before protocol version 3 ignore the cursor for the next page
+            next_cursor = str(ser[2]) if ser[2] is not None else ""
+            return [ser[0], self.signing_key.sign(ser[0])[:64], ser[1], next_cursor]
+
+        if cursor:
+            d = self.db.deferred.follow.get_followers(cursor=int(cursor))
+        elif start is not None:
+            d = self.db.deferred.follow.get_followers(int(start))
         else:
-            ser = self.db.follow.get_followers()
-        return [ser[0], self.signing_key.sign(ser[0])[:64], ser[1]]
+            d = self.db.deferred.follow.get_followers()
+        return d.addCallback(respond)
 
     def rpc_get_following(self, sender):
         self.log.info("serving following list to %s" % sender)
         self.audit.record(sender.id.encode("hex"), "GET_FOLLOWING")
         self.router.addContact(sender)
+        # the following list is held in memory and the same str is returned until it changes
         ser = self.db.follow.get_following()
         if ser is None:
             return None
-        else:
-            return [ser, self.signing_key.sign(ser)[:64]]
+        if self.signed_following is None or self.signed_following[0] is not ser:
+            self.signed_following = [ser, self.signing_key.sign(ser)[:64]]
+        return self.signed_following
 
     def rpc_broadcast(self, sender, message, signature):
         if len(message) <= 140 and self.db.follow.is_following(sender.id):
             try:
-                verify_key = nacl.signing.VerifyKey(sender.pubkey)
-                verify_key.verify(message, signature)
+                SignatureCache.instance().verify(sender.pubkey, message, signature, cache=False)
             except Exception:
                 self.log.warning("received invalid broadcast from %s" % sender)
                 return ["False"]
@@ -240,8 +227,7 @@ class MarketProtocol(RPCProtocol):
             p.ParseFromString(plaintext)
             signature = p.signature
             p.ClearField("signature")
-            verify_key = nacl.signing.VerifyKey(p.pubkey)
-            verify_key.verify(p.SerializeToString(), signature)
+            SignatureCache.instance().verify(p.pubkey, p.SerializeToString(), signature, cache=False)
             h = nacl.hash.sha512(p.pubkey)
             pow_hash = h[40:]
             if int(pow_hash[:6], 16) >= 50 or p.sender_guid.encode("hex") != h[:40] or p.sender_guid != sender.id:
@@ -265,7 +251,13 @@ class MarketProtocol(RPCProtocol):
             order = box.decrypt(encrypted)
             c = Contract(self.db, contract=json.loads(order, object_pairs_hook=OrderedDict),
                          testnet=self.multiplexer.testnet)
-            v = c.verify(sender.pubkey)
+            return c.verify(sender.pubkey).addCallback(self._handle_order, sender, c)
+        except Exception, e:
+            self.log.error("Exception (%s) occurred processing order from %s" % (e.message, sender))
+            return ["False"]
+
+    def _handle_order(self, v, sender, c):
+        try:
             if v is True:
                 self.router.addContact(sender)
                 self.log.info("received an order from %s, waiting for payment..." % sender)
@@ -358,20 +350,24 @@ class MarketProtocol(RPCProtocol):
         self.log.info("serving ratings for contract %s to %s" % (a, sender))
         self.audit.record(sender.id.encode("hex"), "GET_RATINGS", a)
         self.router.addContact(sender)
-        try:
+
+        def respond(rows):
             ratings = []
-            if listing_hash:
-                for rating in self.db.ratings.get_listing_ratings(listing_hash.encode("hex")):
-                    ratings.append(json.loads(rating[0], object_pairs_hook=OrderedDict))
-            else:
-                for rating in self.db.ratings.get_all_ratings():
-                    ratings.append(json.loads(rating[0], object_pairs_hook=OrderedDict))
+            for rating in rows:
+                ratings.append(json.loads(rating[0], object_pairs_hook=OrderedDict))
             ret = json.dumps(ratings).encode("zlib")
             return [str(ret), self.signing_key.sign(ret)[:64]]
-        except Exception:
+
+        def failed(_):
             self.log.warning("could not load ratings for contract %s" % a)
             return None
 
+        if listing_hash:
+            d = self.db.deferred.ratings.get_listing_ratings(listing_hash.encode("hex"))
+        else:
+            d = self.db.deferred.ratings.get_all_ratings()
+        return d.addCallback(respond).addErrback(failed)
+
     def rpc_refund(self, sender, pubkey, encrypted):
         try:
             box = Box(self.signing_key.to_curve25519_private_key(), PublicKey(pubkey))
@@ -419,8 +415,10 @@ class MarketProtocol(RPCProtocol):
         d = self.unfollow(nodeToAsk, signature)
         return d.addCallback(self.handleCallResponse, nodeToAsk)
 
-    def callGetFollowers(self, nodeToAsk, start=None):
-        if start is None:
+    def callGetFollowers(self, nodeToAsk, start=None, cursor=None):
+        if cursor is not None:
+            d = self.get_followers(nodeToAsk, start or 0, cursor)
+        elif start is None:
             d = self.get_followers(nodeToAsk)
         else:
             d = self.get_followers(nodeToAsk, start)
@@ -0,0 +1,70 @@
+__author__ = 'chris'
+
+from protos.objects import Listings, Profile
+
+
+class Storefront(object):
+    """
+    Holds the signed responses to GET_LISTINGS and GET_CONTRACT_METADATA ready to
+    send, so serving a popular store doesn't mean parsing, filtering and signing
+    the listings on every request.
+
+    The responses are rebuilt when the listings or the profile change. The stores
+    return the same serialized `str` until they are written to, so checking for
+    changes is an identity comparison.
+    """
+
+    def __init__(self, db, signing_key):
+        self.db = db
+        self.signing_key = signing_key
+        self.listings_proto = None
+        self.profile_proto = None
+        self.listings = None
+        self.signed_listings = [None, None]
+        self.signed_metadata = {}
+
+    def _refresh(self):
+        listings_proto = self.db.listings.get_proto()
+        profile_proto = self.db.profile.get_proto()
+        if self.listings is not None and listings_proto is self.listings_proto and \
+                profile_proto is self.profile_proto:
+            return
+        p = Profile()
+        if profile_proto is not None:
+            p.ParseFromString(profile_proto)
+        l = Listings()
+        l.ParseFromString(listings_proto)
+
+        visible = Listings()
+        visible.handle = p.handle
+        visible.avatar_hash = p.avatar_hash
+        visible.listing.extend([listing for listing in l.listing if not listing.hidden])
+        ser = visible.SerializeToString()
+        self.signed_listings = [ser, self.signing_key.sign(ser)[:64]]
+
+        # the metadata for a single contract carries the store's handle and avatar
+        for listing in l.listing:
+            listing.avatar_hash = p.avatar_hash
+            listing.handle = p.handle
+        self.listings = dict((listing.contract_hash, listing) for listing in l.listing)
+        self.signed_metadata = {}
+        self.listings_proto = listings_proto
+        self.profile_proto = profile_proto
+
+    def get_listings(self):
+        """Returns the serialized `Listings`, without the hidden listings, and its signature."""
+        self._refresh()
+        return self.signed_listings
+
+    def get_contract_metadata(self, contract_hash):
+        """
+        Returns the serialized `ListingMetadata` for the contract and its signature.
+        Raises `KeyError` if we aren't selling the contract.
+        """
+        self._refresh()
+        try:
+            return self.signed_metadata[contract_hash]
+        except KeyError:
+            ser = self.listings[contract_hash].SerializeToString()
+            signed = self.signed_metadata[contract_hash] = [ser, self.signing_key.sign(ser)[:64]]
+            return signed
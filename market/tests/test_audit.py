@@ -0,0 +1,73 @@
+import os
+
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+from db import connection
+from db.datastore import Database
+from market.audit import Audit
+
+
+class AuditTest(unittest.TestCase):
+    def setUp(self):
+        self.db = Database(filepath="test.db")
+        self.clock = task.Clock()
+        self.audit = Audit(self.db, flush_interval=5, batch_size=3, max_queue=4, clock=self.clock)
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.db.deferred.stop()
+        connection.close_all("test.db")
+        os.remove("test.db")
+
+    def test_record_is_queued(self):
+        self.audit.record("guid", "GET_PROFILE")
+        self.audit.record("guid", "GET_CONTRACT", "hash")
+        self.assertEqual(self.db.audit_shopping.get(), [])
+        self.assertEqual(self.audit.get_stats()["queued"], 2)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+
+    @defer.inlineCallbacks
+    def test_flush_on_timer(self):
+        self.audit.record("guid", "GET_CONTRACT", "hash")
+        self.audit.record("guid", "UNKNOWN")
+        self.clock.advance(5)
+        yield self.audit.flushing
+        events = self.db.audit_shopping.get()
+        self.assertEqual(len(events), 1)
+        self.assertEqual((events[0][1], events[0][2], events[0][4]), ("guid", "hash", 1))
+        self.assertEqual(self.audit.get_stats(), {"queued": 0, "written": 1, "dropped": 0})
+
+    @defer.inlineCallbacks
+    def test_flush_on_batch_size(self):
+        for _ in range(3):
+            self.audit.record("guid", "GET_LISTINGS")
+        self.assertIsNotNone(self.audit.flushing)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        yield self.audit.flush()
+        self.assertEqual(len(self.db.audit_shopping.get()), 3)
+
+    @defer.inlineCallbacks
+    def test_drop_when_full(self):
+        for _ in range(3):
+            self.audit.record("guid", "GET_LISTINGS")
+        for _ in range(6):
+            self.audit.record("guid", "GET_PROFILE")
+        self.assertEqual(self.audit.dropped, 2)
+        yield self.audit.flush()
+        self.assertEqual(len(self.db.audit_shopping.get()), 7)
+        self.assertEqual(self.audit.get_stats(), {"queued": 0, "written": 7, "dropped": 2})
+
+    @defer.inlineCallbacks
+    def test_prune(self):
+        self.db.audit_shopping.set_many([("guid", 3600, "hash", 1)])
+        self.audit.record("guid", "GET_PROFILE")
+        yield self.audit.flush()
+        self.assertEqual(len(self.db.audit_shopping.get()), 1)
+        self.assertEqual(len(self.db.audit_shopping.get_rollups()), 1)
+        self.assertEqual(len(self.db.audit_shopping.get_rollups(daily=True)), 2)
+
+    def test_disabled(self):
+        audit = Audit(self.db, enabled=False, clock=self.clock)
+        audit.record("guid", "GET_PROFILE")
+        self.assertEqual(audit.get_stats()["queued"], 0)
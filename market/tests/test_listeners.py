@@ -3,6 +3,7 @@ from twisted.python import log
 from mock import MagicMock
 import mock
 
+from db.deferreddb import DeferredDatabase
 from market.listeners import MessageListenerImpl, BroadcastListenerImpl, NotificationListenerImpl
 from protos.objects import PlaintextMessage
 
@@ -14,6 +15,7 @@ class MarketListenersTest(unittest.TestCase):
         log.addObserver(observer)
         self.addCleanup(log.removeObserver, observer)
         self.db = MagicMock()
+        self.db.deferred = DeferredDatabase(self.db, threaded=False)
         self.ws = MagicMock()
 
     @staticmethod
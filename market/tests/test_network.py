@@ -0,0 +1,146 @@
+__author__ = 'chris'
+
+import time
+import nacl.signing
+import nacl.encoding
+import nacl.hash
+from binascii import unhexlify
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+from dht.node import Node
+from keys.cryptoservice import CryptoService
+from log import Logger
+from market.network import Server, PREWARM_WINDOW
+from protos import objects
+
+
+class FakeProtocol(object):
+    multiplexer = {}
+
+    def __init__(self, response):
+        self.response = response
+
+    def callGetFollowers(self, node_to_ask, start=None, cursor=None):
+        return defer.succeed((True, self.response))
+
+
+class FakeHandler(object):
+    def __init__(self, node):
+        self.node = node
+        self.time_last_message = 0
+
+
+class FakeConnection(object):
+    def __init__(self, node):
+        self.handler = FakeHandler(node)
+        self.shutdowns = 0
+
+    def shutdown(self):
+        self.shutdowns += 1
+
+
+class FakeMultiplexer(dict):
+    relay_node = None
+
+
+class FakeKServer(object):
+    def __init__(self, node, multiplexer):
+        self.node = node
+        self.protocol = self
+        self.multiplexer = multiplexer
+
+    def resolve(self, guid):
+        if self.node is None:
+            return defer.fail(Exception("lookup failed"))
+        return defer.succeed(self.node)
+
+    def callPing(self, node):
+        self.multiplexer[(node.ip, node.port)] = FakeConnection(node)
+        return defer.succeed((True, None))
+
+
+class GetFollowersTest(unittest.TestCase):
+    def setUp(self):
+        CryptoService(processes=0)
+        self.node_key = nacl.signing.SigningKey.generate()
+        self.node = Node("b" * 20, "127.0.0.1", 18467, self.node_key.verify_key.encode())
+        # a key with a valid guid proof of work
+        valid_key = "63d901c4d57cde34fc1f1e28b9af5d56ed342cae5c2fb470046d0130a4226b0c"
+        self.follower_key = nacl.signing.SigningKey(valid_key, encoder=nacl.encoding.HexEncoder)
+
+    def _server(self, followers):
+        server = Server.__new__(Server)
+        server.log = Logger(system=server)
+        ser = followers.SerializeToString()
+        server.protocol = FakeProtocol([ser, self.node_key.sign(ser)[:64], str(len(followers.followers))])
+        return server
+
+    def _follower(self, followers):
+        follower = followers.followers.add()
+        pubkey = self.follower_key.verify_key.encode()
+        follower.guid = unhexlify(nacl.hash.sha512(pubkey)[:40])
+        follower.following = self.node.id
+        follower.pubkey = pubkey
+        follower.metadata.name = "Follower"
+        follower.signature = self.follower_key.sign(follower.SerializeToString())[:64]
+        return follower
+
+    def test_forged_follower_with_copied_signature(self):
+        f = objects.Followers()
+        follower = self._follower(f)
+        forged = f.followers.add()
+        forged.CopyFrom(follower)
+        forged.metadata.name = "Forged"
+
+        def check(result):
+            valid, count, cursor = result
+            self.assertEqual([follower], list(valid.followers))
+            self.assertEqual("2", count)
+            self.assertIsNone(cursor)
+        server = self._server(f)
+        # the second time the real follower's signature is cached
+        d = server.get_followers(self.node).addCallback(check)
+        return d.addCallback(lambda _: server.get_followers(self.node)).addCallback(check)
+
+
+class PrewarmTest(unittest.TestCase):
+    def setUp(self):
+        self.node = Node("b" * 20, "127.0.0.1", 18467)
+        self.multiplexer = FakeMultiplexer()
+        self.clock = task.Clock()
+
+    def _server(self, node):
+        server = Server.__new__(Server)
+        server.log = Logger(system=server)
+        server.clock = self.clock
+        server.prewarmed = {}
+        server.kserver = FakeKServer(node, self.multiplexer)
+        server.protocol = server.kserver
+        return server
+
+    @defer.inlineCallbacks
+    def test_unused_connection_expires(self):
+        reached = yield self._server(self.node).prewarm(self.node.id.encode("hex"))
+        self.assertTrue(reached)
+        connection = self.multiplexer[("127.0.0.1", 18467)]
+        self.clock.advance(PREWARM_WINDOW - 1)
+        self.assertEqual(connection.shutdowns, 0)
+        self.clock.advance(1)
+        self.assertEqual(connection.shutdowns, 1)
+
+    @defer.inlineCallbacks
+    def test_used_connection_kept(self):
+        yield self._server(self.node).prewarm(self.node.id.encode("hex"))
+        connection = self.multiplexer[("127.0.0.1", 18467)]
+        connection.handler.time_last_message = time.time() + 1
+        self.clock.advance(PREWARM_WINDOW)
+        self.assertEqual(connection.shutdowns, 0)
+
+    @defer.inlineCallbacks
+    def test_failed_lookup(self):
+        server = self._server(None)
+        reached = yield server.prewarm(self.node.id.encode("hex"))
+        self.assertFalse(reached)
+        self.assertEqual(server.prewarmed, {})
+        self.assertEqual(self.clock.getDelayedCalls(), [])
@@ -1,7 +1,10 @@
+import nacl.signing
+from twisted.internet import defer
 from twisted.trial import unittest
 from protos import objects
 import os
 
+from db import connection
 from db.datastore import Database
 from market.profile import Profile
 
@@ -70,6 +73,7 @@ zaX5wLzZGfrFtWetE1kFBbzlmdb8jARlkRB68nvzSH3vCoyLkRXa9/l7FXouIuNG
         self.db.profile.set_temp_handle("test_handle")
 
     def tearDown(self):
+        connection.close_all("test.db")
         os.remove("test.db")
 
     def test_MarketProfile_get_success(self):
@@ -169,14 +173,47 @@ zaX5wLzZGfrFtWetE1kFBbzlmdb8jARlkRB68nvzSH3vCoyLkRXa9/l7FXouIuNG
         p = Profile(self.db)
         self.assertEqual("test_handle", p.get_temp_handle())
 
+    @defer.inlineCallbacks
     def test_MarketProfile_add_pgp_key_success(self):
         p = Profile(self.db)
-        self.assertTrue(p.add_pgp_key(self.PUBLIC_KEY, self.SIGNATURE, self.VALID_GUID))
+        added = yield p.add_pgp_key(self.PUBLIC_KEY, self.SIGNATURE, self.VALID_GUID)
+        self.assertTrue(added)
         u = p.get()
         self.assertEqual(self.SIGNATURE, u.pgp_key.signature)
         self.assertEqual(self.PUBLIC_KEY, u.pgp_key.public_key)
 
+    @defer.inlineCallbacks
     def test_MarketProfile_add_pgp_key_wrong_guid(self):
         p = Profile(self.db)
         wrong_guid = '5c2dedbd-5977-4326-b965-c9a2435c8e91'
-        self.assertFalse(p.add_pgp_key(self.PUBLIC_KEY, self.SIGNATURE, wrong_guid))
+        added = yield p.add_pgp_key(self.PUBLIC_KEY, self.SIGNATURE, wrong_guid)
+        self.assertFalse(added)
+
+    def test_MarketProfile_get_signed_cached(self):
+        signing_key = nacl.signing.SigningKey.generate()
+        p = Profile(self.db)
+        signed = p.get_signed(signing_key)
+        self.assertEqual(self.db.profile.get_proto(), signed[0])
+        signing_key.verify_key.verify(signed[0], signed[1])
+        self.assertIs(Profile(self.db).get_signed(signing_key), signed)
+
+        u = objects.Profile()
+        u.name = "new_name"
+        p.update(u)
+        updated = Profile(self.db).get_signed(signing_key)
+        self.assertIsNot(updated, signed)
+        self.assertEqual("new_name", Profile(Database(filepath="test.db")).get().name)
+
+    def test_MarketProfile_get_signed_metadata(self):
+        signing_key = nacl.signing.SigningKey.generate()
+        signed = Profile(self.db).get_signed_metadata(signing_key)
+        signing_key.verify_key.verify(signed[0], signed[1])
+        m = objects.Metadata()
+        m.ParseFromString(signed[0])
+        self.assertEqual("test_name", m.name)
+        p = Profile(self.db)
+        self.assertIs(p.get_signed_metadata(signing_key), signed)
+        # served from the cache without parsing the profile
+        self.assertIsNone(p._profile)
+        Profile(self.db).remove_field("about")
+        self.assertIsNot(Profile(self.db).get_signed_metadata(signing_key), signed)
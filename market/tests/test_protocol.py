@@ -1,11 +1,18 @@
+import json
+import os
+import nacl.signing
+from twisted.internet import defer
 from twisted.trial import unittest
 from twisted.python import log
 
+from db import connection
+from db.datastore import Database
 from dht.node import Node
 from dht.utils import digest
 from dht.routing import RoutingTable
 from market.protocol import MarketProtocol
 from dht.tests.utils import mknode
+from protos.objects import Followers, Metadata
 
 class MarketProtocolTest(unittest.TestCase):
     def setUp(self):
@@ -36,3 +43,80 @@ class MarketProtocolTest(unittest.TestCase):
         exception_message = catcher.pop()
         self.assertEquals(catch_exception["message"][0], "[WARNING] could not find image 696e76616c69645f68617368")
         self.assertEquals(exception_message["message"][0], "[WARNING] Image hash is not 20 characters invalid_hash")
+
+
+class MarketProtocolDatabaseTest(unittest.TestCase):
+    """The rpcs which load from and save to the database in the database thread."""
+
+    def setUp(self):
+        self.catcher = []
+        observer = self.catcher.append
+        log.addObserver(observer)
+        self.addCleanup(log.removeObserver, observer)
+        self.db = Database(filepath="test.db")
+        self.db.settings.update("", "USD", "", "", "", 0, "", "", "", "", "", 0, "", "", "", "", "")
+        self.signing_key = nacl.signing.SigningKey.generate()
+        self.node = Node(digest("node"), "127.0.0.1", 1234, self.signing_key.verify_key.encode())
+        self.router = RoutingTable(self, 20, self.node.id)
+        self.protocol = MarketProtocol(self.node, self.router, self.signing_key, self.db, audit=False)
+        self.sender_key = nacl.signing.SigningKey.generate()
+        self.sender = Node(digest("sender"), "127.0.0.2", 1234, self.sender_key.verify_key.encode())
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.db.deferred.stop()
+        connection.close_all("test.db")
+        os.remove("test.db")
+
+    def _follower(self):
+        f = Followers.Follower()
+        f.guid = self.sender.id
+        f.following = self.node.id
+        f.pubkey = self.sender.pubkey
+        f.metadata.name = "Sender"
+        ser = f.SerializeToString()
+        return ser, self.sender_key.sign(ser)[:64]
+
+    @defer.inlineCallbacks
+    def test_rpc_follow_and_unfollow(self):
+        result = yield self.protocol.rpc_follow(self.sender, *self._follower())
+        self.assertEqual(result[0], "True")
+        Metadata().ParseFromString(result[1])
+        self.signing_key.verify_key.verify(result[1], result[2])
+        self.assertEqual(self.db.follow.get_follower_count(), 1)
+
+        signature = self.sender_key.sign("unfollow:" + self.node.id)[:64]
+        result = yield self.protocol.rpc_unfollow(self.sender, signature)
+        self.assertEqual(result, ["True"])
+        self.assertEqual(self.db.follow.get_follower_count(), 0)
+
+    @defer.inlineCallbacks
+    def test_rpc_follow_logs_failure(self):
+        self.db.settings.get = lambda: None
+        result = yield self.protocol.rpc_follow(self.sender, *self._follower())
+        self.assertEqual(result, ["False"])
+        messages = [e["message"][0] for e in self.catcher if e.get("message")]
+        self.assertIn("[WARNING] failed to accept follower: 'NoneType' object has no attribute '__getitem__'",
+                      messages)
+
+    @defer.inlineCallbacks
+    def test_rpc_get_followers(self):
+        ser, signature = self._follower()
+        yield self.protocol.rpc_follow(self.sender, ser, signature)
+        result = yield self.protocol.rpc_get_followers(self.sender)
+        self.signing_key.verify_key.verify(result[0], result[1])
+        f = Followers()
+        f.ParseFromString(result[0])
+        self.assertEqual([self.sender.id], [follower.guid for follower in f.followers])
+        self.assertEqual(result[2:], [1, ""])
+
+    @defer.inlineCallbacks
+    def test_rpc_get_ratings(self):
+        listing_hash = digest("listing")
+        self.db.ratings.add_rating(listing_hash.encode("hex"), json.dumps({"rating": 5}))
+        self.db.ratings.add_rating(digest("other").encode("hex"), json.dumps({"rating": 1}))
+        result = yield self.protocol.rpc_get_ratings(self.sender, listing_hash)
+        self.signing_key.verify_key.verify(result[0], result[1])
+        self.assertEqual(json.loads(result[0].decode("zlib")), [{"rating": 5}])
+        result = yield self.protocol.rpc_get_ratings(self.sender)
+        self.assertEqual(len(json.loads(result[0].decode("zlib"))), 2)
@@ -0,0 +1,67 @@
+import os
+
+import nacl.signing
+from twisted.trial import unittest
+
+from db import connection
+from db.datastore import Database
+from market.profile import Profile
+from market.storefront import Storefront
+from protos import objects
+
+
+class StorefrontTest(unittest.TestCase):
+    def setUp(self):
+        self.db = Database(filepath="test.db")
+        self.signing_key = nacl.signing.SigningKey.generate()
+        u = objects.Profile()
+        u.handle = "@test"
+        self.db.profile.set_proto(u.SerializeToString())
+        self.add_listing("a" * 20, "visible")
+        self.add_listing("b" * 20, "hidden", hidden=True)
+        self.storefront = Storefront(self.db, self.signing_key)
+
+    def tearDown(self):
+        connection.close_all("test.db")
+        os.remove("test.db")
+
+    def add_listing(self, contract_hash, title, hidden=False):
+        listing = objects.Listings.ListingMetadata()
+        listing.contract_hash = contract_hash
+        listing.title = title
+        listing.hidden = hidden
+        self.db.listings.add_listing(listing)
+
+    def test_get_listings(self):
+        ser, signature = self.storefront.get_listings()
+        self.signing_key.verify_key.verify(ser, signature)
+        l = objects.Listings()
+        l.ParseFromString(ser)
+        self.assertEqual("@test", l.handle)
+        self.assertEqual(["visible"], [listing.title for listing in l.listing])
+        self.assertIs(self.storefront.get_listings()[0], ser)
+
+    def test_get_listings_rebuilt_on_change(self):
+        ser = self.storefront.get_listings()[0]
+        self.add_listing("c" * 20, "new")
+        self.assertIsNot(self.storefront.get_listings()[0], ser)
+        ser = self.storefront.get_listings()[0]
+        self.db.listings.delete_listing("c" * 20)
+        self.assertIsNot(self.storefront.get_listings()[0], ser)
+        ser = self.storefront.get_listings()[0]
+        u = objects.Profile()
+        u.handle = "@renamed"
+        Profile(self.db).update(u)
+        l = objects.Listings()
+        l.ParseFromString(self.storefront.get_listings()[0])
+        self.assertEqual("@renamed", l.handle)
+
+    def test_get_contract_metadata(self):
+        ser, signature = self.storefront.get_contract_metadata("b" * 20)
+        self.signing_key.verify_key.verify(ser, signature)
+        listing = objects.Listings.ListingMetadata()
+        listing.ParseFromString(ser)
+        self.assertEqual("hidden", listing.title)
+        self.assertEqual("@test", listing.handle)
+        self.assertIs(self.storefront.get_contract_metadata("b" * 20)[0], ser)
+        self.assertRaises(KeyError, self.storefront.get_contract_metadata, "c" * 20)
@@ -0,0 +1,98 @@
+__author__ = 'chris'
+
+import time
+from log import Logger
+from protos.message import Command, NOT_FOUND, CALM_DOWN
+
+
+class CommandDispatcher(object):
+    """
+    Routes incoming messages to the `MessageProcessor` that handles their command.
+
+    The table mapping each command to its (processor, bound rpc method) pair is built
+    when a processor is registered, so nothing needs to be looked up per datagram.
+    NOT_FOUND and CALM_DOWN responses don't belong to any one processor and are passed
+    to all of them.
+
+    It also keeps a count of the messages received for each command and the CPU time
+    spent processing them (including running the rpc handler for requests).
+    """
+
+    def __init__(self, processors=None):
+        """
+        Args:
+            processors: an existing `list` of processors to dispatch to. The list is
+                shared, not copied, so `register` and `unregister` update it in place.
+        """
+        self.processors = processors if processors is not None else []
+        self.table = {}
+        self.stats = {}
+        self.log = Logger(system=self)
+        self._build_table()
+
+    def register(self, processor):
+        if processor not in self.processors:
+            self.processors.append(processor)
+        self._build_table()
+
+    def unregister(self, processor):
+        if processor in self.processors:
+            self.processors.remove(processor)
+        self._build_table()
+
+    def _build_table(self):
+        table = {}
+        for processor in self.processors:
+            for command in processor:
+                if command in table:
+                    self.log.warning("%s is already handled by %s, ignoring %s" %
+                                     (Command.Name(command), table[command][0].__class__.__name__,
+                                      processor.__class__.__name__))
+                    continue
+                handler = getattr(processor, "rpc_%s" % Command.Name(command).lower(), None)
+                table[command] = (processor, handler if callable(handler) else None)
+        self.table = table
+
+    def dispatch(self, message, sender, connection, ban_score):
+        """
+        Pass the message to the processor registered for its command.
+
+        Returns:
+            False if no processor handles the command, otherwise True.
+        """
+        command = message.command
+        start = time.clock()
+        if command in (NOT_FOUND, CALM_DOWN):
+            for processor in self.processors:
+                processor.receive_message(message, sender, connection, ban_score)
+        else:
+            try:
+                processor, handler = self.table[command]
+            except KeyError:
+                self._record(command, 0)
+                return False
+            processor.receive_message(message, sender, connection, ban_score, handler)
+        self._record(command, time.clock() - start)
+        return True
+
+    def _record(self, command, cpu_time):
+        try:
+            stat = self.stats[command]
+        except KeyError:
+            stat = self.stats[command] = [0, 0.0]
+        stat[0] += 1
+        stat[1] += cpu_time
+
+    def get_stats(self):
+        """
+        Returns a `dict` of command name to the number of messages received and
+        the total CPU seconds spent processing them.
+        """
+        ret = {}
+        for command, (received, cpu_time) in self.stats.items():
+            try:
+                name = Command.Name(command)
+            except ValueError:
+                name = str(command)
+            ret[name] = {"received": received, "cpu_time": cpu_time}
+        return ret
@@ -1,60 +1,201 @@
 __author__ = 'chris'
 
+from collections import namedtuple
 from log import Logger
-from protos.message import Command, FOLLOW, UNFOLLOW
-from twisted.internet import reactor, task
+from protos.message import Command, FOLLOW, UNFOLLOW, STORE, DELETE, FIND_VALUE, FIND_NODE, \
+    GET_CONTRACT, GET_IMAGE, GET_LISTINGS, GET_PROFILE, GET_FOLLOWERS, GET_FOLLOWING, GET_RATINGS, \
+    GET_CONTRACT_METADATA, GET_USER_METADATA, MESSAGE, BROADCAST, ORDER
+from twisted.internet import reactor
 
-RECONNECTIONS = 100
-MALFORMATED = 110
+# capacity: the burst of messages allowed.
+# rate: the number of messages per second the bucket refills at.
+# strikes: the number of strikes a peer gets for each message over the limit.
+RateLimit = namedtuple("RateLimit", ["capacity", "rate", "strikes"])
 
-SCORES = {
-    FOLLOW: 0,
-    UNFOLLOW: 0
+MAX_STRIKES = 20
+
+# `Server.update_listings` republishes every keyword of every listing at once (and deletes
+# them when listings expire). Each keyword is looked up with FIND_NODE and stored on the
+# ksize nearest nodes, so on a small network a peer can get a FIND_NODE and a STORE for
+# every keyword. This is enough for a vendor with 100 listings with 10 keywords each.
+REPUBLISH_BURST = 1000
+
+LIMITS = {
+    FOLLOW: RateLimit(3, 1 / 30.0, MAX_STRIKES),
+    UNFOLLOW: RateLimit(3, 1 / 30.0, MAX_STRIKES),
+    STORE: RateLimit(REPUBLISH_BURST, 5, 1),
+    DELETE: RateLimit(REPUBLISH_BURST, 5, 1),
+    FIND_NODE: RateLimit(REPUBLISH_BURST, 10, 1),
+    FIND_VALUE: RateLimit(100, 10, 1),
+    GET_CONTRACT: RateLimit(50, 5, 1),
+    GET_IMAGE: RateLimit(50, 5, 1),
+    GET_LISTINGS: RateLimit(20, 1, 1),
+    GET_PROFILE: RateLimit(20, 1, 1),
+    GET_FOLLOWERS: RateLimit(20, 1, 1),
+    GET_FOLLOWING: RateLimit(20, 1, 1),
+    GET_RATINGS: RateLimit(20, 1, 1),
+    MESSAGE: RateLimit(30, 1, 1),
+    BROADCAST: RateLimit(10, 1 / 6.0, 1),
+    ORDER: RateLimit(10, 1 / 6.0, 2)
 }
+DEFAULT_LIMIT = RateLimit(200, 20, 1)
+
+# The cost of each command against a peer's overall budget, roughly in proportion
+# to the CPU and bandwidth it takes us to answer.
+COSTS = {
+    GET_IMAGE: 10,
+    GET_CONTRACT: 5,
+    GET_LISTINGS: 5,
+    GET_CONTRACT_METADATA: 2,
+    GET_USER_METADATA: 2,
+    GET_PROFILE: 2,
+    GET_FOLLOWERS: 3,
+    GET_FOLLOWING: 3,
+    GET_RATINGS: 3,
+    FIND_VALUE: 2,
+    ORDER: 10
+}
+# room for a republish burst of STORE and FIND_NODE on top of normal traffic
+PEER_LIMIT = RateLimit(3 * REPUBLISH_BURST, 50, 1)
+
+# Strikes are forgiven at this rate (per second).
+STRIKE_DECAY = 1 / 30.0
+
+
+class TokenBucket(object):
+    """
+    A token bucket which is refilled lazily, when it's used, so idle buckets cost
+    nothing and no periodic sweep is needed.
+    """
+    __slots__ = ["tokens", "last"]
+
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.last = now
+
+    def refill(self, capacity, rate, now):
+        """Add the tokens earned since the last refill and return how many there are."""
+        self.tokens = min(capacity, self.tokens + (now - self.last) * rate)
+        self.last = now
+        return self.tokens
+
+
+class Peer(object):
+    __slots__ = ["commands", "budget", "strikes", "bans", "last_seen"]
+
+    def __init__(self, now):
+        self.commands = {}
+        self.budget = TokenBucket(PEER_LIMIT.capacity, now)
+        self.strikes = 0
+        self.bans = 0
+        self.last_seen = now
+
+    def strike(self, strikes, now):
+        """Forgive the strikes that have decayed since the last request, then add new ones."""
+        self.strikes = max(0, self.strikes - (now - self.last_seen) * STRIKE_DECAY) + strikes
 
 
 class BanScore(object):
+    """
+    Rate limits incoming requests per IP address and per command using token buckets.
 
-    def __init__(self, multiplexer, ban_time=86400):
+    Each command has its own bucket and every request also draws its cost from the
+    peer's overall budget. Requests over either limit are refused (the peer is sent
+    CALM_DOWN) and earn the peer strikes; strikes are forgiven over time. A peer who reaches `MAX_STRIKES` is
+    banned, and each subsequent ban lasts twice as long as the last.
+    """
+
+    def __init__(self, multiplexer, ban_time=3600, max_ban_time=7 * 86400,
+                 limits=None, costs=None, max_peers=10000, clock=reactor):
+        """
+        Args:
+            multiplexer: the `OpenBazaarProtocol` whose connections we're limiting.
+            ban_time: seconds for a peer's first ban.
+            max_ban_time: the longest a ban will escalate to.
+            limits: a `dict` of command to `RateLimit`, overriding the defaults in `LIMITS`.
+            costs: a `dict` of command to cost, overriding the defaults in `COSTS`.
+            max_peers: the number of peers to track before forgetting idle ones.
+            clock: an `IReactorTime` provider.
+        """
         self.multiplexer = multiplexer
         self.ban_time = ban_time
+        self.max_ban_time = max_ban_time
+        self.limits = dict(LIMITS)
+        self.limits.update(limits or {})
+        self.costs = dict(COSTS)
+        self.costs.update(costs or {})
+        self.max_peers = max_peers
+        self.clock = clock
         self.peers = {}
-        self.scoring_loop = task.LoopingCall(self.adjust_scores)
-        self.scoring_loop.start(30, now=False)
+        self.last_forget = 0
+        self.dropped = 0
         self.log = Logger(system=self)
 
     def process_message(self, peer, message):
-        if peer[0] not in self.peers:
-            self.peers[peer[0]] = SCORES.copy()
+        """
+        Count an incoming request against the peer's limits.
+
+        Args:
+            peer: a `tuple` of the peer's (ip address, port).
+            message: the `Message` protobuf.
 
+        Returns:
+            True if the request should be processed, False if it should be refused.
+        """
+        now = self.clock.seconds()
+        ip = peer[0]
         try:
-            if message.command == FOLLOW:
-                self.peers[peer[0]][FOLLOW] += 1
-                if self.peers[peer[0]][FOLLOW] > 3:
-                    self.ban(peer, FOLLOW)
-            elif message.command == UNFOLLOW:
-                self.peers[peer[0]][UNFOLLOW] += 1
-                if self.peers[peer[0]][UNFOLLOW] > 3:
-                    self.ban(peer, UNFOLLOW)
-
-        except Exception:
-            self.log.warning("Exception processing banscore")
+            p = self.peers[ip]
+        except KeyError:
+            if len(self.peers) >= self.max_peers and now - self.last_forget > 60:
+                self._forget_idle(now)
+            p = self.peers[ip] = Peer(now)
+
+        command = message.command
+        limit = self.limits.get(command, DEFAULT_LIMIT)
+        try:
+            bucket = p.commands[command]
+        except KeyError:
+            bucket = p.commands[command] = TokenBucket(limit.capacity, now)
+
+        # nothing is taken from either bucket unless both have enough
+        cost = self.costs.get(command, 1)
+        if (bucket.refill(limit.capacity, limit.rate, now) >= 1 and
+                p.budget.refill(PEER_LIMIT.capacity, PEER_LIMIT.rate, now) >= cost):
+            bucket.tokens -= 1
+            p.budget.tokens -= cost
+            if p.strikes:
+                p.strike(0, now)
+            p.last_seen = now
+            return True
+
+        self.dropped += 1
+        p.strike(limit.strikes, now)
+        p.last_seen = now
+        if p.strikes >= MAX_STRIKES:
+            self.ban(peer, command)
+        return False
 
     def ban(self, peer, message_type):
+        p = self.peers.get(peer[0])
+        bans = 0
+        if p is not None:
+            bans = p.bans
+            p.bans += 1
+            p.commands.clear()
+            p.strikes = 0
+        ban_time = min(self.ban_time * 2 ** bans, self.max_ban_time)
         reason = Command.Name(message_type)
-        self.log.warning("Banned %s. Reason: too many %s messages." %
-                         (peer[0], reason))
+        self.log.warning("Banned %s for %s seconds. Reason: too many %s messages." %
+                         (peer[0], ban_time, reason))
         self.multiplexer.ban_ip(peer[0])
         if peer in self.multiplexer:
             self.multiplexer[peer].shutdown()
-        reactor.callLater(self.ban_time, self.multiplexer.remove_ip_ban, peer[0])
-
-    def adjust_scores(self):
-        for peer in self.peers.keys():
-            remove = True
-            for k, v in self.peers[peer].items():
-                if v > 0:
-                    remove = False
-                    self.peers[peer][k] = v - 1
-            if remove:
-                del self.peers[peer]
+        self.clock.callLater(ban_time, self.multiplexer.remove_ip_ban, peer[0])
+
+    def _forget_idle(self, now):
+        """Drop peers we haven't heard from in an hour and who have never been banned."""
+        self.last_forget = now
+        for ip, p in self.peers.items():
+            if p.bans == 0 and now - p.last_seen > 3600:
+                del self.peers[ip]
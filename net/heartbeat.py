@@ -28,6 +28,7 @@ class HeartbeatFactory(Factory):
             only_ip = ["127.0.0.1"]
         self.only_ip = only_ip
         self.status = "starting up"
+        self.progress = None
         self.protocol = HeartbeatProtocol
         self.libbitcoin = None
         self.clients = []
@@ -43,6 +44,11 @@ class HeartbeatFactory(Factory):
     def set_status(self, status):
         self.status = status
 
+    def set_progress(self, progress):
+        """Set the percent complete of the current status (ex. generating GUID) or `None`."""
+        self.progress = progress
+        self._heartbeat()
+
     def register(self, client):
         if client not in self.clients:
             self.clients.append(client)
@@ -61,7 +67,10 @@ class HeartbeatFactory(Factory):
             libbitcoin_status = "online" if self.libbitcoin.connected else "offline"
         else:
             libbitcoin_status = "NA"
-        self.push(json.dumps({
+        heartbeat = {
             "status": self.status,
             "libbitcoin": libbitcoin_status
-        }))
+        }
+        if self.progress is not None:
+            heartbeat["progress"] = self.progress
+        self.push(json.dumps(heartbeat))
@@ -0,0 +1,142 @@
+__author__ = 'chris'
+
+from log import Logger
+from twisted.internet import reactor
+
+
+class HolePunchCoordinator(object):
+    """
+    Coordinates NAT hole punching for the multiplexer.
+
+    When asked to punch through our NAT for a peer (`punch`), the empty datagrams are
+    sent in a paced burst scheduled on the reactor rather than in a tight loop, and a
+    target that is already being punched isn't punched again.
+
+    When we want to reach a restricted peer (`request`), only one HOLE_PUNCH request
+    per target is in flight at a time, and targets we connected to recently are
+    assumed to still have an open NAT mapping and aren't asked to punch again.
+    Requests which lead to a connection are counted as successes, along with the time
+    it took to connect.
+    """
+
+    def __init__(self, multiplexer, burst=20, interval=0.05, timeout=30, cache_ttl=60, clock=reactor):
+        """
+        Args:
+            multiplexer: the `OpenBazaarProtocol` used to send datagrams.
+            burst: the number of datagrams to send to punch through our NAT.
+            interval: seconds between each datagram in the burst.
+            timeout: seconds to wait for a connection after requesting a hole punch.
+            cache_ttl: seconds after a connection to a peer during which we assume its
+                NAT mapping is still open.
+            clock: an `IReactorTime` provider.
+        """
+        self.multiplexer = multiplexer
+        self.burst = burst
+        self.interval = interval
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.clock = clock
+        self.punching = {}
+        self.pending = {}
+        self.connected_at = {}
+        self.bursts = 0
+        self.attempts = 0
+        self.successes = 0
+        self.failures = 0
+        self.deduplicated = 0
+        self.connect_time = 0.0
+        self.log = Logger(system=self)
+
+    def punch(self, address):
+        """
+        Send a burst of empty datagrams to the (ip, port) so our NAT lets its packets in.
+        Returns False if a burst to this address is already under way.
+        """
+        if address in self.punching:
+            self.deduplicated += 1
+            return False
+        self.bursts += 1
+        self.punching[address] = self.burst
+        self._send(address)
+        return True
+
+    def _send(self, address):
+        try:
+            self.multiplexer.send_datagram("", address)
+        except Exception:
+            self.log.warning("unable to send hole punch datagram to %s:%s" % address)
+            del self.punching[address]
+            return
+        remaining = self.punching[address] - 1
+        if remaining > 0:
+            self.punching[address] = remaining
+            self.clock.callLater(self.interval, self._send, address)
+        else:
+            del self.punching[address]
+
+    def request(self, address):
+        """
+        Called before asking a peer's relay to have the peer punch through its NAT for
+        us. Returns True if the request should be sent: no request for this address is
+        in flight and we haven't recently been connected to it.
+        """
+        now = self.clock.seconds()
+        connected = self.connected_at.get(address)
+        if connected is not None:
+            if now - connected < self.cache_ttl:
+                self.deduplicated += 1
+                return False
+            del self.connected_at[address]
+        started = self.pending.get(address)
+        if started is not None:
+            if now - started < self.timeout:
+                self.deduplicated += 1
+                return False
+            self.failures += 1
+        self.attempts += 1
+        self.pending[address] = now
+        if len(self.pending) > 1000:
+            self._expire(now)
+        return True
+
+    def _expire(self, now):
+        """Count requests which timed out without a connection as failures."""
+        for address, started in self.pending.items():
+            if now - started >= self.timeout:
+                del self.pending[address]
+                self.failures += 1
+
+    def connected(self, address):
+        """Called when a connection to the (ip, port) is established."""
+        now = self.clock.seconds()
+        self.connected_at[address] = now
+        started = self.pending.pop(address, None)
+        if started is not None:
+            if now - started < self.timeout:
+                self.successes += 1
+                self.connect_time += now - started
+            else:
+                self.failures += 1
+        if len(self.connected_at) > 1000:
+            for addr, t in self.connected_at.items():
+                if now - t >= self.cache_ttl:
+                    del self.connected_at[addr]
+
+    def get_stats(self):
+        """
+        Returns a `dict` with the number of hole punch requests, how many led to a
+        connection, the success rate and mean time to connect of the finished
+        requests, the number of bursts we've sent, and the number of duplicate punches
+        and requests skipped.
+        """
+        self._expire(self.clock.seconds())
+        finished = self.successes + self.failures
+        return {
+            "attempts": self.attempts,
+            "successes": self.successes,
+            "failures": self.failures,
+            "success_rate": float(self.successes) / finished if finished else None,
+            "mean_time_to_connect": self.connect_time / self.successes if self.successes else None,
+            "bursts": self.bursts,
+            "deduplicated": self.deduplicated
+        }
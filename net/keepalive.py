@@ -0,0 +1,151 @@
+__author__ = 'chris'
+
+import math
+import random
+from log import Logger
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+from txrudp.connection import State
+
+IDLE_TIMEOUT = 300
+
+PINGED = "pinged"
+CLOSED = "closed"
+KEPT = "kept"
+
+
+class KeepAliveScheduler(object):
+    """
+    Tracks the keep-alive deadline of each connection in a hashed timer wheel so
+    that every tick only touches the connections which are actually due, rather
+    than iterating over every connection in the multiplexer.
+
+    Ping deadlines are jittered so connections opened at the same time don't PING
+    in lock step. The idle timeout isn't jittered: a connection that is idle and not
+    in the routing table is checked, and closed, at the moment it expires.
+
+    A `handler` is a `ConnHandler`. Its `keep_alive()` must return one of `PINGED`,
+    `CLOSED` or `KEPT` and it must have `time_last_message` and `ping_interval`
+    attributes.
+    """
+
+    def __init__(self, idle_timeout=IDLE_TIMEOUT, jitter=0.1, resolution=1, slots=512, clock=reactor):
+        """
+        Args:
+            idle_timeout: seconds without a message after which a connection to a node which
+                isn't in the routing table is closed.
+            jitter: the maximum random delay added to ping deadlines as a fraction of the
+                ping interval.
+            resolution: seconds per tick of the wheel.
+            slots: the number of slots in the wheel. Deadlines further out than
+                `slots * resolution` wrap around and are skipped until their tick comes.
+            clock: an `IReactorTime` provider.
+        """
+        self.idle_timeout = idle_timeout
+        self.jitter = jitter
+        self.resolution = resolution
+        self.clock = clock
+        self.wheel = [[] for _ in range(slots)]
+        self.deadlines = {}
+        self.current_tick = self._tick_for(clock.seconds())
+        self.pinged = 0
+        self.closed = 0
+        self.kept = 0
+        self.log = Logger(system=self)
+        self.loop = LoopingCall(self.tick)
+        self.loop.clock = clock
+
+    def start(self):
+        self.loop.start(self.resolution, now=False)
+
+    def stop(self):
+        if self.loop.running:
+            self.loop.stop()
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def __contains__(self, handler):
+        return handler in self.deadlines
+
+    def _tick_for(self, t):
+        return int(math.ceil(t / self.resolution))
+
+    def _jittered(self, interval):
+        return interval * (1 + random.uniform(0, self.jitter))
+
+    def schedule(self, handler, deadline):
+        """Check the handler again at `deadline`, replacing any previous deadline."""
+        self.deadlines[handler] = deadline
+        tick = max(self._tick_for(deadline), self.current_tick + 1)
+        self.wheel[tick % len(self.wheel)].append((tick, deadline, handler))
+
+    def add(self, handler):
+        """Start tracking a newly connected handler."""
+        self.schedule(handler, self.clock.seconds() + self._jittered(handler.ping_interval))
+
+    def remove(self, handler):
+        """Stop tracking a handler. Its entry in the wheel is dropped when its slot comes up."""
+        self.deadlines.pop(handler, None)
+
+    def next_deadline(self, handler, action, now):
+        """
+        The next time this handler needs to be checked. That's when it's due for a
+        PING, or when it hits the idle timeout if that comes first.
+        """
+        if action == PINGED or handler.time_last_message == 0:
+            deadline = now + self._jittered(handler.ping_interval)
+        else:
+            deadline = handler.time_last_message + self._jittered(handler.ping_interval)
+        expires = handler.time_last_message + self.idle_timeout
+        if now < expires < deadline:
+            deadline = expires
+        return deadline
+
+    def tick(self):
+        """
+        Process every slot between the last tick and now. Returns a `tuple` of the
+        number of connections (pinged, closed, kept) during this tick.
+        """
+        now = self.clock.seconds()
+        now_tick = self._tick_for(now)
+        pinged = closed = kept = 0
+        while self.current_tick < now_tick:
+            self.current_tick += 1
+            slot_index = self.current_tick % len(self.wheel)
+            slot = self.wheel[slot_index]
+            if not slot:
+                continue
+            self.wheel[slot_index] = [e for e in slot if e[0] > self.current_tick]
+            for tick, deadline, handler in slot:
+                if tick > self.current_tick or self.deadlines.get(handler) != deadline:
+                    continue
+                if handler.connection is None or handler.connection.state != State.CONNECTED:
+                    self.remove(handler)
+                    continue
+                action = handler.keep_alive()
+                if action == CLOSED:
+                    self.remove(handler)
+                    closed += 1
+                    continue
+                if action == PINGED:
+                    pinged += 1
+                else:
+                    kept += 1
+                self.schedule(handler, self.next_deadline(handler, action, now))
+        self.pinged += pinged
+        self.closed += closed
+        self.kept += kept
+        if pinged or closed:
+            self.log.debug("keep alive: pinged %s, closed %s, kept %s of %s connections" %
+                           (pinged, closed, kept, len(self.deadlines)))
+        return pinged, closed, kept
+
+    def get_stats(self):
+        """Returns the running totals of connections pinged, closed and kept and the number tracked."""
+        return {
+            "connections": len(self.deadlines),
+            PINGED: self.pinged,
+            CLOSED: self.closed,
+            KEPT: self.kept
+        }
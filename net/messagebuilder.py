@@ -0,0 +1,118 @@
+__author__ = 'chris'
+
+from config import PROTOCOL_VERSION
+from protos.message import Message
+from protos.wire import varint, tag, read_varint, VARINT, LENGTH_DELIMITED
+
+_MESSAGE_ID = tag(Message.DESCRIPTOR.fields_by_name["messageID"].number, LENGTH_DELIMITED)
+_SENDER = tag(Message.DESCRIPTOR.fields_by_name["sender"].number, LENGTH_DELIMITED)
+_COMMAND = tag(Message.DESCRIPTOR.fields_by_name["command"].number, VARINT)
+_PROTO_VER = tag(Message.DESCRIPTOR.fields_by_name["protoVer"].number, VARINT)
+_ARGUMENT = tag(Message.DESCRIPTOR.fields_by_name["arguments"].number, LENGTH_DELIMITED)
+_TESTNET = tag(Message.DESCRIPTOR.fields_by_name["testnet"].number, VARINT) + varint(1)
+_SIGNATURE = tag(Message.DESCRIPTOR.fields_by_name["signature"].number, LENGTH_DELIMITED) + varint(64)
+
+
+def sender_field(datagram):
+    """
+    Returns the serialized sender `Node` from a raw `Message` without parsing the
+    rest of it, or `None` if the sender isn't the first field after the message ID
+    (where every protobuf implementation puts it).
+    """
+    try:
+        pos = 0
+        if datagram.startswith(_MESSAGE_ID):
+            length, pos = read_varint(datagram, len(_MESSAGE_ID))
+            pos += length
+        if not datagram.startswith(_SENDER, pos):
+            return None
+        length, pos = read_varint(datagram, pos + len(_SENDER))
+        if pos + length > len(datagram):
+            return None
+        return datagram[pos:pos + length]
+    except IndexError:
+        return None
+
+
+class MessageBuilder(object):
+    """
+    Serializes and signs outgoing `Message` protobufs without building a `Message`
+    object. Protobuf fields are written in field number order, so a message can be
+    assembled by concatenating the encoded fields. The sender and protocol version
+    never change between messages so they are encoded once and reused. Each argument
+    is only copied once (when the signed body is joined) no matter how large it is.
+
+    The output is byte-for-byte identical to populating a `Message`, signing
+    `SerializeToString()` and serializing again.
+    """
+
+    def __init__(self, source_node, protocol_version=PROTOCOL_VERSION):
+        """
+        Args:
+            source_node: the `dht.node.Node` for this node. Its relay address and vendor
+                flag may change at runtime; the cached sender is rebuilt when they do.
+            protocol_version: the `protoVer` to put in each message.
+        """
+        self.source_node = source_node
+        self.protocol_version = protocol_version
+        self._sender_key = None
+        self._sender = None
+        self._prefix = None
+        self._commands = {}
+
+    def _node_key(self):
+        n = self.source_node
+        return n.id, n.ip, n.port, n.pubkey, n.relay_node, n.nat_type, n.vendor
+
+    def sender_proto(self):
+        """
+        Returns the serialized `Node` protobuf for this node. Cached until one of
+        the node's fields changes.
+        """
+        key = self._node_key()
+        if key != self._sender_key:
+            self._sender = self.source_node.getProto().SerializeToString()
+            self._prefix = _SENDER + varint(len(self._sender)) + self._sender
+            self._sender_key = key
+        return self._sender
+
+    def _command_field(self, command):
+        """Encoded command and protocol version fields. Zero values are omitted, as in proto3."""
+        try:
+            return self._commands[command]
+        except KeyError:
+            field = ""
+            if command != 0:
+                field += _COMMAND + varint(command)
+            if self.protocol_version != 0:
+                field += _PROTO_VER + varint(self.protocol_version)
+            self._commands[command] = field
+            return field
+
+    def build(self, signing_key, message_id, command, arguments=(), testnet=False):
+        """
+        Returns the serialized, signed message ready to go on the wire.
+
+        Args:
+            signing_key: a `nacl.signing.SigningKey` used to sign the message.
+            message_id: the raw message ID bytes.
+            command: a `protos.message.Command` value.
+            arguments: an iterable of arguments. Anything that isn't a `str` is
+                converted with `str()`.
+            testnet: whether the message is for the test network.
+        """
+        parts = []
+        if message_id:
+            parts.extend((_MESSAGE_ID, varint(len(message_id)), message_id))
+        self.sender_proto()
+        parts.append(self._prefix)
+        parts.append(self._command_field(command))
+        for arg in arguments:
+            if not isinstance(arg, str):
+                arg = str(arg)
+            parts.append(_ARGUMENT + varint(len(arg)))
+            parts.append(arg)
+        if testnet:
+            parts.append(_TESTNET)
+        body = "".join(parts)
+        return "".join((body, _SIGNATURE, signing_key.sign(body)[:64]))
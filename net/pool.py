@@ -0,0 +1,121 @@
+__author__ = 'chris'
+
+from collections import OrderedDict, deque
+from log import Logger
+from twisted.internet import reactor
+from txrudp.constants import UDP_SAFE_SEGMENT_SIZE
+
+# Rough size of a connection with nothing queued: the Connection, its handler,
+# crypto box, LoopingCalls and the ack timer.
+CONNECTION_OVERHEAD = 8 * 1024
+
+
+def queued_packets(connection):
+    """The number of packets a txrudp connection is holding in its send and receive buffers."""
+    count = 0
+    for attr in ("_segment_queue", "_sending_window", "_receive_heap"):
+        try:
+            count += len(getattr(connection, attr))
+        except (AttributeError, TypeError):
+            pass
+    return count
+
+
+class ConnectionPool(object):
+    """
+    Bounds the number of open rudp connections. Connections are kept in least
+    recently used order and, when the pool is full, the least recently used idle
+    connection which isn't protected (ex. routing table members or our relay node)
+    is shut down to make room.
+    """
+
+    def __init__(self, max_connections, min_idle=30, clock=reactor):
+        """
+        Args:
+            max_connections: the number of connections to allow before evicting.
+            min_idle: seconds without traffic before a connection may be evicted.
+            clock: an `IReactorTime` provider.
+        """
+        self.max_connections = max_connections
+        self.min_idle = min_idle
+        self.clock = clock
+        self.lru = OrderedDict()
+        self.evictions = deque()
+        self.evicted = 0
+        self.refused = 0
+        self.log = Logger(system=self)
+
+    def touch(self, address):
+        """Mark the connection to this address as the most recently used."""
+        self.lru.pop(address, None)
+        self.lru[address] = self.clock.seconds()
+
+    def remove(self, address):
+        self.lru.pop(address, None)
+
+    def is_full(self, multiplexer):
+        return len(multiplexer) >= self.max_connections
+
+    def evict(self, multiplexer, is_protected):
+        """
+        Shut down the least recently used idle connection.
+
+        Args:
+            multiplexer: the `ConnectionMultiplexer` holding the connections.
+            is_protected: a function taking the (address, connection) and returning True
+                if the connection must not be evicted.
+
+        Returns:
+            True if a connection was evicted.
+        """
+        now = self.clock.seconds()
+        stale = []
+        victim = address = None
+        for address, last_used in self.lru.iteritems():
+            if now - last_used < self.min_idle:
+                break
+            connection = multiplexer.get(address)
+            if connection is None:
+                stale.append(address)
+            elif not queued_packets(connection) and not is_protected(address, connection):
+                victim = connection
+                break
+        for stale_address in stale:
+            del self.lru[stale_address]
+        if victim is None:
+            return False
+
+        self.log.debug("connection pool full, evicting %s:%s" % address)
+        self.remove(address)
+        victim.shutdown()
+        self.evicted += 1
+        self.evictions.append(now)
+        self._prune_evictions(now)
+        return True
+
+    def _prune_evictions(self, now):
+        # only the last minute of evictions is kept
+        while self.evictions and now - self.evictions[0] > 60:
+            self.evictions.popleft()
+
+    def refuse(self):
+        self.refused += 1
+
+    def get_stats(self, multiplexer):
+        """
+        Returns a `dict` with the number of connections, an estimate of the memory they're
+        using in bytes, the total number of connections evicted and refused and the number
+        evicted in the last minute.
+        """
+        self._prune_evictions(self.clock.seconds())
+        memory = 0
+        for connection in multiplexer.values():
+            memory += CONNECTION_OVERHEAD + queued_packets(connection) * UDP_SAFE_SEGMENT_SIZE
+        return {
+            "connections": len(multiplexer),
+            "max_connections": self.max_connections,
+            "memory_estimate": memory,
+            "evicted": self.evicted,
+            "evictions_per_minute": len(self.evictions),
+            "refused": self.refused
+        }
@@ -0,0 +1,175 @@
+__author__ = 'chris'
+
+from dht.node import Node
+from dht.utils import digest
+from log import Logger
+from protos.objects import FULL_CONE
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+
+# Assumed round trip time for candidates we haven't measured yet.
+DEFAULT_RTT = 1.0
+
+
+class RelayCandidate(object):
+    __slots__ = ["address", "rtt", "successes", "failures"]
+
+    def __init__(self, address):
+        self.address = address
+        self.rtt = None
+        self.successes = 0
+        self.failures = 0
+
+    @property
+    def reliability(self):
+        """The fraction of probes answered, smoothed so one result doesn't dominate."""
+        return (self.successes + 1.0) / (self.successes + self.failures + 2.0)
+
+    @property
+    def score(self):
+        """The expected latency of a round trip through this relay. Lower is better."""
+        return (self.rtt if self.rtt is not None else DEFAULT_RTT) / self.reliability
+
+    def __repr__(self):
+        return "%s:%s (rtt %s, %s/%s)" % (self.address[0], self.address[1], self.rtt,
+                                          self.successes, self.successes + self.failures)
+
+
+class RelayManager(object):
+    """
+    Keeps track of the FULL_CONE nodes we could use as a relay, with their measured
+    round trip time and reliability, so NATed nodes relay through the fastest one
+    instead of a random one. The runner-up is kept as a warm standby so we can fail
+    over immediately when the relay goes away.
+
+    Optionally probes the candidates in the background to keep the measurements
+    current and the connection to the standby open.
+    """
+
+    def __init__(self, alpha=0.3, max_candidates=32, clock=reactor):
+        """
+        Args:
+            alpha: the weight of a new RTT sample in the moving average.
+            max_candidates: the number of candidates to keep. The worst are dropped first.
+            clock: an `IReactorTime` provider.
+        """
+        self.alpha = alpha
+        self.max_candidates = max_candidates
+        self.clock = clock
+        self.candidates = {}
+        self.relay = None
+        self.standby = None
+        self.probe_loop = None
+        self.log = Logger(system=self)
+
+    def add_candidate(self, address, rtt=None):
+        """Add a FULL_CONE node's (ip, port) and, if it was just pinged, the round trip time."""
+        address = tuple(address)
+        if address not in self.candidates:
+            if len(self.candidates) >= self.max_candidates:
+                worst = max(self.candidates.values(), key=lambda c: c.score)
+                if worst.address in (self.relay, self.standby):
+                    return
+                del self.candidates[worst.address]
+            self.candidates[address] = RelayCandidate(address)
+        if rtt is not None:
+            self.record_success(address, rtt)
+
+    def record_success(self, address, rtt):
+        c = self.candidates.get(tuple(address))
+        if c is None:
+            return
+        c.successes += 1
+        c.rtt = rtt if c.rtt is None else (1 - self.alpha) * c.rtt + self.alpha * rtt
+
+    def record_failure(self, address):
+        c = self.candidates.get(tuple(address))
+        if c is not None:
+            c.failures += 1
+
+    def ranked(self, exclude=()):
+        return sorted((c for c in self.candidates.values() if c.address not in exclude),
+                      key=lambda c: c.score)
+
+    def select(self):
+        """
+        Pick the best candidate as the relay and the next best as the standby.
+        Returns the relay's (ip, port) or `None` if there are no candidates.
+        """
+        ranked = self.ranked()
+        self.relay = ranked[0].address if ranked else None
+        self.standby = ranked[1].address if len(ranked) > 1 else None
+        return self.relay
+
+    def failover(self, failed=None):
+        """
+        Called when the relay stops responding. Promotes the standby and picks a new one.
+
+        Args:
+            failed: the (ip, port) of the relay that failed, if not the one we selected.
+
+        Returns:
+            The new relay's (ip, port) or `None` if there are no other candidates.
+        """
+        if failed is None:
+            failed = self.relay
+        if failed is not None:
+            self.record_failure(failed)
+        if self.standby is not None and self.standby != failed and self.standby in self.candidates:
+            self.relay = self.standby
+        else:
+            ranked = self.ranked(exclude=(failed,))
+            self.relay = ranked[0].address if ranked else None
+        ranked = self.ranked(exclude=(failed, self.relay))
+        self.standby = ranked[0].address if ranked else None
+        self.log.info("relay node %s failed, switching to %s" % (failed, self.relay))
+        return self.relay
+
+    def probe(self, protocol, address):
+        """
+        PING a candidate and record the result.
+
+        Args:
+            protocol: the `KademliaProtocol` to send the PING with. We don't use `callPing` as
+                we don't know the candidate's GUID and don't want it added to the routing table.
+            address: the candidate's (ip, port).
+        """
+        start = self.clock.seconds()
+
+        def handle(result):
+            if result[0]:
+                self.record_success(address, self.clock.seconds() - start)
+            else:
+                self.record_failure(address)
+            return result
+
+        return protocol.ping(Node(digest("null"), address[0], address[1], nat_type=FULL_CONE)).addCallback(handle)
+
+    def probe_all(self, protocol):
+        """Probe the relay, the standby and the candidate we know least about."""
+        targets = [a for a in (self.relay, self.standby) if a is not None]
+        others = sorted((c for c in self.candidates.values() if c.address not in targets),
+                        key=lambda c: c.successes + c.failures)
+        if others:
+            targets.append(others[0].address)
+        for address in targets:
+            self.probe(protocol, address)
+
+    def start_probing(self, protocol, interval=60):
+        """Probe candidates every `interval` seconds."""
+        self.stop_probing()
+        self.probe_loop = LoopingCall(self.probe_all, protocol)
+        self.probe_loop.clock = self.clock
+        self.probe_loop.start(interval, now=False)
+
+    def stop_probing(self):
+        if self.probe_loop is not None and self.probe_loop.running:
+            self.probe_loop.stop()
+        self.probe_loop = None
+
+    def get_stats(self):
+        return {
+            "relay": self.relay,
+            "standby": self.standby,
+            "candidates": [repr(c) for c in self.ranked()]
+        }
@@ -6,12 +6,12 @@ Copyright (c) 2015 OpenBazaar
 import abc
 import random
 from base64 import b64encode
-from config import PROTOCOL_VERSION
 from dht.node import Node
 from dht.utils import digest
 from hashlib import sha1
 from log import Logger
-from protos.message import Message, Command, NOT_FOUND, HOLE_PUNCH
+from net.messagebuilder import MessageBuilder
+from protos.message import Command, NOT_FOUND, HOLE_PUNCH, CALM_DOWN
 from protos.objects import FULL_CONE, RESTRICTED, SYMMETRIC
 from twisted.internet import defer, reactor
 from txrudp.connection import State
@@ -41,9 +41,10 @@ class RPCProtocol:
         self.router = router
         self._waitTimeout = waitTimeout
         self._outstanding = {}
+        self._builder = MessageBuilder(sourceNode)
         self.log = Logger(system=self)
 
-    def receive_message(self, message, sender, connection, ban_score):
+    def receive_message(self, message, sender, connection, ban_score, handler=None):
         if message.testnet != self.multiplexer.testnet:
             self.log.warning("received message from %s with incorrect network parameters." %
                              str(connection.dest_addr))
@@ -54,19 +55,29 @@ class RPCProtocol:
             self.multiplexer.vendors[sender.id] = sender
 
         msgID = message.messageID
-        if message.command == NOT_FOUND:
+        if message.command in (NOT_FOUND, CALM_DOWN):
             data = None
         else:
             data = tuple(message.arguments)
         if msgID in self._outstanding:
-            self._acceptResponse(msgID, data, sender)
-        elif message.command != NOT_FOUND:
-            ban_score.process_message(connection.dest_addr, message)
-            self._acceptRequest(msgID, str(Command.Name(message.command)).lower(), data, sender, connection)
-
-
-    def _acceptResponse(self, msgID, data, sender):
-        if data is not None:
+            self._acceptResponse(msgID, data, sender, message.command)
+        elif message.command not in (NOT_FOUND, CALM_DOWN):
+            if not ban_score.process_message(connection.dest_addr, message):
+                # Answer rather than drop it, a request that times out gets us removed from the peer's routing table
+                self.log.debug("refusing %s request from %s, rate limit exceeded" %
+                               (Command.Name(message.command), sender))
+                if connection.state != State.SHUTDOWN:
+                    connection.send_message(self._builder.build(self.signing_key, msgID, CALM_DOWN, (),
+                                                                self.multiplexer.testnet))
+                return False
+            self._acceptRequest(msgID, str(Command.Name(message.command)).lower(), data, sender, connection,
+                                handler)
+
+
+    def _acceptResponse(self, msgID, data, sender, command=None):
+        if command == CALM_DOWN:
+            self.log.warning("%s is rate limiting our requests" % sender)
+        elif data is not None:
             msgargs = (b64encode(msgID), sender)
             self.log.debug("received response for message id %s from %s" % msgargs)
         else:
@@ -77,9 +88,9 @@ class RPCProtocol:
         d.callback((True, data))
         del self._outstanding[msgID]
 
-    def _acceptRequest(self, msgID, funcname, args, sender, connection):
+    def _acceptRequest(self, msgID, funcname, args, sender, connection, handler=None):
         self.log.debug("received request from %s, command %s" % (sender, funcname.upper()))
-        f = getattr(self, "rpc_%s" % funcname, None)
+        f = handler if handler is not None else getattr(self, "rpc_%s" % funcname, None)
         if f is None or not callable(f):
             msgargs = (self.__class__.__name__, funcname)
             self.log.error("%s has no callable method rpc_%s; ignoring request" % msgargs)
@@ -93,21 +104,15 @@ class RPCProtocol:
 
     def _sendResponse(self, response, funcname, msgID, sender, connection):
         self.log.debug("sending response for msg id %s to %s" % (b64encode(msgID), sender))
-        m = Message()
-        m.messageID = msgID
-        m.sender.MergeFrom(self.sourceNode.getProto())
-        m.protoVer = PROTOCOL_VERSION
-        m.testnet = self.multiplexer.testnet
         if response is None:
-            m.command = NOT_FOUND
+            command = NOT_FOUND
+            response = []
         else:
-            m.command = Command.Value(funcname.upper())
+            command = Command.Value(funcname.upper())
             if not isinstance(response, list):
                 response = [response]
-            for arg in response:
-                m.arguments.append(str(arg))
-        m.signature = self.signing_key.sign(m.SerializeToString())[:64]
-        connection.send_message(m.SerializeToString())
+        connection.send_message(self._builder.build(self.signing_key, msgID, command,
+                                                    response, self.multiplexer.testnet))
 
     def timeout(self, node):
         """
@@ -140,9 +145,7 @@ class RPCProtocol:
             self.hole_punch(Node(digest("null"), ip, int(port), nat_type=FULL_CONE), sender.ip, sender.port)
         else:
             self.log.debug("punching through NAT for %s:%s" % (ip, port))
-            # pylint: disable=W0612
-            for i in range(20):
-                self.multiplexer.send_datagram("", (ip, int(port)))
+            self.multiplexer.hole_puncher.punch((ip, int(port)))
 
     def __getattr__(self, name):
         if name.startswith("_") or name.startswith("rpc_"):
@@ -157,16 +160,8 @@ class RPCProtocol:
             address = (node.ip, node.port)
 
             msgID = sha1(str(random.getrandbits(255))).digest()
-            m = Message()
-            m.messageID = msgID
-            m.sender.MergeFrom(self.sourceNode.getProto())
-            m.command = Command.Value(name.upper())
-            m.protoVer = PROTOCOL_VERSION
-            for arg in args:
-                m.arguments.append(str(arg))
-            m.testnet = self.multiplexer.testnet
-            m.signature = self.signing_key.sign(m.SerializeToString())[:64]
-            data = m.SerializeToString()
+            command = Command.Value(name.upper())
+            data = self._builder.build(self.signing_key, msgID, command, args, self.multiplexer.testnet)
 
             relay_addr = None
             if node.nat_type == SYMMETRIC or \
@@ -174,7 +169,7 @@ class RPCProtocol:
                 relay_addr = node.relay_node
 
             d = defer.Deferred()
-            if m.command != HOLE_PUNCH:
+            if command != HOLE_PUNCH:
                 timeout = reactor.callLater(self._waitTimeout, self.timeout, node)
                 self._outstanding[msgID] = [d, address, timeout]
                 self.log.debug("calling remote function %s on %s (msgid %s)" % (name, address, b64encode(msgID)))
@@ -184,7 +179,8 @@ class RPCProtocol:
             if self.multiplexer[address].state != State.CONNECTED and \
                             node.nat_type == RESTRICTED and \
                             self.sourceNode.nat_type != SYMMETRIC and \
-                            node.relay_node is not None:
+                            node.relay_node is not None and \
+                            self.multiplexer.hole_puncher.request(address):
                 self.hole_punch(Node(digest("null"), node.relay_node[0], node.relay_node[1], nat_type=FULL_CONE),
                                 address[0], address[1], "True")
                 self.log.debug("sending hole punch message to %s" % address[0] + ":" + str(address[1]))
@@ -0,0 +1,66 @@
+__author__ = 'chris'
+import unittest
+
+from net.dispatch import CommandDispatcher
+from protos.message import Message, PING, STORE, GET_IMAGE, NOT_FOUND, CALM_DOWN
+
+
+class FakeProcessor(object):
+    def __init__(self, commands):
+        self.commands = commands
+        self.received = []
+
+    def receive_message(self, message, sender, connection, ban_score, handler=None):
+        self.received.append((message.command, handler))
+
+    def rpc_ping(self, sender):
+        pass
+
+    def __iter__(self):
+        return iter(self.commands)
+
+
+def _message(command):
+    m = Message()
+    m.command = command
+    return m
+
+
+class CommandDispatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.dht = FakeProcessor([PING, STORE])
+        self.market = FakeProcessor([GET_IMAGE])
+        self.dispatcher = CommandDispatcher()
+        self.dispatcher.register(self.dht)
+        self.dispatcher.register(self.market)
+
+    def test_routes_to_owning_processor(self):
+        self.assertTrue(self.dispatcher.dispatch(_message(PING), None, None, None))
+        self.assertTrue(self.dispatcher.dispatch(_message(GET_IMAGE), None, None, None))
+        self.assertEqual(self.dht.received, [(PING, self.dht.rpc_ping)])
+        self.assertEqual(self.market.received, [(GET_IMAGE, None)])
+
+    def test_not_found_goes_to_all(self):
+        self.dispatcher.dispatch(_message(NOT_FOUND), None, None, None)
+        self.assertEqual(self.dht.received, [(NOT_FOUND, None)])
+        self.assertEqual(self.market.received, [(NOT_FOUND, None)])
+
+    def test_calm_down_goes_to_all(self):
+        self.dispatcher.dispatch(_message(CALM_DOWN), None, None, None)
+        self.assertEqual(self.dht.received, [(CALM_DOWN, None)])
+        self.assertEqual(self.market.received, [(CALM_DOWN, None)])
+
+    def test_unhandled_command(self):
+        self.dispatcher.unregister(self.market)
+        self.assertFalse(self.dispatcher.dispatch(_message(GET_IMAGE), None, None, None))
+        self.assertEqual(self.market.received, [])
+        self.assertEqual(self.dispatcher.processors, [self.dht])
+
+    def test_stats(self):
+        for _ in range(3):
+            self.dispatcher.dispatch(_message(PING), None, None, None)
+        self.dispatcher.dispatch(_message(STORE), None, None, None)
+        stats = self.dispatcher.get_stats()
+        self.assertEqual(stats["PING"]["received"], 3)
+        self.assertEqual(stats["STORE"]["received"], 1)
+        self.assertTrue(stats["PING"]["cpu_time"] >= 0)
@@ -0,0 +1,100 @@
+__author__ = 'chris'
+import unittest
+
+from twisted.internet import task
+
+from net.dos import BanScore, RateLimit, MAX_STRIKES, PEER_LIMIT, REPUBLISH_BURST
+from protos.message import Message, FOLLOW, GET_IMAGE, PING, STORE, DELETE, FIND_NODE
+
+
+class FakeMultiplexer(dict):
+    def __init__(self):
+        super(FakeMultiplexer, self).__init__()
+        self.banned = set()
+
+    def ban_ip(self, ip):
+        self.banned.add(ip)
+
+    def remove_ip_ban(self, ip):
+        self.banned.discard(ip)
+
+
+def _message(command):
+    m = Message()
+    m.command = command
+    return m
+
+
+class BanScoreTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.clock.advance(1000)
+        self.multiplexer = FakeMultiplexer()
+        self.ban_score = BanScore(self.multiplexer, ban_time=100, clock=self.clock,
+                                  limits={GET_IMAGE: RateLimit(5, 1, 1)})
+        self.peer = ("1.2.3.4", 1234)
+
+    def _send(self, command, count, peer=None):
+        return [self.ban_score.process_message(peer or self.peer, _message(command))
+                for _ in range(count)]
+
+    def test_burst_then_refill(self):
+        self.assertEqual(self._send(GET_IMAGE, 6), [True] * 5 + [False])
+        self.clock.advance(2)
+        self.assertEqual(self._send(GET_IMAGE, 3), [True, True, False])
+        # other commands and other peers have their own buckets
+        self.assertEqual(self._send(PING, 1), [True])
+        self.assertEqual(self._send(GET_IMAGE, 1, ("5.6.7.8", 1234)), [True])
+
+    def test_follow_spam_banned(self):
+        self.assertEqual(self._send(FOLLOW, 3), [True] * 3)
+        self.assertNotIn(self.peer[0], self.multiplexer.banned)
+        self.assertEqual(self._send(FOLLOW, 1), [False])
+        self.assertIn(self.peer[0], self.multiplexer.banned)
+        self.clock.advance(100)
+        self.assertNotIn(self.peer[0], self.multiplexer.banned)
+
+    def test_bans_escalate(self):
+        self._send(GET_IMAGE, 5 + MAX_STRIKES)
+        self.assertIn(self.peer[0], self.multiplexer.banned)
+        self.clock.advance(100)
+        self.assertNotIn(self.peer[0], self.multiplexer.banned)
+        self._send(GET_IMAGE, 5 + MAX_STRIKES)
+        self.assertIn(self.peer[0], self.multiplexer.banned)
+        self.clock.advance(100)
+        self.assertIn(self.peer[0], self.multiplexer.banned)
+        self.clock.advance(100)
+        self.assertNotIn(self.peer[0], self.multiplexer.banned)
+
+    def test_strikes_forgiven(self):
+        self._send(GET_IMAGE, 5 + MAX_STRIKES - 1)
+        self.clock.advance(60)
+        self._send(GET_IMAGE, 1)
+        self.assertNotIn(self.peer[0], self.multiplexer.banned)
+
+    def test_costs_draw_from_peer_budget(self):
+        ban_score = BanScore(self.multiplexer, clock=self.clock, costs={PING: PEER_LIMIT.capacity * 0.4})
+        results = [ban_score.process_message(self.peer, _message(PING)) for _ in range(3)]
+        self.assertEqual(results, [True, True, False])
+
+    def test_republish_burst_allowed(self):
+        # a vendor republishing (then deleting) all its keywords, spread over a few seconds
+        for command in (STORE, DELETE):
+            for i in range(REPUBLISH_BURST):
+                self.assertEqual(self._send(FIND_NODE, 1) + self._send(command, 1), [True, True])
+                if i % 100 == 0:
+                    self.clock.advance(1)
+            self.assertNotIn(self.peer[0], self.multiplexer.banned)
+            self.clock.advance(3600)
+
+    def test_refused_request_takes_no_tokens(self):
+        ban_score = BanScore(self.multiplexer, clock=self.clock, costs={PING: PEER_LIMIT.capacity * 0.4},
+                             limits={PING: RateLimit(3, 0, 1), GET_IMAGE: RateLimit(0, 0, 1)})
+        results = [ban_score.process_message(self.peer, _message(PING)) for _ in range(3)]
+        self.assertEqual(results, [True, True, False])
+        # the PING refused by the peer's budget didn't use up a PING token
+        peer = ban_score.peers[self.peer[0]]
+        self.assertEqual(peer.commands[PING].tokens, 1)
+        # and the GET_IMAGE refused by its own limit took nothing from the budget
+        self.assertFalse(ban_score.process_message(self.peer, _message(GET_IMAGE)))
+        self.assertAlmostEqual(peer.budget.tokens, PEER_LIMIT.capacity * 0.2)
@@ -0,0 +1,67 @@
+__author__ = 'chris'
+import unittest
+
+from twisted.internet import task
+
+from net.holepunch import HolePunchCoordinator
+
+
+class FakeMultiplexer(object):
+    def __init__(self):
+        self.sent = []
+
+    def send_datagram(self, datagram, address):
+        self.sent.append((datagram, address))
+
+
+class HolePunchCoordinatorTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.multiplexer = FakeMultiplexer()
+        self.puncher = HolePunchCoordinator(self.multiplexer, burst=20, interval=0.05, clock=self.clock)
+        self.addr = ("1.2.3.4", 1234)
+
+    def test_burst_is_paced(self):
+        self.assertTrue(self.puncher.punch(self.addr))
+        self.assertEqual(len(self.multiplexer.sent), 1)
+        self.clock.advance(0.05)
+        self.assertEqual(len(self.multiplexer.sent), 2)
+        self.clock.pump([0.05] * 30)
+        self.assertEqual(self.multiplexer.sent, [("", self.addr)] * 20)
+
+    def test_concurrent_punches_deduplicated(self):
+        self.assertTrue(self.puncher.punch(self.addr))
+        self.assertFalse(self.puncher.punch(self.addr))
+        self.clock.pump([0.05] * 30)
+        self.assertEqual(len(self.multiplexer.sent), 20)
+        self.assertTrue(self.puncher.punch(self.addr))
+
+    def test_request_deduplicated_until_timeout(self):
+        self.assertTrue(self.puncher.request(self.addr))
+        self.assertFalse(self.puncher.request(self.addr))
+        self.clock.advance(30)
+        self.assertTrue(self.puncher.request(self.addr))
+        stats = self.puncher.get_stats()
+        self.assertEqual(stats["attempts"], 2)
+        self.assertEqual(stats["failures"], 1)
+        self.assertEqual(stats["deduplicated"], 1)
+
+    def test_success_cached(self):
+        self.puncher.request(self.addr)
+        self.clock.advance(2)
+        self.puncher.connected(self.addr)
+        self.assertFalse(self.puncher.request(self.addr))
+        self.clock.advance(60)
+        self.assertTrue(self.puncher.request(self.addr))
+        stats = self.puncher.get_stats()
+        self.assertEqual(stats["successes"], 1)
+        self.assertEqual(stats["mean_time_to_connect"], 2)
+
+    def test_success_rate(self):
+        other = ("5.6.7.8", 1234)
+        self.puncher.request(self.addr)
+        self.puncher.request(other)
+        self.clock.advance(1)
+        self.puncher.connected(self.addr)
+        self.clock.advance(30)
+        self.assertEqual(self.puncher.get_stats()["success_rate"], 0.5)
@@ -0,0 +1,106 @@
+__author__ = 'chris'
+import unittest
+
+from twisted.internet import task
+from txrudp.connection import State
+
+from net.keepalive import KeepAliveScheduler, PINGED, CLOSED, KEPT
+
+
+class FakeConnection(object):
+    state = State.CONNECTED
+
+
+class FakeHandler(object):
+    """Pings when idle for `ping_interval` and closes when idle for 300 seconds unless `routing`."""
+
+    def __init__(self, clock, ping_interval=30, routing=False):
+        self.clock = clock
+        self.connection = FakeConnection()
+        self.ping_interval = ping_interval
+        self.routing = routing
+        self.time_last_message = clock.seconds()
+        self.pings = []
+
+    def keep_alive(self):
+        idle = self.clock.seconds() - self.time_last_message
+        if idle >= 300 and not self.routing:
+            self.connection.state = State.SHUTDOWN
+            return CLOSED
+        if idle >= self.ping_interval:
+            self.pings.append(self.clock.seconds())
+            return PINGED
+        return KEPT
+
+
+class KeepAliveSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.clock.advance(1000)
+        self.scheduler = KeepAliveScheduler(jitter=0.1, clock=self.clock)
+
+    def _run(self, seconds):
+        for _ in range(seconds):
+            self.clock.advance(1)
+            self.scheduler.tick()
+
+    def test_idle_connection_closed_when_it_expires(self):
+        handler = FakeHandler(self.clock)
+        self.scheduler.add(handler)
+        self._run(299)
+        self.assertIn(handler, self.scheduler)
+        self._run(1)
+        self.assertNotIn(handler, self.scheduler)
+        self.assertEqual(handler.connection.state, State.SHUTDOWN)
+        self.assertEqual(self.scheduler.get_stats()[CLOSED], 1)
+        # pinged about every 30-33 seconds until then
+        self.assertTrue(8 <= len(handler.pings) <= 9)
+
+    def test_routing_table_connection_kept(self):
+        handler = FakeHandler(self.clock, routing=True)
+        self.scheduler.add(handler)
+        self._run(1000)
+        self.assertIn(handler, self.scheduler)
+        self.assertEqual(self.scheduler.get_stats()[CLOSED], 0)
+        # one check lands on the idle timeout, otherwise pings are 30-33 seconds apart
+        intervals = [b - a for a, b in zip(handler.pings, handler.pings[1:])]
+        self.assertTrue(all(i <= 34 for i in intervals))
+        self.assertTrue(len([i for i in intervals if i < 30]) <= 1)
+
+    def test_active_connection_not_pinged(self):
+        handler = FakeHandler(self.clock)
+        self.scheduler.add(handler)
+        for _ in range(20):
+            self._run(20)
+            handler.time_last_message = self.clock.seconds()
+        self.assertEqual(handler.pings, [])
+        self.assertIn(handler, self.scheduler)
+        self.assertTrue(self.scheduler.get_stats()[KEPT] > 0)
+
+    def test_pings_are_spread(self):
+        handlers = [FakeHandler(self.clock) for _ in range(200)]
+        for handler in handlers:
+            self.scheduler.add(handler)
+        self._run(40)
+        first_pings = set(h.pings[0] for h in handlers)
+        self.assertTrue(len(first_pings) > 1)
+        self.assertEqual(self.scheduler.get_stats()[PINGED], 200)
+
+    def test_removed_and_disconnected_handlers_dropped(self):
+        removed = FakeHandler(self.clock)
+        disconnected = FakeHandler(self.clock)
+        self.scheduler.add(removed)
+        self.scheduler.add(disconnected)
+        self.scheduler.remove(removed)
+        disconnected.connection.state = State.SHUTDOWN
+        self._run(40)
+        self.assertEqual(removed.pings, [])
+        self.assertEqual(disconnected.pings, [])
+        self.assertEqual(len(self.scheduler), 0)
+
+    def test_catches_up_after_stall(self):
+        handler = FakeHandler(self.clock, routing=True)
+        self.scheduler.add(handler)
+        self.clock.advance(5000)
+        self.assertEqual(self.scheduler.tick(), (1, 0, 0))
+        self.assertIn(handler, self.scheduler)
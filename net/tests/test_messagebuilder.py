@@ -0,0 +1,73 @@
+__author__ = 'chris'
+import unittest
+from binascii import unhexlify
+
+import nacl.signing
+import nacl.encoding
+import nacl.hash
+
+from config import PROTOCOL_VERSION
+from dht.node import Node
+from dht.utils import digest
+from net.messagebuilder import MessageBuilder, sender_field
+from protos import objects
+from protos.message import Message, Command, PING, GET_IMAGE, NOT_FOUND
+
+
+class MessageBuilderTest(unittest.TestCase):
+    def setUp(self):
+        valid_key = "63d901c4d57cde34fc1f1e28b9af5d56ed342cae5c2fb470046d0130a4226b0c"
+        self.signing_key = nacl.signing.SigningKey(valid_key, encoder=nacl.encoding.HexEncoder)
+        verify_key = self.signing_key.verify_key
+        h = nacl.hash.sha512(verify_key.encode())
+        self.node = Node(unhexlify(h[:40]), "123.45.67.89", 12345,
+                         verify_key.encode(), None, objects.FULL_CONE, True)
+        self.builder = MessageBuilder(self.node)
+
+    def _expected(self, msg_id, command, arguments, testnet):
+        m = Message()
+        m.messageID = msg_id
+        m.sender.MergeFrom(self.node.getProto())
+        m.command = command
+        m.protoVer = PROTOCOL_VERSION
+        for arg in arguments:
+            m.arguments.append(str(arg))
+        m.testnet = testnet
+        m.signature = self.signing_key.sign(m.SerializeToString())[:64]
+        return m.SerializeToString()
+
+    def test_matches_protobuf_serialization(self):
+        cases = [
+            (digest("msgid"), GET_IMAGE, ["x" * 1000000], False),
+            (digest("msgid"), PING, [], True),
+            (digest("msgid"), NOT_FOUND, [], False),
+            (digest("msgid"), Command.Value("STORE"), [digest("Keyword"), "", 10, u"ttl"], True),
+        ]
+        for msg_id, command, arguments, testnet in cases:
+            self.assertEqual(self.builder.build(self.signing_key, msg_id, command, arguments, testnet),
+                             self._expected(msg_id, command, arguments, testnet))
+
+    def test_signature_covers_unsigned_message(self):
+        data = self.builder.build(self.signing_key, digest("msgid"), GET_IMAGE, ["image"])
+        m = Message()
+        m.ParseFromString(data)
+        signature = m.signature
+        m.ClearField("signature")
+        self.signing_key.verify_key.verify(m.SerializeToString(), signature)
+
+    def test_sender_rebuilt_when_node_changes(self):
+        self.assertEqual(self.builder.sender_proto(), self.node.getProto().SerializeToString())
+        self.node.relay_node = ("1.2.3.4", 5678)
+        self.node.vendor = False
+        self.assertEqual(self.builder.sender_proto(), self.node.getProto().SerializeToString())
+        self.assertEqual(self.builder.build(self.signing_key, digest("msgid"), GET_IMAGE, ["image"]),
+                         self._expected(digest("msgid"), GET_IMAGE, ["image"], False))
+
+    def test_sender_field(self):
+        sender = self.node.getProto().SerializeToString()
+        data = self.builder.build(self.signing_key, digest("msgid"), GET_IMAGE, ["image"])
+        self.assertEqual(sender_field(data), sender)
+        data = self.builder.build(self.signing_key, "", PING)
+        self.assertEqual(sender_field(data), sender)
+        self.assertIsNone(sender_field(data[:30]))
+        self.assertIsNone(sender_field("hihihihihihihihihihihihihihihihihihihihih"))
@@ -0,0 +1,86 @@
+__author__ = 'chris'
+import unittest
+from collections import deque
+
+from twisted.internet import task
+
+from net.pool import ConnectionPool, CONNECTION_OVERHEAD
+
+
+class FakeConnection(object):
+    def __init__(self, multiplexer, address):
+        self.multiplexer = multiplexer
+        self.address = address
+        self._segment_queue = deque()
+        self.closed = False
+
+    def shutdown(self):
+        self.closed = True
+        del self.multiplexer[self.address]
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.clock.advance(1000)
+        self.pool = ConnectionPool(3, min_idle=30, clock=self.clock)
+        self.multiplexer = {}
+        self.protected = set()
+
+    def _connect(self, address):
+        self.multiplexer[address] = FakeConnection(self.multiplexer, address)
+        self.pool.touch(address)
+
+    def _is_protected(self, address, connection):
+        return address in self.protected
+
+    def test_evicts_least_recently_used(self):
+        for port in (1, 2, 3):
+            self._connect(("1.2.3.4", port))
+            self.clock.advance(10)
+        self.clock.advance(60)
+        self.pool.touch(("1.2.3.4", 1))
+        self.assertTrue(self.pool.is_full(self.multiplexer))
+        self.assertTrue(self.pool.evict(self.multiplexer, self._is_protected))
+        self.assertNotIn(("1.2.3.4", 2), self.multiplexer)
+        self.assertEqual(len(self.multiplexer), 2)
+
+    def test_protected_and_busy_not_evicted(self):
+        for port in (1, 2, 3):
+            self._connect(("1.2.3.4", port))
+        self.clock.advance(60)
+        self.protected.add(("1.2.3.4", 1))
+        self.multiplexer[("1.2.3.4", 2)]._segment_queue.append("packet")
+        self.assertTrue(self.pool.evict(self.multiplexer, self._is_protected))
+        self.assertEqual(sorted(self.multiplexer.keys()), [("1.2.3.4", 1), ("1.2.3.4", 2)])
+        self.assertFalse(self.pool.evict(self.multiplexer, self._is_protected))
+
+    def test_recently_used_not_evicted(self):
+        for port in (1, 2, 3):
+            self._connect(("1.2.3.4", port))
+        self.clock.advance(29)
+        self.assertFalse(self.pool.evict(self.multiplexer, self._is_protected))
+        self.assertEqual(len(self.multiplexer), 3)
+
+    def test_stats(self):
+        for port in (1, 2, 3):
+            self._connect(("1.2.3.4", port))
+        self.multiplexer[("1.2.3.4", 3)]._segment_queue.append("packet")
+        self.clock.advance(60)
+        self.pool.evict(self.multiplexer, self._is_protected)
+        stats = self.pool.get_stats(self.multiplexer)
+        self.assertEqual(stats["connections"], 2)
+        self.assertEqual(stats["evicted"], 1)
+        self.assertEqual(stats["evictions_per_minute"], 1)
+        self.assertEqual(stats["memory_estimate"], 2 * CONNECTION_OVERHEAD + 1000)
+        self.clock.advance(61)
+        self.assertEqual(self.pool.get_stats(self.multiplexer)["evictions_per_minute"], 0)
+
+    def test_evictions_pruned_without_stats(self):
+        for port in (1, 2, 3):
+            self._connect(("1.2.3.4", port))
+        self.clock.advance(60)
+        self.pool.evict(self.multiplexer, self._is_protected)
+        self.clock.advance(61)
+        self.pool.evict(self.multiplexer, self._is_protected)
+        self.assertEqual(len(self.pool.evictions), 1)
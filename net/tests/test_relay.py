@@ -0,0 +1,177 @@
+__author__ = 'chris'
+import unittest
+
+from twisted.internet import defer, task
+
+from net.relay import RelayManager
+from net.wireprotocol import OpenBazaarProtocol
+from protos.message import PING
+
+
+class FakeProtocol(object):
+    def __init__(self):
+        self.pinged = []
+        self.responses = {}
+
+    def ping(self, node):
+        self.pinged.append((node.ip, node.port))
+        d = self.responses[(node.ip, node.port)] = defer.Deferred()
+        return d
+
+
+class RelayManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.manager = RelayManager(clock=self.clock)
+        self.a = ("1.1.1.1", 18467)
+        self.b = ("2.2.2.2", 18467)
+        self.c = ("3.3.3.3", 18467)
+
+    def test_select_lowest_latency(self):
+        self.manager.add_candidate(self.a, 0.5)
+        self.manager.add_candidate(self.b, 0.05)
+        self.manager.add_candidate(self.c)
+        self.assertEqual(self.manager.select(), self.b)
+        self.assertEqual(self.manager.standby, self.a)
+
+    def test_unreliable_candidate_demoted(self):
+        self.manager.add_candidate(self.a, 0.1)
+        self.manager.add_candidate(self.b, 0.15)
+        for _ in range(3):
+            self.manager.record_failure(self.a)
+        self.assertEqual(self.manager.select(), self.b)
+
+    def test_failover_to_standby(self):
+        for addr, rtt in ((self.a, 0.1), (self.b, 0.2), (self.c, 0.3)):
+            self.manager.add_candidate(addr, rtt)
+        self.manager.select()
+        self.assertEqual(self.manager.failover(), self.b)
+        self.assertEqual(self.manager.standby, self.c)
+        self.assertEqual(self.manager.candidates[self.a].failures, 1)
+        self.assertEqual(self.manager.failover(), self.c)
+        self.assertEqual(self.manager.failover(), self.a)
+
+    def test_failover_without_candidates(self):
+        self.manager.add_candidate(self.a, 0.1)
+        self.manager.select()
+        self.assertIsNone(self.manager.failover())
+
+    def test_probe_records_rtt(self):
+        protocol = FakeProtocol()
+        self.manager.add_candidate(self.a)
+        self.manager.add_candidate(self.b)
+        self.manager.probe(protocol, self.a)
+        self.manager.probe(protocol, self.b)
+        self.clock.advance(0.2)
+        protocol.responses[self.a].callback((True, None))
+        protocol.responses[self.b].callback((False, None))
+        self.assertAlmostEqual(self.manager.candidates[self.a].rtt, 0.2)
+        self.assertEqual(self.manager.candidates[self.b].failures, 1)
+
+    def test_background_probing(self):
+        protocol = FakeProtocol()
+        for addr in (self.a, self.b, self.c):
+            self.manager.add_candidate(addr, 0.1)
+        self.manager.select()
+        self.manager.start_probing(protocol, 60)
+        self.clock.advance(60)
+        self.assertEqual(len(protocol.pinged), 3)
+        self.manager.stop_probing()
+        self.clock.advance(60)
+        self.assertEqual(len(protocol.pinged), 3)
+
+    def test_max_candidates(self):
+        manager = RelayManager(max_candidates=2, clock=self.clock)
+        manager.add_candidate(self.a, 0.1)
+        manager.add_candidate(self.b, 0.9)
+        manager.add_candidate(self.c, 0.2)
+        self.assertEqual(sorted(manager.candidates.keys()), [self.a, self.c])
+
+
+class FakeConnection(object):
+    def __init__(self, multiplexer, address):
+        self.multiplexer = multiplexer
+        self.dest_addr = address
+        self.handler = None
+        self.shutdowns = 0
+
+    def unregister(self):
+        del self.multiplexer[self.dest_addr]
+
+    def shutdown(self):
+        self.shutdowns += 1
+        self.handler.handle_shutdown()
+
+
+class FakeMultiplexer(dict):
+    def __init__(self, relay_manager):
+        dict.__init__(self)
+        self.relay_manager = relay_manager
+        self.relay_node = None
+
+
+class FakeSourceNode(object):
+    relay_node = None
+
+
+class FakeRouter(object):
+    buckets = []
+
+
+class FakeProcessor(FakeProtocol):
+    TESTNET = False
+
+    def __init__(self, multiplexer):
+        FakeProtocol.__init__(self)
+        self.multiplexer = multiplexer
+        self.sourceNode = FakeSourceNode()
+        self.router = FakeRouter()
+
+    def __contains__(self, command):
+        return command == PING
+
+    def timeout(self, node):
+        pass
+
+
+class RelayFailoverTest(unittest.TestCase):
+    def setUp(self):
+        self.manager = RelayManager(clock=task.Clock())
+        self.multiplexer = FakeMultiplexer(self.manager)
+        self.processor = FakeProcessor(self.multiplexer)
+        self.a = ("1.1.1.1", 18467)
+        self.b = ("2.2.2.2", 18467)
+        self.c = ("3.3.3.3", 18467)
+        for addr, rtt in ((self.a, 0.1), (self.b, 0.2), (self.c, 0.3)):
+            self.manager.add_candidate(addr, rtt)
+            self._connect(addr)
+        self.processor.sourceNode.relay_node = self.manager.select()
+
+    def _connect(self, address):
+        handler = OpenBazaarProtocol.ConnHandler.__new__(OpenBazaarProtocol.ConnHandler)
+        handler.log = self.manager.log
+        handler.processors = [self.processor]
+        handler.keep_alive_scheduler = None
+        handler.connection_pool = None
+        handler.node = None
+        handler.addr = None
+        handler.relay_node = None
+        handler.connection = self.multiplexer[address] = FakeConnection(self.multiplexer, address)
+        handler.connection.handler = handler
+
+    def test_failover_keeps_standby_connection(self):
+        standby = self.multiplexer[self.b]
+        self.multiplexer[self.a].shutdown()
+
+        self.assertEqual(self.processor.sourceNode.relay_node, self.b)
+        self.assertEqual(self.manager.standby, self.c)
+        self.assertEqual(standby.shutdowns, 0)
+        self.assertIs(self.multiplexer[self.b], standby)
+        self.assertEqual(self.processor.pinged, [self.b])
+        self.assertEqual([self.manager.candidates[addr].failures for addr in (self.a, self.b, self.c)], [1, 0, 0])
+
+    def test_standby_shutdown_does_not_fail_over(self):
+        self.multiplexer[self.b].shutdown()
+        self.assertEqual(self.processor.sourceNode.relay_node, self.a)
+        self.assertEqual(self.manager.candidates[self.b].failures, 0)
+        self.assertEqual(self.processor.pinged, [])
@@ -4,17 +4,21 @@ import socket
 import nacl.signing
 import nacl.hash
 import time
-from config import SEEDS
+from config import SEEDS, MAX_CONNECTIONS
 from dht.node import Node
 from dht.utils import digest
 from interfaces import MessageProcessor, Multiplexer, ConnectionHandler
 from log import Logger
+from net.dispatch import CommandDispatcher
 from net.dos import BanScore
-from protos.message import Message, PING, NOT_FOUND
+from net.holepunch import HolePunchCoordinator
+from net.keepalive import KeepAliveScheduler, IDLE_TIMEOUT, PINGED, CLOSED, KEPT
+from net.pool import ConnectionPool
+from net.relay import RelayManager
+from net.messagebuilder import sender_field
+from protos.message import Message, PING
 from protos.objects import FULL_CONE
-from random import shuffle
 from twisted.internet import task, reactor
-from twisted.internet.task import LoopingCall
 from txrudp.connection import HandlerFactory, Handler, State
 from txrudp.crypto_connection import CryptoConnectionFactory
 from txrudp.rudp import ConnectionMultiplexer
@@ -31,12 +35,14 @@ class OpenBazaarProtocol(ConnectionMultiplexer):
     """
     implements(Multiplexer)
 
-    def __init__(self, db, ip_address, nat_type, testnet=False, relaying=False):
+    def __init__(self, db, ip_address, nat_type, testnet=False, relaying=False, max_connections=MAX_CONNECTIONS):
         """
         Initialize the new protocol with the connection handler factory.
 
         Args:
                 ip_address: a `tuple` of the (ip address, port) of ths node.
+                max_connections: the number of rudp connections to hold open before
+                    evicting the least recently used idle ones.
         """
         self.ip_address = ip_address
         self.testnet = testnet
@@ -46,22 +52,32 @@ class OpenBazaarProtocol(ConnectionMultiplexer):
         self.relay_node = None
         self.nat_type = nat_type
         self.vendors = db.vendors.get_vendors()
+        self.dispatcher = CommandDispatcher(self.processors)
         self.ban_score = BanScore(self)
-        self.factory = self.ConnHandlerFactory(self.processors, nat_type, self.relay_node, self.ban_score)
+        self.keep_alive_scheduler = KeepAliveScheduler()
+        self.connection_pool = ConnectionPool(max_connections)
+        self.relay_manager = RelayManager()
+        self.hole_puncher = HolePunchCoordinator(self)
+        self.factory = self.ConnHandlerFactory(self.processors, nat_type, self.relay_node, self.ban_score,
+                                               self.dispatcher, self.keep_alive_scheduler, self.connection_pool)
         self.log = Logger(system=self)
-        self.keep_alive_loop = LoopingCall(self.keep_alive)
-        self.keep_alive_loop.start(30, now=False)
+        self.keep_alive_scheduler.start()
         ConnectionMultiplexer.__init__(self, CryptoConnectionFactory(self.factory), self.ip_address[0], relaying)
 
     class ConnHandler(Handler):
         implements(ConnectionHandler)
 
-        def __init__(self, processors, nat_type, relay_node, ban_score, *args, **kwargs):
+        def __init__(self, processors, nat_type, relay_node, ban_score, dispatcher=None,
+                     keep_alive_scheduler=None, connection_pool=None, *args, **kwargs):
             super(OpenBazaarProtocol.ConnHandler, self).__init__(*args, **kwargs)
             self.log = Logger(system=self)
             self.processors = processors
+            self.dispatcher = dispatcher if dispatcher is not None else CommandDispatcher(processors)
+            self.keep_alive_scheduler = keep_alive_scheduler
+            self.connection_pool = connection_pool
             self.connection = None
             self.node = None
+            self.sender_bytes = None
             self.relay_node = relay_node
             self.ban_score = ban_score
             self.addr = None
@@ -77,6 +93,11 @@ class OpenBazaarProtocol(ConnectionMultiplexer):
             if self.connection.state == State.CONNECTED:
                 self.addr = str(self.connection.dest_addr[0]) + ":" + str(self.connection.dest_addr[1])
                 self.log.info("connected to %s" % self.addr)
+                if self.processors:
+                    self.processors[0].multiplexer.hole_puncher.connected(
+                        (self.connection.dest_addr[0], self.connection.dest_addr[1]))
+                if self.keep_alive_scheduler is not None:
+                    self.keep_alive_scheduler.add(self)
 
         def receive_message(self, datagram):
             if len(datagram) < 166:
@@ -85,23 +106,28 @@ class OpenBazaarProtocol(ConnectionMultiplexer):
             try:
                 m = Message()
                 m.ParseFromString(datagram)
-                self.node = Node(m.sender.guid,
-                                 m.sender.nodeAddress.ip,
-                                 m.sender.nodeAddress.port,
-                                 m.sender.publicKey,
-                                 None if not m.sender.HasField("relayAddress") else
-                                 (m.sender.relayAddress.ip, m.sender.relayAddress.port),
-                                 m.sender.natType,
-                                 m.sender.vendor)
+                # Peers send the same sender with every message so only build a new
+                # Node when it changes (ex. the peer picked a new relay node).
+                sender = sender_field(datagram)
+                if sender is None or sender != self.sender_bytes or self.node is None:
+                    self.node = Node(m.sender.guid,
+                                     m.sender.nodeAddress.ip,
+                                     m.sender.nodeAddress.port,
+                                     m.sender.publicKey,
+                                     None if not m.sender.HasField("relayAddress") else
+                                     (m.sender.relayAddress.ip, m.sender.relayAddress.port),
+                                     m.sender.natType,
+                                     m.sender.vendor)
+                    self.sender_bytes = sender
                 self.remote_node_version = m.protoVer
                 if self.time_last_message == 0:
                     h = nacl.hash.sha512(m.sender.publicKey)
                     pow_hash = h[40:]
                     if int(pow_hash[:6], 16) >= 50 or m.sender.guid.encode("hex") != h[:40]:
                         raise Exception('Invalid GUID')
-                for processor in self.processors:
-                    if m.command in processor or m.command == NOT_FOUND:
-                        processor.receive_message(m, self.node, self.connection, self.ban_score)
+                if self.connection_pool is not None:
+                    self.connection_pool.touch(self.connection.dest_addr)
+                self.dispatcher.dispatch(m, self.node, self.connection, self.ban_score)
                 if m.command != PING:
                     self.time_last_message = time.time()
             except Exception:
@@ -115,6 +141,11 @@ class OpenBazaarProtocol(ConnectionMultiplexer):
             except Exception:
                 pass
 
+            if self.keep_alive_scheduler is not None:
+                self.keep_alive_scheduler.remove(self)
+            if self.connection_pool is not None:
+                self.connection_pool.remove(self.connection.dest_addr)
+
             if self.node is None:
                 self.node = Node(digest("null"), str(self.connection.dest_addr[0]),
                                  int(self.connection.dest_addr[1]))
@@ -124,7 +155,8 @@ class OpenBazaarProtocol(ConnectionMultiplexer):
             if self.addr:
                 self.log.info("connection with %s terminated" % self.addr)
 
-            if self.relay_node == (self.connection.dest_addr[0], self.connection.dest_addr[1]):
+            address = (self.connection.dest_addr[0], self.connection.dest_addr[1])
+            if self.processors and address in (self.relay_node, self.processors[0].sourceNode.relay_node):
                 self.log.info("Disconnected from relay node. Picking new one...")
                 self.change_relay_node()
 
@@ -133,44 +165,59 @@ class OpenBazaarProtocol(ConnectionMultiplexer):
             Let's check that this node has been active in the last 5 minutes. If not
             and if it's not in our routing table, we don't need to keep the connection
             open. Otherwise PING it to make sure the NAT doesn't drop the mapping.
+
+            Called by the `KeepAliveScheduler` when this connection's deadline comes up.
+            Returns `PINGED`, `CLOSED` or `KEPT`.
             """
             t = time.time()
             router = self.processors[0].router
             if (
                     self.node is not None and
-                    t - self.time_last_message >= 300 and
+                    t - self.time_last_message >= IDLE_TIMEOUT and
                     router.isNewNode(self.node) and
                     self.relay_node != (self.connection.dest_addr[0], self.connection.dest_addr[1])
             ):
                 self.connection.shutdown()
-                return
+                return CLOSED
 
-            if t - self.time_last_message >= self.ping_interval:
+            if self.node is not None and t - self.time_last_message >= self.ping_interval:
                 for processor in self.processors:
-                    if PING in processor and self.node is not None:
+                    if PING in processor:
                         processor.callPing(self.node)
+                return PINGED
+            return KEPT
 
         def change_relay_node(self):
-            potential_relay_nodes = []
-            for bucket in self.processors[0].router.buckets:
-                for node in bucket.nodes.values():
-                    if node.nat_type == FULL_CONE:
-                        potential_relay_nodes.append((node.ip, node.port))
-            if len(potential_relay_nodes) == 0:
+            """
+            Fail over to the standby relay picked by the `RelayManager`. We only scan the
+            routing table (and then the seeds) for candidates if the manager has run out.
+            """
+            failed = (self.connection.dest_addr[0], self.connection.dest_addr[1])
+            relay_manager = self.processors[0].multiplexer.relay_manager
+            if not relay_manager.ranked(exclude=(failed,)):
+                for bucket in self.processors[0].router.buckets:
+                    for node in bucket.nodes.values():
+                        if node.nat_type == FULL_CONE:
+                            relay_manager.add_candidate((node.ip, node.port))
+            if not relay_manager.ranked(exclude=(failed,)):
                 for seed in SEEDS:
                     try:
-                        potential_relay_nodes.append((socket.gethostbyname(seed[0].split(":")[0]),
-                                                      28469 if self.processors[0].TESTNET else 18469))
+                        relay_manager.add_candidate((socket.gethostbyname(seed[0].split(":")[0]),
+                                                     28469 if self.processors[0].TESTNET else 18469))
                     except socket.gaierror:
                         pass
-            shuffle(potential_relay_nodes)
-            self.relay_node = potential_relay_nodes[0]
+            relay_node = relay_manager.failover(failed)
+            if relay_node is None:
+                self.log.warning("no relay nodes available")
+                return
+            self.relay_node = relay_node
+            self.processors[0].multiplexer.relay_node = relay_node
+            self.processors[0].sourceNode.relay_node = relay_node
+            # The standby's connection is usually open already. It's reused rather than shut down, as
+            # shutting it down would look like the new relay disconnecting and fail over again.
             for processor in self.processors:
                 if PING in processor:
-                    if (self.relay_node[0], self.relay_node[1]) in processor.multiplexer:
-                        processor.multiplexer[(self.relay_node[0], self.relay_node[1])].shutdown()
-                    processor.callPing(Node(digest("null"), self.relay_node[0], self.relay_node[1],
-                                            relay_node=None, nat_type=FULL_CONE))
+                    relay_manager.probe(processor, relay_node)
 
         def check_new_connection(self):
             if self.is_new_node:
@@ -181,34 +228,82 @@ class OpenBazaarProtocol(ConnectionMultiplexer):
 
     class ConnHandlerFactory(HandlerFactory):
 
-        def __init__(self, processors, nat_type, relay_node, ban_score):
+        def __init__(self, processors, nat_type, relay_node, ban_score, dispatcher=None,
+                     keep_alive_scheduler=None, connection_pool=None):
             super(OpenBazaarProtocol.ConnHandlerFactory, self).__init__()
             self.processors = processors
             self.nat_type = nat_type
             self.relay_node = relay_node
             self.ban_score = ban_score
+            self.dispatcher = dispatcher
+            self.keep_alive_scheduler = keep_alive_scheduler
+            self.connection_pool = connection_pool
 
         def make_new_handler(self, *args, **kwargs):
-            return OpenBazaarProtocol.ConnHandler(self.processors, self.nat_type, self.relay_node, self.ban_score)
+            return OpenBazaarProtocol.ConnHandler(self.processors, self.nat_type, self.relay_node, self.ban_score,
+                                                  self.dispatcher, self.keep_alive_scheduler, self.connection_pool)
 
     def register_processor(self, processor):
         """Add a new class which implements the `MessageProcessor` interface."""
         if verifyObject(MessageProcessor, processor):
-            self.processors.append(processor)
+            self.dispatcher.register(processor)
 
     def unregister_processor(self, processor):
         """Unregister the given processor."""
-        if processor in self.processors:
-            self.processors.remove(processor)
+        self.dispatcher.unregister(processor)
+
+    def get_dispatch_stats(self):
+        """Returns the per-command receive counts and processing time. See `CommandDispatcher.get_stats`."""
+        return self.dispatcher.get_stats()
 
     def set_servers(self, ws, blockchain):
         self.ws = ws
         self.blockchain = blockchain
 
-    def keep_alive(self):
-        for connection in self.values():
-            if connection.state == State.CONNECTED:
-                connection.handler.keep_alive()
+    def is_protected(self, address, connection):
+        """
+        Connections to our relay node and to nodes in our routing table are never
+        evicted from the connection pool.
+        """
+        if address == self.relay_node or address == connection.handler.relay_node:
+            return True
+        if self.processors:
+            processor = self.processors[0]
+            if address == processor.sourceNode.relay_node:
+                return True
+            node = connection.handler.node
+            if node is not None and not processor.router.isNewNode(node):
+                return True
+        return False
+
+    def make_new_connection(self, own_addr, source_addr, relay_addr=None, outbound=False):
+        # pylint: disable=arguments-differ
+        """
+        Create a new connection, first evicting an idle connection if the pool is full.
+        If the pool is full and nothing can be evicted, incoming connections are refused
+        (`None` is returned, so the multiplexer drops the SYN) but outgoing connections
+        are still made.
+        """
+        if self.connection_pool.is_full(self) and not self.connection_pool.evict(self, self.is_protected):
+            if not outbound:
+                self.connection_pool.refuse()
+                self.log.warning("connection pool full, refusing connection from %s:%s" % source_addr)
+                return None
+        con = ConnectionMultiplexer.make_new_connection(self, own_addr, source_addr, relay_addr)
+        self.connection_pool.touch(source_addr)
+        return con
+
+    def get_connection_stats(self):
+        """Returns the connection count, memory estimate and evictions. See `ConnectionPool.get_stats`."""
+        return self.connection_pool.get_stats(self)
+
+    def get_hole_punch_stats(self):
+        """Returns the hole punch success rate and time to connect. See `HolePunchCoordinator.get_stats`."""
+        return self.hole_puncher.get_stats()
+
+    def get_keep_alive_stats(self):
+        """Returns the number of connections pinged, closed and kept. See `KeepAliveScheduler.get_stats`."""
+        return self.keep_alive_scheduler.get_stats()
 
     def send_message(self, datagram, address, relay_addr):
         """
@@ -222,9 +317,10 @@ class OpenBazaarProtocol(ConnectionMultiplexer):
                 or `None` if no relaying is required.
         """
         if address not in self:
-            con = self.make_new_connection(self.ip_address, address, relay_addr)
+            con = self.make_new_connection(self.ip_address, address, relay_addr, outbound=True)
         else:
             con = self[address]
+            self.connection_pool.touch(address)
         if relay_addr is not None and relay_addr != con.relay_addr and relay_addr != con.own_addr:
             con.set_relay_address(relay_addr)
 
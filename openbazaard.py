@@ -18,6 +18,7 @@ from dht.network import Server
 from dht.node import Node
 from dht.storage import ForgetfulStorage
 from keys.credentials import get_credentials
+from keys.cryptoservice import CryptoService
 from keys.keychain import KeyChain
 from log import Logger, FileLogObserver
 from market import network
@@ -108,6 +109,10 @@ def run(*args):
             kserver.bootstrap(kserver.querySeed(SEED_URLS)).addCallback(on_bootstrap_complete)
         kserver.saveStateRegularly(os.path.join(DATA_FOLDER, 'cache.pickle'), 10)
         protocol.register_processor(kserver.protocol)
+        if nat_type != FULL_CONE:
+            if relay_node is not None:
+                protocol.relay_manager.add_candidate(relay_node)
+            protocol.relay_manager.start_probing(kserver.protocol)
 
         # market
         mserver = network.Server(kserver, keys.signing_key, db, AUDIT)
@@ -171,13 +176,17 @@ def run(*args):
 
         def shutdown():
             logger.info("shutting down server")
-            for vendor in protocol.vendors.values():
-                db.vendors.save_vendor(vendor.id.encode("hex"), vendor.getProto().SerializeToString())
+            db.vendors.save_vendors([(vendor.id.encode("hex"), vendor.getProto().SerializeToString())
+                                     for vendor in protocol.vendors.values()])
             PortMapper().clean_my_mappings(PORT)
             protocol.shutdown()
 
         reactor.addSystemEventTrigger('before', 'shutdown', shutdown)
 
+    # start the crypto workers before anything else so they're forked from a clean process
+    crypto = CryptoService()
+    crypto.start()
+
     # database
     db = Database(TESTNET)
     storage = ForgetfulStorage()
@@ -205,6 +214,7 @@ def run(*args):
 
     btcPrice.closethread()
     btcPrice.join(1)
+    crypto.stop()
 
 if __name__ == "__main__":
 
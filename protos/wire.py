@@ -0,0 +1,48 @@
+__author__ = 'chris'
+"""
+Helpers for writing and reading the protobuf wire format directly, where building
+or parsing the whole message would be wasted work.
+"""
+
+VARINT = 0
+LENGTH_DELIMITED = 2
+
+
+def varint(value):
+    """Encode a non-negative integer as a protobuf base 128 varint."""
+    ret = []
+    bits = value & 0x7f
+    value >>= 7
+    while value:
+        ret.append(chr(0x80 | bits))
+        bits = value & 0x7f
+        value >>= 7
+    ret.append(chr(bits))
+    return "".join(ret)
+
+
+def tag(field_number, wire_type):
+    return varint((field_number << 3) | wire_type)
+
+
+def read_varint(data, pos):
+    """Decode the varint starting at `pos`. Returns the value and the position after it."""
+    value = 0
+    shift = 0
+    while True:
+        b = ord(data[pos])
+        pos += 1
+        value |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return value, pos
+        shift += 7
+
+
+def join_repeated(field_number, serialized):
+    """
+    Returns a serialized message which only has the repeated message field `field_number`
+    set, from the serialized elements. A repeated field serializes as its tagged, length
+    prefixed elements one after another, so nothing needs to be parsed.
+    """
+    field_tag = tag(field_number, LENGTH_DELIMITED)
+    return "".join(field_tag + varint(len(ser)) + ser for ser in serialized)
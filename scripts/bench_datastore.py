@@ -0,0 +1,83 @@
+"""
+Measures the per-call overhead of `db.datastore` with a new sqlite3 connection per
+call (how every store method used to work) against the pooled connections from
+`db.connection`, and saving vendors one call at a time against `save_vendors`.
+
+Run from the repository root:
+    python scripts/bench_datastore.py [iterations]
+"""
+__author__ = 'chris'
+
+import os
+import sqlite3
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from db import connection
+from db.datastore import Database
+
+
+def unpooled_get_file(path, hash_value):
+    conn = sqlite3.connect(path)
+    conn.text_factory = str
+    cursor = conn.cursor()
+    cursor.execute('''SELECT filepath FROM hashmap WHERE hash=?''', (hash_value,))
+    ret = cursor.fetchone()
+    conn.close()
+    return ret
+
+
+def unpooled_save_vendor(path, guid, serialized_node):
+    conn = sqlite3.connect(path)
+    conn.text_factory = str
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute('''INSERT OR REPLACE INTO vendors(guid, serializedNode) VALUES (?,?)''',
+                       (guid, serialized_node))
+        conn.commit()
+    conn.close()
+
+
+def bench(func, iterations):
+    return min(timeit.repeat(func, number=iterations, repeat=3)) / iterations
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    db = Database(filepath=path)
+    hash_value = "87e0555568bf5c7e4debd6645fc3f41e88df6ca8"
+    db.filemap.insert(hash_value, "store/media/" + hash_value)
+    vendors = [(os.urandom(20).encode("hex"), os.urandom(100)) for _ in range(200)]
+
+    print "%d iterations, database in %s" % (iterations, path)
+    print "%-28s %12s %12s %9s" % ("", "before (us)", "after (us)", "speedup")
+
+    old = bench(lambda: unpooled_get_file(path, hash_value), iterations)
+    new = bench(lambda: db.filemap.get_file(hash_value), iterations)
+    print "%-28s %12.1f %12.1f %8.1fx" % ("HashMap.get_file", old * 1e6, new * 1e6, old / new)
+
+    old = bench(lambda: unpooled_save_vendor(path, *vendors[0]), iterations / 10)
+    new = bench(lambda: db.vendors.save_vendor(*vendors[0]), iterations / 10)
+    print "%-28s %12.1f %12.1f %8.1fx" % ("VendorStore.save_vendor", old * 1e6, new * 1e6, old / new)
+
+    def save_each():
+        for guid, node in vendors:
+            unpooled_save_vendor(path, guid, node)
+
+    old = bench(save_each, 1)
+    new = bench(lambda: db.vendors.save_vendors(vendors), 1)
+    print "%-28s %12.1f %12.1f %8.1fx" % ("save %d vendors" % len(vendors), old * 1e6, new * 1e6, old / new)
+
+    connection.close_all()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    os.rmdir(os.path.dirname(path))
+
+
+if __name__ == "__main__":
+    main()
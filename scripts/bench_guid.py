@@ -0,0 +1,41 @@
+"""
+Measures how `keys.guid.GUID.generate_parallel` scales with the number of worker
+processes. The time to find a GUID is random, so the figure that matters is the
+number of keys tried per second.
+
+Run from the repository root:
+    python scripts/bench_guid.py [max_processes] [guids_per_run]
+"""
+__author__ = 'chris'
+
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from keys.guid import GUID, EXPECTED_ATTEMPTS
+
+
+def main():
+    max_processes = int(sys.argv[1]) if len(sys.argv) > 1 else multiprocessing.cpu_count()
+    guids = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    print "expected attempts per GUID: %d" % EXPECTED_ATTEMPTS
+    print "%9s %14s %10s %12s" % ("processes", "keys/s", "speedup", "s/GUID")
+    base = None
+    for processes in range(1, max_processes + 1):
+        total = 0
+        start = time.time()
+        for _ in range(guids):
+            total += GUID.generate_parallel(processes=processes)[1]
+        elapsed = time.time() - start
+        rate = total / elapsed
+        if base is None:
+            base = rate
+        print "%9d %14.0f %9.2fx %12.1f" % (processes, rate, rate / base, EXPECTED_ATTEMPTS / rate)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Compares building a signed `Message` with the protobuf object (the old
+`RPCProtocol._sendResponse` path) against `net.messagebuilder.MessageBuilder`.
+
+Run from the repository root:
+    python scripts/bench_messagebuilder.py [payload_bytes] [iterations]
+"""
+__author__ = 'chris'
+
+import os
+import sys
+import timeit
+from binascii import unhexlify
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import nacl.hash
+import nacl.signing
+from config import PROTOCOL_VERSION
+from dht.node import Node
+from dht.utils import digest
+from net.messagebuilder import MessageBuilder
+from protos.message import Message, GET_IMAGE
+from protos.objects import FULL_CONE
+
+
+def protobuf_path(signing_key, node, msg_id, payload):
+    m = Message()
+    m.messageID = msg_id
+    m.sender.MergeFrom(node.getProto())
+    m.protoVer = PROTOCOL_VERSION
+    m.testnet = False
+    m.command = GET_IMAGE
+    for arg in [payload]:
+        m.arguments.append(str(arg))
+    m.signature = signing_key.sign(m.SerializeToString())[:64]
+    return m.SerializeToString()
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1024 * 1024
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    signing_key = nacl.signing.SigningKey.generate()
+    h = nacl.hash.sha512(signing_key.verify_key.encode())
+    node = Node(unhexlify(h[:40]), "123.45.67.89", 18467, signing_key.verify_key.encode(),
+                None, FULL_CONE, True)
+    builder = MessageBuilder(node)
+    msg_id = digest("bench")
+    payload = os.urandom(size)
+
+    assert protobuf_path(signing_key, node, msg_id, payload) == \
+        builder.build(signing_key, msg_id, GET_IMAGE, [payload])
+
+    old = min(timeit.repeat(lambda: protobuf_path(signing_key, node, msg_id, payload),
+                            number=iterations, repeat=3)) / iterations
+    new = min(timeit.repeat(lambda: builder.build(signing_key, msg_id, GET_IMAGE, [payload]),
+                            number=iterations, repeat=3)) / iterations
+
+    print "payload: %d bytes, %d iterations" % (size, iterations)
+    print "protobuf Message:  %.3f ms/msg" % (old * 1000)
+    print "MessageBuilder:    %.3f ms/msg" % (new * 1000)
+    print "speedup:           %.2fx" % (old / new)
+
+
+if __name__ == "__main__":
+    main()
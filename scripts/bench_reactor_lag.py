@@ -0,0 +1,97 @@
+"""
+Measures how late the reactor runs timed calls while the REST API's conversation
+list (`MessageStore.get_conversations`, a long scan) is loaded over and over,
+first in the reactor thread (as before) and then through `db.deferred`.
+
+Run from the repository root:
+    python scripts/bench_reactor_lag.py [messages] [seconds]
+"""
+__author__ = 'chris'
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from db import connection
+from db.datastore import Database
+from twisted.internet import defer, reactor, task
+
+TICK = 0.005
+
+
+class LagMonitor(object):
+    """Records how late a `TICK` second `LoopingCall` fires."""
+
+    def __init__(self):
+        self.lags = []
+        self.last = None
+        self.loop = task.LoopingCall(self.tick)
+
+    def tick(self):
+        now = time.time()
+        if self.last is not None:
+            self.lags.append(max(0, now - self.last - TICK))
+        self.last = now
+
+    def start(self):
+        self.lags = []
+        self.last = None
+        self.loop.start(TICK)
+
+    def stop(self):
+        self.loop.stop()
+        lags = sorted(self.lags)
+        return lags[-1] * 1000, lags[int(len(lags) * 0.99)] * 1000, sum(lags) / len(lags) * 1000
+
+
+def populate(db, messages):
+    with db.transaction():
+        for i in range(messages):
+            db.messages.save_message("%040d" % (i % 200), "", os.urandom(32), "", "CHAT", "message %d" % i, i,
+                                     os.urandom(20), os.urandom(64), False)
+
+
+@defer.inlineCallbacks
+def run(db, seconds):
+    monitor = LagMonitor()
+    results = []
+    for name, load in (("reactor thread", lambda: defer.succeed(db.messages.get_conversations())),
+                       ("db.deferred", db.deferred.messages.get_conversations)):
+        monitor.start()
+        end = time.time() + seconds
+        loads = 0
+        while time.time() < end:
+            yield load()
+            loads += 1
+            yield task.deferLater(reactor, TICK, lambda: None)
+        results.append((name, loads) + monitor.stop())
+
+    print "%-16s %7s %12s %12s %12s" % ("", "loads", "max (ms)", "p99 (ms)", "mean (ms)")
+    for result in results:
+        print "%-16s %7d %12.1f %12.1f %12.2f" % result
+    reactor.stop()
+
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 3
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    db = Database(filepath=path)
+    populate(db, messages)
+    print "%d messages, reactor lag measured every %d ms" % (messages, TICK * 1000)
+
+    reactor.callWhenRunning(run, db, seconds)
+    reactor.run()
+
+    connection.close_all()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    os.rmdir(os.path.dirname(path))
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,9 @@ else
     exit 1
 fi
 
+# scripts/ isn't a package, so its modules only resolve imports from the repository root
+export PYTHONPATH=".:$PYTHONPATH"
+
 echo '.: Checking python source files...'
 errored=0;
 count=0;